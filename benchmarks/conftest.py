@@ -0,0 +1,53 @@
+"""Fixtures of the benchmark suite
+
+Run with ``pytest benchmarks --scales 1000,10000,100000``. The synthetic
+networks are generated once per scale and session.
+"""
+import pytest
+from threedi_schema import ThreediDatabase
+
+from hydxlib.importer import import_hydx
+from hydxlib.synthetic import generate_hydx
+
+DEFAULT_SCALES = "1000"
+
+
+def pytest_addoption(parser):
+    parser.addoption(
+        "--scales",
+        default=DEFAULT_SCALES,
+        help="Comma separated numbers of nodes of the synthetic networks",
+    )
+
+
+def pytest_generate_tests(metafunc):
+    if "node_count" in metafunc.fixturenames:
+        scales = [int(x) for x in metafunc.config.getoption("scales").split(",")]
+        metafunc.parametrize("node_count", scales, scope="session")
+
+
+@pytest.fixture(scope="session")
+def hydx_path(tmp_path_factory, node_count):
+    path = tmp_path_factory.mktemp(f"hydx_{node_count}")
+    generate_hydx(path, node_count)
+    return path
+
+
+@pytest.fixture(scope="session")
+def hydx(hydx_path):
+    return import_hydx(hydx_path)
+
+
+@pytest.fixture
+def new_threedi_db(tmp_path):
+    """Return a function that creates an empty schematisation and returns its path"""
+    paths = (tmp_path / f"{number}.sqlite" for number in range(1000000))
+
+    def create():
+        path = next(paths)
+        ThreediDatabase(str(path)).schema.upgrade(
+            backup=False, epsg_code_override=28992
+        )
+        return str(path)
+
+    return create
@@ -0,0 +1,56 @@
+"""Benchmarks of the import, conversion and export of synthetic networks
+
+These use the ``benchmark`` fixture of pytest-benchmark.
+"""
+import subprocess
+import sys
+
+from hydxlib.exporter import dry_run_threedi, export_threedi
+from hydxlib.importer import import_hydx
+from hydxlib.sinks import export_geopackage
+from hydxlib.threedi import Threedi
+
+
+def test_import(benchmark, hydx_path, node_count):
+    hydx = benchmark(import_hydx, hydx_path)
+    assert len(hydx.connection_nodes) == node_count
+
+
+def test_conversion(benchmark, hydx, node_count):
+    def convert():
+        threedi = Threedi()
+        threedi.import_hydx(hydx)
+        return threedi
+
+    threedi = benchmark(convert)
+    assert len(threedi.connection_nodes) == node_count
+
+
+def test_dry_run(benchmark, hydx, node_count):
+    commit_counts, _ = benchmark(dry_run_threedi, hydx)
+    assert commit_counts["connection_nodes"] == node_count
+
+
+def test_export_geopackage(benchmark, hydx, node_count, tmp_path):
+    counts = benchmark(export_geopackage, hydx, tmp_path / "out.gpkg")
+    assert counts["connection_nodes"] == node_count
+
+
+def test_export_threedi(benchmark, hydx, node_count, new_threedi_db):
+    # every round writes into a new, empty schematisation
+    threedi = benchmark.pedantic(
+        export_threedi,
+        setup=lambda: ((hydx, new_threedi_db()), {}),
+        rounds=3,
+    )
+    assert len(threedi.connection_nodes) == node_count
+
+
+def test_startup(benchmark):
+    # a new interpreter that imports the command line entry point
+    benchmark.pedantic(
+        subprocess.run,
+        args=([sys.executable, "-c", "import hydxlib.scripts"],),
+        kwargs={"check": True},
+        rounds=5,
+    )
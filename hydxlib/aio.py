@@ -0,0 +1,233 @@
+# -*- coding: utf-8 -*-
+"""asyncio API for the import and export
+
+The csv files are parsed in a process pool and the conversion and database
+writes run in a dedicated thread, so the event loop stays responsive::
+
+    conversion = Conversion(hydx_path, out_path, chunk_size=1000)
+    async for event in conversion:
+        print(event.kind, event.name, event.done, event.total)
+    print(conversion.commit_counts)
+
+The events are:
+
+- ``Event("parsed", csvfilename, files parsed, files to parse)``
+- ``Event("stage", "import" or "export", None, None)`` when a stage is done
+- ``Event("written", export stage or layer, objects written, objects to
+  write)`` after every chunk written by the 3Di exporter or the sink
+
+``conversion.cancel()`` (or cancelling the task iterating the conversion)
+stops the conversion after the current csv file or chunk; iterating then
+raises Cancelled. Like ``resume``, the stages that the exporter already
+committed stay in the schematisation.
+
+The diagnostics and report that are active when the iteration starts
+collect the problems and stages of the conversion.
+"""
+import asyncio
+import contextvars
+import functools
+import logging
+import os
+import threading
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from . import diagnostics
+from .diagnostics import Diagnostics
+from .hydx import Hydx
+from .importer import (
+    check_hydx,
+    get_csvfiles,
+    get_fieldnames,
+    get_selected_csvfiles,
+    parse_csvfile,
+)
+from .report import stage
+from .scripts import convert_hydx
+
+logger = logging.getLogger(__name__)
+
+Event = namedtuple("Event", ["kind", "name", "done", "total"])
+
+
+class Cancelled(Exception):
+    pass
+
+
+def parse_in_process(hydx_path, csvfilename, max_samples=None, fieldnames=None):
+    """Parse one csv file, return (records, diagnostics)
+
+    Without max_samples the diagnostics are logged (by the worker process).
+    """
+    hydx = Hydx()
+    collected = None if max_samples is None else Diagnostics(max_samples)
+    if collected is None:
+        parse_csvfile(hydx, hydx_path, csvfilename, fieldnames)
+    else:
+        with collected.activate():
+            parse_csvfile(hydx, hydx_path, csvfilename, fieldnames)
+    collection_name = Hydx.CSVFILES[csvfilename]["collection_name"]
+    return getattr(hydx, collection_name), collected
+
+
+async def run_in_thread(executor, func, *args, **kwargs):
+    """Run func in the executor with the diagnostics and report of the caller"""
+    context = contextvars.copy_context()
+    return await asyncio.get_running_loop().run_in_executor(
+        executor, functools.partial(context.run, func, *args, **kwargs)
+    )
+
+
+async def import_hydx_async(
+    hydx_path, executor=None, progress=None, cancel=None, collections=None, fields=None
+):
+    """Like import_hydx, parsing the csv files in a process pool
+
+    Args:
+        collections, fields: the selection, see import_hydx
+        executor:           a ProcessPoolExecutor, default: a new one
+        progress (callable): called with an Event after each parsed file
+        cancel (threading.Event): raise Cancelled after the file being parsed
+    """
+    loop = asyncio.get_running_loop()
+    csvfilenames = get_csvfiles(hydx_path, get_selected_csvfiles(collections, fields))
+    active = diagnostics.get_active()
+    max_samples = None if active is None else active.max_samples
+    own_executor = executor is None and csvfilenames
+    if own_executor:
+        executor = ProcessPoolExecutor(min(len(csvfilenames), os.cpu_count() or 1))
+
+    async def parse(csvfilename):
+        return csvfilename, await loop.run_in_executor(
+            executor,
+            parse_in_process,
+            hydx_path,
+            csvfilename,
+            max_samples,
+            get_fieldnames(csvfilename, fields),
+        )
+
+    hydx = Hydx()
+    tasks = [asyncio.ensure_future(parse(x)) for x in csvfilenames]
+    try:
+        with stage("import"):
+            results = {}
+            for done, future in enumerate(asyncio.as_completed(tasks), 1):
+                csvfilename, (records, collected) = await future
+                results[csvfilename] = records
+                if collected is not None:
+                    active.update(collected)
+                if progress is not None:
+                    progress(Event("parsed", csvfilename, done, len(csvfilenames)))
+                if cancel is not None and cancel.is_set():
+                    raise Cancelled()
+            # the same order as import_hydx, whatever the order of completion
+            for csvfilename in csvfilenames:
+                collection_name = Hydx.CSVFILES[csvfilename]["collection_name"]
+                getattr(hydx, collection_name).extend(results[csvfilename])
+            await run_in_thread(None, check_hydx, hydx)
+    finally:
+        for task in tasks:
+            task.cancel()
+        if own_executor:
+            executor.shutdown(wait=False, cancel_futures=True)
+    return hydx
+
+
+async def export_async(
+    hydx, hydx_path, out_path, progress=None, cancel=None, **options
+):
+    """Run convert_hydx for a parsed hydx in a dedicated thread
+
+    Args:
+        progress (callable): called in the event loop with an Event per chunk
+        cancel (threading.Event): raise Cancelled after the chunk being written
+        options:            passed to convert_hydx
+
+    Returns:
+        dict: the number of objects written per type
+    """
+    loop = asyncio.get_running_loop()
+    # set when the awaiting task is cancelled, stops the writer thread
+    stop = threading.Event()
+
+    def report_progress(name, done, total):
+        if stop.is_set():
+            # the event loop may be closed already
+            raise Cancelled()
+        if progress is not None:
+            loop.call_soon_threadsafe(progress, Event("written", name, done, total))
+        if cancel is not None and cancel.is_set():
+            raise Cancelled()
+
+    writer = ThreadPoolExecutor(1, thread_name_prefix="hydxlib-writer")
+    try:
+        return await run_in_thread(
+            writer,
+            convert_hydx,
+            hydx_path,
+            out_path,
+            progress=report_progress,
+            load_hydx=lambda path: hydx,
+            **options,
+        )
+    except asyncio.CancelledError:
+        # the thread stops at its next chunk
+        stop.set()
+        raise
+    finally:
+        writer.shutdown(wait=False)
+
+
+class Conversion:
+    """Import and export one delivery, iterate over it for the progress Events"""
+
+    def __init__(self, hydx_path, out_path, executor=None, **options):
+        self.hydx_path = hydx_path
+        self.out_path = out_path
+        self.executor = executor
+        self.options = options
+        self.commit_counts = None
+        self.cancel_requested = threading.Event()
+
+    def cancel(self):
+        self.cancel_requested.set()
+
+    def __aiter__(self):
+        return self.events()
+
+    async def events(self):
+        events = asyncio.Queue()
+        task = asyncio.ensure_future(self.run(events.put_nowait))
+        try:
+            while True:
+                event = await events.get()
+                if event is None:
+                    break
+                yield event
+            await task
+        finally:
+            if not task.done():
+                self.cancel()
+                task.cancel()
+
+    async def run(self, emit):
+        try:
+            hydx = await import_hydx_async(
+                self.hydx_path, self.executor, emit, self.cancel_requested
+            )
+            emit(Event("stage", "import", None, None))
+            if self.cancel_requested.is_set():
+                raise Cancelled()
+            self.commit_counts = await export_async(
+                hydx,
+                self.hydx_path,
+                self.out_path,
+                emit,
+                self.cancel_requested,
+                **self.options,
+            )
+            emit(Event("stage", "export", None, None))
+        finally:
+            emit(None)
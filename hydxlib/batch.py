@@ -0,0 +1,218 @@
+# -*- coding: utf-8 -*-
+"""Convert many GWSW-hydx deliveries on a pool of worker processes
+
+A manifest lists the deliveries: a csv file with the columns ``hydx_path`` and
+``out_path`` (separated by "," or ";"), or a JSON file with a list of objects
+with these keys or an object mapping hydx paths to output paths. Relative
+paths are relative to the manifest.
+
+Every worker imports the exporter (sqlalchemy, pyproj, threedi-schema) once
+and then converts one delivery after the other. A delivery that fails, even
+one that crashes its worker process, only fails its own job. Every delivery
+gets the log file and the diagnostics csv of ``run-hydxlib`` in its hydx
+directory (or next to its zip archive).
+"""
+import csv
+import json
+import logging
+import os
+import time
+import traceback
+from concurrent.futures import as_completed, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from .diagnostics import Diagnostics, MAX_SAMPLES
+from .sidecars import open_atomic, write_json_atomic
+from .sources import get_log_dir
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_COLUMNS = ("hydx_path", "out_path")
+SUMMARY_COLUMNS = (
+    "hydx_path",
+    "out_path",
+    "status",
+    "duration",
+    "commit_counts",
+    "error",
+)
+
+
+def read_manifest(path):
+    """Return the (hydx_path, out_path) of every job in a csv or JSON manifest"""
+    base_dir = os.path.dirname(os.path.abspath(path))
+    with open(path, newline="") as f:
+        if str(path).lower().endswith(".json"):
+            content = json.load(f)
+            if isinstance(content, dict):
+                jobs = list(content.items())
+            else:
+                jobs = [(x["hydx_path"], x["out_path"]) for x in content]
+        else:
+            dialect = csv.Sniffer().sniff(f.readline(), delimiters=",;")
+            f.seek(0)
+            reader = csv.DictReader(f, dialect=dialect)
+            missing = set(MANIFEST_COLUMNS) - set(reader.fieldnames or ())
+            if missing:
+                raise ValueError(
+                    "The manifest %s misses the columns %s"
+                    % (path, ", ".join(sorted(missing)))
+                )
+            jobs = [(row["hydx_path"], row["out_path"]) for row in reader]
+    return [
+        (os.path.join(base_dir, hydx_path), os.path.join(base_dir, out_path))
+        for hydx_path, out_path in jobs
+    ]
+
+
+def preload(output_format="threedi"):
+    """Import the exporter once per worker process instead of once per job"""
+    if output_format == "threedi":
+        from . import exporter  # noqa: F401
+    else:
+        from . import sinks  # noqa: F401
+
+
+def failed_result(hydx_path, out_path, error=None):
+    return {
+        "hydx_path": hydx_path,
+        "out_path": out_path,
+        "status": "failed",
+        "duration": None,
+        "commit_counts": None,
+        "error": error,
+    }
+
+
+def run_job(hydx_path, out_path, max_samples=MAX_SAMPLES, **options):
+    """Convert one delivery, return its result (never raises)"""
+    from .scripts import convert_hydx
+
+    if not os.path.exists(hydx_path):
+        return failed_result(hydx_path, out_path, "%s does not exist" % hydx_path)
+
+    result = failed_result(hydx_path, out_path)
+    start = time.perf_counter()
+    log_dir = get_log_dir(hydx_path)
+    handler = logging.FileHandler(
+        os.path.join(log_dir, "import_hydx_hydxlib.log"), mode="w"
+    )
+    handler.setLevel(logging.WARNING)
+    handler.setFormatter(logging.Formatter("%(levelname)s: %(message)s"))
+    logging.getLogger("hydxlib").addHandler(handler)
+    diagnostics = Diagnostics(max_samples=max_samples)
+    try:
+        with diagnostics.activate():
+            commit_counts = convert_hydx(hydx_path, out_path, **options)
+        if commit_counts is None:
+            result["error"] = "The export did not finish"
+        else:
+            result["status"] = "ok"
+            result["commit_counts"] = commit_counts
+    except Exception as e:
+        logger.debug(traceback.format_exc())
+        result["error"] = "%s: %s" % (type(e).__name__, e)
+    finally:
+        diagnostics.log_summary(logging.getLogger("hydxlib.scripts"))
+        diagnostics.write_csv(
+            os.path.join(log_dir, "import_hydx_hydxlib.diagnostics.csv")
+        )
+        logging.getLogger("hydxlib").removeHandler(handler)
+        handler.close()
+        result["duration"] = time.perf_counter() - start
+    return result
+
+
+def run_batch(jobs, workers=None, **options):
+    """Convert the (hydx_path, out_path) jobs, return their results in order
+
+    Args:
+        jobs (list):        (hydx_path, out_path) per delivery
+        workers (int):      number of worker processes, default: the cpu count
+        options:            passed to convert_hydx
+    """
+    results = [None] * len(jobs)
+    crashed = _run_pool(jobs, range(len(jobs)), results, workers, options)
+    # a worker that died took the jobs it had queued with it: run those one
+    # at a time, so that only the job that crashes fails
+    for index in crashed:
+        if _run_pool(jobs, [index], results, 1, options):
+            results[index] = failed_result(*jobs[index], "The worker process crashed")
+    return results
+
+
+def _run_pool(jobs, indices, results, workers, options):
+    """Run jobs[indices] into results, return the indices lost to a crash"""
+    crashed = []
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        initializer=preload,
+        initargs=(options.get("output_format", "threedi"),),
+    ) as executor:
+        futures = {
+            executor.submit(run_job, *jobs[index], **options): index
+            for index in indices
+        }
+        for future in as_completed(futures):
+            index = futures[future]
+            try:
+                results[index] = future.result()
+            except BrokenProcessPool:
+                crashed.append(index)
+                continue
+            logger.info(
+                "%s: %s in %.1f s",
+                results[index]["hydx_path"],
+                results[index]["status"],
+                results[index]["duration"],
+            )
+    return sorted(crashed)
+
+
+def format_summary(results):
+    """Return the lines of a plain text table with a row per job"""
+    header = ("hydx_path", "out_path", "status", "time [s]", "counts / error")
+    lines = ["%-40s %-40s %-6s %10s  %s" % header]
+    for result in results:
+        if result["status"] == "ok":
+            details = ", ".join(
+                "%s: %s" % item for item in sorted(result["commit_counts"].items())
+            )
+        else:
+            details = result["error"]
+        lines.append(
+            "%-40s %-40s %-6s %10s  %s"
+            % (
+                result["hydx_path"],
+                result["out_path"],
+                result["status"],
+                "" if result["duration"] is None else "%.1f" % result["duration"],
+                details,
+            )
+        )
+    failed = sum(result["status"] != "ok" for result in results)
+    lines.append("%d of %d deliveries failed" % (failed, len(results)))
+    return lines
+
+
+def write_summary(results, path):
+    """Write the results as JSON or (for other extensions) as csv"""
+    if str(path).lower().endswith(".json"):
+        write_json_atomic(path, results, indent=2)
+        return
+    with open_atomic(path, newline="") as f:
+        writer = csv.writer(f, delimiter=";")
+        writer.writerow(SUMMARY_COLUMNS)
+        for result in results:
+            writer.writerow(
+                [
+                    result["hydx_path"],
+                    result["out_path"],
+                    result["status"],
+                    "" if result["duration"] is None else "%.3f" % result["duration"],
+                    ""
+                    if result["commit_counts"] is None
+                    else json.dumps(result["commit_counts"], sort_keys=True),
+                    result["error"] or "",
+                ]
+            )
@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+"""Benchmark regression gate
+
+A benchmark run generates a synthetic network, imports it and exports it into
+a new schematisation while recording the stages of a Report: parsing each
+file, each conversion step of ``Threedi.import_hydx`` and each write stage of
+``write_threedi_to_db``. The run is repeated and the fastest time per stage
+is kept. One additional run traces the peak memory per stage.
+
+Times are divided by the time of a fixed calibration workload, so that a
+baseline recorded on one machine can be compared with a run on another (or on
+the same, busier) machine. Comparing a run with a baseline returns the stages
+that are slower or use more memory than the tolerances allow.
+"""
+import json
+import logging
+import os
+import tempfile
+import time
+from collections import defaultdict
+
+from . import __version__
+from .importer import import_hydx
+from .report import Report
+from .sidecars import write_json_atomic
+from .synthetic import generate_hydx
+
+logger = logging.getLogger(__name__)
+
+CALIBRATION_SIZE = 200000
+# stages faster than this (in calibration units) are too noisy to compare
+MIN_TIME = 0.5
+# memory increases below this (in bytes) are ignored
+MIN_MEMORY = 1024 * 1024
+
+
+def calibration_workload(size=CALIBRATION_SIZE):
+    """Dictionary, string and sorting work, like the conversion does"""
+    values = {}
+    for i in range(size):
+        values["knp%d" % i] = (i * 7919) % 1000 / 10.0
+    return sorted(values.items(), key=lambda item: item[1])[0]
+
+
+def calibrate(repeat=5):
+    """Return the fastest time in seconds of the calibration workload"""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        calibration_workload()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def create_schematisation(path, epsg_code=28992):
+    from threedi_schema import ThreediDatabase
+
+    ThreediDatabase(str(path)).schema.upgrade(
+        backup=False, epsg_code_override=epsg_code
+    )
+    return str(path)
+
+
+def run_stages(hydx_path, db_path, trace_memory=False):
+    """Import and export once, return the Report"""
+    from .exporter import export_threedi
+
+    report = Report(trace_memory=trace_memory)
+    with report.activate():
+        hydx = import_hydx(hydx_path)
+        export_threedi(hydx, db_path)
+    return report
+
+
+def run_benchmark(node_count=10000, repeat=3, seed=0):
+    """Return the benchmark results of a synthetic network of node_count nodes
+
+    Times are in calibration units, memory peaks in bytes.
+    """
+    calibration = calibrate()
+    times = defaultdict(list)
+    memory_peaks = defaultdict(int)
+    with tempfile.TemporaryDirectory() as work_dir:
+        hydx_path = os.path.join(work_dir, "hydx")
+        generate_hydx(hydx_path, node_count, seed=seed)
+        for run in range(repeat + 1):
+            trace_memory = run == repeat
+            db_path = create_schematisation(os.path.join(work_dir, f"{run}.sqlite"))
+            report = run_stages(hydx_path, db_path, trace_memory=trace_memory)
+            run_times = defaultdict(float)
+            for stage in report.stages:
+                run_times[stage.name] += stage.wall_time
+                if trace_memory:
+                    memory_peaks[stage.name] = max(
+                        memory_peaks[stage.name], stage.memory_peak
+                    )
+            if not trace_memory:
+                for name, wall_time in run_times.items():
+                    times[name].append(wall_time)
+            logger.info("Benchmark run %d of %d done", run + 1, repeat + 1)
+
+    return {
+        "version": __version__,
+        "node_count": node_count,
+        "seed": seed,
+        "calibration": calibration,
+        "stages": {
+            name: {
+                "time": min(stage_times) / calibration,
+                "memory_peak": memory_peaks.get(name),
+            }
+            for name, stage_times in times.items()
+        },
+    }
+
+
+def compare(
+    baseline,
+    result,
+    time_tolerance=0.2,
+    memory_tolerance=0.1,
+    min_time=MIN_TIME,
+    min_memory=MIN_MEMORY,
+):
+    """Return the regressions of result compared to baseline
+
+    A stage regresses if its time or memory peak is more than the tolerance
+    (a fraction) above the baseline. Stages that are too fast or increases in
+    memory that are too small to measure reliably are ignored.
+
+    returns: list of (stage, metric, baseline value, new value)
+    """
+    if (baseline["node_count"], baseline["seed"]) != (
+        result["node_count"],
+        result["seed"],
+    ):
+        raise ValueError(
+            "The baseline is of a network with %d nodes and seed %d"
+            % (baseline["node_count"], baseline["seed"])
+        )
+    regressions = []
+    for name, old in baseline["stages"].items():
+        new = result["stages"].get(name)
+        if new is None:
+            logger.warning("Stage %s of the baseline did not run", name)
+            continue
+        if max(old["time"], new["time"]) >= min_time and new["time"] > old["time"] * (
+            1 + time_tolerance
+        ):
+            regressions.append((name, "time", old["time"], new["time"]))
+        old_memory, new_memory = old.get("memory_peak"), new.get("memory_peak")
+        if (
+            old_memory is not None
+            and new_memory is not None
+            and new_memory - old_memory >= min_memory
+            and new_memory > old_memory * (1 + memory_tolerance)
+        ):
+            regressions.append((name, "memory_peak", old_memory, new_memory))
+    return regressions
+
+
+def load_results(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_results(results, path):
+    write_json_atomic(path, results, indent=2)
+
+
+def format_comparison(baseline, result):
+    """Return the lines of a plain text table comparing result with baseline"""
+    lines = [
+        "%-40s %10s %10s %8s %12s %12s"
+        % ("stage", "base", "new", "ratio", "base [MB]", "new [MB]")
+    ]
+    for name, new in result["stages"].items():
+        old = baseline["stages"].get(name, {})
+        old_time = old.get("time")
+        old_memory = old.get("memory_peak")
+        new_memory = new.get("memory_peak")
+        lines.append(
+            "%-40s %10s %10.3f %8s %12s %12s"
+            % (
+                name,
+                "" if old_time is None else "%.3f" % old_time,
+                new["time"],
+                "%.2f" % (new["time"] / old_time) if old_time else "",
+                "" if old_memory is None else "%.1f" % (old_memory / 1e6),
+                "" if new_memory is None else "%.1f" % (new_memory / 1e6),
+            )
+        )
+    return lines
@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+import os
+
+from .sidecars import read_json_sidecar, write_json_atomic
+
+
+class Checkpoint:
+    """Sidecar file recording which export stages have been committed
+
+    The file is stored next to the schematisation as
+    ``<schematisation>.hydxlib-checkpoint.json``. For every committed stage it
+    holds the commit counts and the range of ids that were inserted per table::
+
+        {"stages": {"pipes": {"commit_counts": {"pipes": 80},
+                              "ids": {"pipe": [1, 80]}}}}
+    """
+
+    SUFFIX = ".hydxlib-checkpoint.json"
+
+    def __init__(self, db_path):
+        self.path = str(db_path) + self.SUFFIX
+
+    def load(self):
+        """Return the recorded stages, empty if there is no (valid) checkpoint"""
+        return read_json_sidecar(self.path, "export checkpoint").get("stages", {})
+
+    def save(self, stage, commit_counts, ids):
+        stages = self.load()
+        stages[stage] = {"commit_counts": commit_counts, "ids": ids}
+        write_json_atomic(self.path, {"stages": stages}, indent=2)
+
+    def clear(self):
+        if os.path.isfile(self.path):
+            os.remove(self.path)
@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+"""Structured diagnostics of the import, conversion and export
+
+Problems with individual records are reported with ``error`` or ``warning``,
+with a code identifying the kind of problem::
+
+    error(logger, "missing-profile", "Verbinding %r has no profile defined", code,
+          record=code)
+
+Without an active Diagnostics collector, the message is simply logged. While a
+collector is active, it counts the diagnostics per code and only keeps the
+first ``max_samples`` of every code (with the record id and, if known, the
+file and line of the record). On large, dirty deliveries this is much cheaper
+than logging every record::
+
+    diagnostics = Diagnostics()
+    with diagnostics.activate():
+        run_import_export(hydx_path, out_path)
+    diagnostics.log_summary(logger)
+    diagnostics.write_csv("diagnostics.csv")
+"""
+import csv
+import logging
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+logger = logging.getLogger(__name__)
+
+MAX_SAMPLES = 10
+
+_active_diagnostics = ContextVar("hydxlib_diagnostics", default=None)
+
+
+class Diagnostic:
+    """The count and the first samples of the diagnostics with one code"""
+
+    def __init__(self, code, level):
+        self.code = code
+        self.level = level
+        self.count = 0
+        self.samples = []
+
+    def as_dict(self):
+        return {
+            "code": self.code,
+            "level": logging.getLevelName(self.level),
+            "count": self.count,
+            "samples": self.samples,
+        }
+
+
+class Diagnostics:
+    """The diagnostics reported while the collector is active, per code
+
+    With max_samples=None, the samples of all diagnostics are kept.
+    """
+
+    CSV_COLUMNS = ("code", "level", "count", "record", "file", "line", "message")
+
+    def __init__(self, max_samples=MAX_SAMPLES):
+        self.max_samples = max_samples
+        self.diagnostics = {}
+
+    @contextmanager
+    def activate(self):
+        token = _active_diagnostics.set(self)
+        try:
+            yield self
+        finally:
+            _active_diagnostics.reset(token)
+
+    def __getitem__(self, code):
+        return self.diagnostics[code]
+
+    def __contains__(self, code):
+        return code in self.diagnostics
+
+    def __len__(self):
+        return len(self.diagnostics)
+
+    def add(self, level, code, message, args, record=None, file=None, line=None):
+        diagnostic = self.diagnostics.get(code)
+        if diagnostic is None:
+            diagnostic = self.diagnostics[code] = Diagnostic(code, level)
+        diagnostic.count += 1
+        if self.max_samples is None or len(diagnostic.samples) < self.max_samples:
+            diagnostic.samples.append(
+                {
+                    "record": record,
+                    "file": file,
+                    "line": line,
+                    "message": message % args if args else message,
+                }
+            )
+
+    def update(self, other):
+        """Add the counts and samples of another Diagnostics instance"""
+        for code, x in other.diagnostics.items():
+            diagnostic = self.diagnostics.get(code)
+            if diagnostic is None:
+                diagnostic = self.diagnostics[code] = Diagnostic(code, x.level)
+            diagnostic.count += x.count
+            if self.max_samples is None:
+                diagnostic.samples.extend(x.samples)
+            else:
+                free = self.max_samples - len(diagnostic.samples)
+                diagnostic.samples.extend(x.samples[: max(free, 0)])
+
+    def counts(self):
+        """Return {code: count}"""
+        return {code: x.count for code, x in self.diagnostics.items()}
+
+    def as_dict(self):
+        return {"diagnostics": [x.as_dict() for x in self.diagnostics.values()]}
+
+    def by_level(self):
+        """Return the Diagnostic instances, errors first"""
+        return sorted(self.diagnostics.values(), key=lambda x: (-x.level, x.code))
+
+    def format(self):
+        """Return the lines of a summary, one per code with its first message"""
+        return [
+            "%s (%d times), e.g.: %s" % (x.code, x.count, x.samples[0]["message"])
+            for x in self.by_level()
+        ]
+
+    def log_summary(self, logger=logger):
+        for x, line in zip(self.by_level(), self.format()):
+            logger.log(x.level, line)
+
+    def write_csv(self, path):
+        """Write the samples as csv, with the total count of their code"""
+        with open(path, "w", newline="") as f:
+            writer = csv.writer(f, delimiter=";")
+            writer.writerow(self.CSV_COLUMNS)
+            for x in self.diagnostics.values():
+                for sample in x.samples:
+                    writer.writerow(
+                        [
+                            x.code,
+                            logging.getLevelName(x.level),
+                            x.count,
+                            sample["record"],
+                            sample["file"],
+                            sample["line"],
+                            sample["message"],
+                        ]
+                    )
+
+
+def get_active():
+    """Return the active Diagnostics collector, None if there is none"""
+    return _active_diagnostics.get()
+
+
+def report(logger, level, code, message, *args, record=None, file=None, line=None):
+    """Add a diagnostic to the active collector, or log it if there is none"""
+    diagnostics = _active_diagnostics.get()
+    if diagnostics is None:
+        logger.log(level, message, *args)
+    else:
+        diagnostics.add(level, code, message, args, record, file, line)
+
+
+def error(logger, code, message, *args, **kwargs):
+    report(logger, logging.ERROR, code, message, *args, **kwargs)
+
+
+def warning(logger, code, message, *args, **kwargs):
+    report(logger, logging.WARNING, code, message, *args, **kwargs)
@@ -0,0 +1,203 @@
+# -*- coding: utf-8 -*-
+"""Compare two GWSW-hydx deliveries
+
+Records are matched per collection on their identification (``UNI_IDE``,
+``PRO_IDE`` or ``VER_IDE``). The n-th record with a certain identification is
+matched with the n-th record with that identification in the other delivery,
+so collections with repeated identifications (surfaces, variations) can be
+compared as well; those records are reported as ``<ide>#<n>``.
+
+Both deliveries are read in a single pass that only keeps a short hash per
+record. Only when records were modified, the old delivery is read a second
+time to find the changed fields of those records.
+"""
+import csv
+import hashlib
+import logging
+from collections import Counter
+
+from .hydx import Hydx
+from .sources import open_source
+
+logger = logging.getLogger(__name__)
+
+KEY_HEADERS = {
+    "Knooppunt.csv": "UNI_IDE",
+    "Kunstwerk.csv": "UNI_IDE",
+    "Verbinding.csv": "UNI_IDE",
+    "Profiel.csv": "PRO_IDE",
+    "Oppervlak.csv": "UNI_IDE",
+    "Debiet.csv": "UNI_IDE",
+    "Verloop.csv": "VER_IDE",
+}
+
+
+class CollectionDiff:
+    """Added, removed and modified records of one collection
+
+    ``modified`` maps a record key to ``{fieldname: (old, new)}``.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.added = []
+        self.removed = []
+        self.modified = {}
+
+    def __bool__(self):
+        return bool(self.added or self.removed or self.modified)
+
+    def __repr__(self):
+        return "<CollectionDiff %s: %d added, %d removed, %d modified>" % (
+            self.name,
+            len(self.added),
+            len(self.removed),
+            len(self.modified),
+        )
+
+
+class HydxDiff:
+    """The differences per collection between two deliveries"""
+
+    def __init__(self, collections):
+        self.collections = collections
+
+    def __bool__(self):
+        return any(self.collections.values())
+
+    def __getitem__(self, name):
+        return self.collections[name]
+
+    def summary(self):
+        """Return (collection, added, removed, modified) rows"""
+        return [
+            (name, len(diff.added), len(diff.removed), len(diff.modified))
+            for name, diff in self.collections.items()
+        ]
+
+
+def convert_value(value, datatype):
+    """Convert a csv value like Generic.import_csvline does, without logging"""
+    if value in (None, "", "null"):
+        return None
+    try:
+        return datatype(value)
+    except ValueError:
+        return None
+
+
+def iter_records(source, csvfilename):
+    """Yield (key, values) for each record of a collection
+
+    ``source`` is a Hydx instance or a directory with hydx csv files. The values
+    are converted to the field types, so that a Hydx instance and a directory
+    can be compared.
+    """
+    hydx_class = Hydx.CSVFILES[csvfilename]["hydx_class"]
+    key_header = KEY_HEADERS[csvfilename]
+    occurrences = Counter()
+
+    if isinstance(source, Hydx):
+        key_field = next(
+            field["fieldname"].lower()
+            for field in hydx_class.FIELDS
+            if field["csvheader"] == key_header
+        )
+        fieldnames = [field["fieldname"].lower() for field in hydx_class.FIELDS]
+        collection = getattr(source, Hydx.CSVFILES[csvfilename]["collection_name"])
+        records = (
+            (
+                getattr(record, key_field, None),
+                tuple(getattr(record, name, None) for name in fieldnames),
+            )
+            for record in collection
+        )
+    else:
+        records = iter_csv_records(source, csvfilename)
+
+    for ide, values in records:
+        occurrence = occurrences[ide]
+        occurrences[ide] += 1
+        yield (ide if occurrence == 0 else f"{ide}#{occurrence}"), values
+
+
+def iter_csv_records(hydx_path, csvfilename):
+    """Yield (ide, values) from a hydx csv file, nothing if it doesn't exist"""
+    hydx_class = Hydx.CSVFILES[csvfilename]["hydx_class"]
+    key_header = KEY_HEADERS[csvfilename]
+    with open_source(hydx_path) as source:
+        if source.find(csvfilename) is None:
+            return
+        with source.open(csvfilename) as csvfile:
+            for line in csv.DictReader(csvfile, delimiter=";"):
+                yield convert_value(line.get(key_header), str), tuple(
+                    convert_value(line.get(field["csvheader"]), field["type"])
+                    for field in hydx_class.FIELDS
+                )
+
+
+def record_hash(values):
+    return hashlib.blake2b(repr(values).encode("utf-8"), digest_size=8).digest()
+
+
+def diff_collection(old, new, csvfilename):
+    hydx_class = Hydx.CSVFILES[csvfilename]["hydx_class"]
+    diff = CollectionDiff(Hydx.CSVFILES[csvfilename]["collection_name"])
+
+    old_hashes = {
+        key: record_hash(values) for key, values in iter_records(old, csvfilename)
+    }
+    new_values = {}
+    for key, values in iter_records(new, csvfilename):
+        old_hash = old_hashes.pop(key, None)
+        if old_hash is None:
+            diff.added.append(key)
+        elif old_hash != record_hash(values):
+            new_values[key] = values
+    # whatever was not matched by the new delivery was removed
+    diff.removed = list(old_hashes)
+
+    if new_values:
+        fieldnames = [field["fieldname"].lower() for field in hydx_class.FIELDS]
+        for key, values in iter_records(old, csvfilename):
+            if key not in new_values:
+                continue
+            diff.modified[key] = {
+                name: (old_value, new_value)
+                for name, old_value, new_value in zip(
+                    fieldnames, values, new_values.pop(key)
+                )
+                if old_value != new_value
+            }
+    return diff
+
+
+def diff_hydx(old, new):
+    """Return the differences between two Hydx instances or hydx directories"""
+    return HydxDiff(
+        {
+            Hydx.CSVFILES[csvfilename]["collection_name"]: diff_collection(
+                old, new, csvfilename
+            )
+            for csvfilename in Hydx.CSVFILES
+        }
+    )
+
+
+def format_diff(diff, details=False):
+    """Return the lines of a plain text report of a HydxDiff"""
+    lines = ["%-18s %8s %8s %8s" % ("collection", "added", "removed", "modified")]
+    lines += ["%-18s %8d %8d %8d" % row for row in diff.summary()]
+    if details:
+        for name, collection_diff in diff.collections.items():
+            for key in collection_diff.added:
+                lines.append(f"+ {name} {key}")
+            for key in collection_diff.removed:
+                lines.append(f"- {name} {key}")
+            for key, fields in collection_diff.modified.items():
+                changes = ", ".join(
+                    f"{field}: {old!r} -> {new!r}"
+                    for field, (old, new) in fields.items()
+                )
+                lines.append(f"~ {name} {key}: {changes}")
+    return lines
@@ -1,14 +1,15 @@
 # -*- coding: utf-8 -*-
 
+import copy
 import logging
-import math
-from functools import lru_cache
+import os
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
 
-from geoalchemy2.shape import to_shape
-from pyproj import Transformer
-from pyproj.crs import CRS
+import numpy as np
 from sqlalchemy import func
-from sqlalchemy.orm import load_only
 from threedi_schema import ThreediDatabase
 from threedi_schema.application.errors import (
     InvalidSRIDException,
@@ -28,68 +29,235 @@ from threedi_schema.domain.models import (
     Weir,
 )
 
+from . import diagnostics
+from .checkpoint import Checkpoint
+from .fingerprint import Fingerprint, fingerprint_threedi
+from .geometry import (
+    get_lines,
+    get_lines_between_rows,
+    get_point_on_surface_coordinates,
+    get_points,
+    get_points_at_rows,
+    get_source_epsg,
+    get_surface_geometries,
+    NodeCoordinates,
+    to_ewkt,
+)
+from .incremental import content_hash, ContentHashes, get_object_values
+from .report import stage as report_stage
+from .staging import staging_database
 from .threedi import Threedi
 
 logger = logging.getLogger(__name__)
 
 
-# Constructing a Transformer takes quite long, so we use caching here. The
-# function is deterministic so this doesn't have any side effects.
-@lru_cache(maxsize=1)
-def get_transformer(source_epsg, target_epsg):
-    return Transformer.from_crs(
-        CRS.from_epsg(source_epsg), CRS.from_epsg(target_epsg), always_xy=True
-    )
+def export_threedi(hydx, threedi_db_settings, **options):
+    """Convert hydx and write it to a schematisation, return the Threedi instance
 
+    See write_threedi_to_db for the options, and convert_and_write for workers.
+    """
+    return convert_and_write(hydx, threedi_db_settings, **options)[0]
 
-def transform(x, y, source_epsg, target_epsg):
-    return get_transformer(source_epsg, target_epsg).transform(x, y)
 
+def convert_and_write(
+    hydx,
+    threedi_db_settings,
+    in_memory=False,
+    chunk_size=None,
+    progress=None,
+    resume=False,
+    incremental=False,
+    source_fingerprint=None,
+    workers=None,
+):
+    """Like export_threedi, but return (Threedi instance, commit counts)
+
+    With workers > 1 the conversion runs in parallel shards, see shards.py.
+    """
+    threedi = Threedi()
+    with report_stage("convert"):
+        threedi.import_hydx(hydx, workers=workers)
+    with report_stage("export"):
+        commit_counts = write_threedi_to_db(
+            threedi,
+            threedi_db_settings,
+            in_memory=in_memory,
+            chunk_size=chunk_size,
+            progress=progress,
+            resume=resume,
+            incremental=incremental,
+            source_fingerprint=source_fingerprint,
+        )
+    logger.info("GWSW-hydx exchange created elements: %r", commit_counts)
+    return threedi, commit_counts
 
-def to_ewkt_point(x, y, srid):
-    return "srid={};POINT ({} {})".format(srid, x, y)
 
+# the Threedi instance shared by the worker processes of export_threedi_many
+_worker_threedi = None
 
-def to_ewkt_linestring(coordinates: tuple[tuple[int, int]], srid: int):
-    "coordinates should be passed in as ((x1, y1), (x2, y2))"
-    coordinates_string = ", ".join((f"{coord[0]} {coord[1]}") for coord in coordinates)
-    return f"SRID={srid};LINESTRING ({coordinates_string})"
 
+def _init_worker(threedi):
+    global _worker_threedi
+    _worker_threedi = threedi
 
-def quote_nullable(x):
-    if x is None:
-        return "NULL"
-    else:
-        return f"'{x}'"
 
+def _write_target(threedi_db_settings, options):
+    start = time.perf_counter()
+    # writing updates the collections in place, so a worker that handles several
+    # targets writes each of them from a fresh copy
+    threedi = copy.deepcopy(_worker_threedi)
+    commit_counts = write_threedi_to_db(threedi, threedi_db_settings, **options)
+    return commit_counts, time.perf_counter() - start
 
-def export_threedi(hydx, threedi_db_settings):
+
+def export_threedi_many(
+    hydx,
+    targets,
+    workers=None,
+    in_memory=False,
+    chunk_size=None,
+    incremental=False,
+):
+    """Export one hydx delivery into several schematisations in parallel
+
+    The delivery is converted once. The result is handed to each worker process
+    once, and every target is written in a worker process with its own
+    coordinate transformation.
+
+    targets (list): schematisation paths (or db settings)
+    workers (int): number of worker processes, by default one per target up to
+                   the number of CPUs
+
+    returns: (list) with per target a dict with the ``target``, its
+             ``commit_counts`` and the ``duration`` of the export in seconds;
+             ``commit_counts`` is None and ``error`` is set if it failed
+    """
     threedi = Threedi()
     threedi.import_hydx(hydx)
-    commit_counts = write_threedi_to_db(threedi, threedi_db_settings)
-    logger.info("GWSW-hydx exchange created elements: %r", commit_counts)
-    return threedi
+    if workers is None:
+        workers = min(len(targets), os.cpu_count() or 1)
+    options = {
+        "in_memory": in_memory,
+        "chunk_size": chunk_size,
+        "incremental": incremental,
+    }
+
+    results = []
+    with ProcessPoolExecutor(
+        max_workers=max(workers, 1), initializer=_init_worker, initargs=(threedi,)
+    ) as executor:
+        futures = [
+            executor.submit(_write_target, target, options) for target in targets
+        ]
+        for target, future in zip(targets, futures):
+            result = {"target": target, "commit_counts": None, "duration": None}
+            try:
+                result["commit_counts"], result["duration"] = future.result()
+            except Exception as e:
+                logger.error("Export to %s failed: %s", target, e)
+                result["error"] = str(e)
+            else:
+                logger.info(
+                    "Exported to %s in %.1f s: %r",
+                    target,
+                    result["duration"],
+                    result["commit_counts"],
+                )
+            results.append(result)
+    return results
+
+
+def dry_run_threedi(hydx, target_epsg=None, chunk_size=None, progress=None):
+    """Run the export of a hydx delivery without a database
+
+    All conversion and export logic runs, except that nothing is inserted. The
+    target EPSG defaults to the EPSG code of the first connection node, so that
+    no coordinates are transformed.
+
+    returns: (dict, list) the commit counts a real export would report and the
+             messages of all diagnostics, which include every skipped record,
+             grouped per diagnostic code
+
+    The diagnostics are also added to the active collector or, without one,
+    logged.
+    """
+    active = diagnostics.get_active()
+    collected = diagnostics.Diagnostics(max_samples=None)
+    try:
+        with collected.activate():
+            threedi = Threedi()
+            threedi.import_hydx(hydx)
+            if target_epsg is None:
+                target_epsg = get_source_epsg(threedi.connection_nodes)
+            writer = DryRunWriter(
+                threedi, target_epsg, chunk_size=chunk_size, progress=progress
+            )
+            commit_counts = writer.write()
+    finally:
+        if active is not None:
+            active.update(collected)
+        else:
+            for x in collected.diagnostics.values():
+                for sample in x.samples:
+                    logger.log(x.level, sample["message"])
+    skip_reasons = [
+        sample["message"]
+        for x in collected.diagnostics.values()
+        for sample in x.samples
+    ]
+    return commit_counts, skip_reasons
 
 
-def write_threedi_to_db(threedi, threedi_db_settings):
+def write_threedi_to_db(
+    threedi,
+    threedi_db_settings,
+    in_memory=False,
+    chunk_size=None,
+    progress=None,
+    resume=False,
+    incremental=False,
+    source_fingerprint=None,
+):
     """
     writes threedi to model database
 
     threedi (dict): dictionary with for each object type a list of objects
+    in_memory (bool): stage the schematisation in an in-memory database and
+                      write it back to disk in one pass when finished
+    chunk_size (int): insert the objects in chunks of this size to bound memory
+                      use; by default each object type is inserted at once
+    progress (callable): called as progress(stage, done, total) after each chunk
+    resume (bool): skip the stages that an earlier, interrupted export into the
+                   same schematisation has committed according to its checkpoint
+    incremental (bool): update the schematisation in place: insert new objects,
+                        update changed ones and delete the ones that are gone
+    source_fingerprint (str): fingerprint of the source files, recorded together
+                              with the fingerprint of the threedi content
+
+    If the schematisation is unchanged since an earlier export of the same
+    content, the recorded commit counts are returned without writing anything.
 
     returns: (dict) with number of objects committed to the database of
              each object type
 
     """
-
-    commit_counts = {}
-
     if isinstance(threedi_db_settings, dict):
         path = threedi_db_settings["db_file"]
     else:
         path = threedi_db_settings
 
+    if resume and incremental:
+        raise ValueError("An incremental export cannot be resumed")
+
     db = ThreediDatabase(path)
+    fingerprint = Fingerprint(db.path)
+    content_fingerprint = fingerprint_threedi(threedi)
+    commit_counts = fingerprint.get_commit_counts(content=content_fingerprint)
+    if commit_counts is not None:
+        logger.info("Schematisation %s is up to date, skipping the export", db.path)
+        return commit_counts
+    fingerprint.clear()
+
     schema = db.schema
     try:
         schema.validate_schema
@@ -103,271 +271,716 @@ def write_threedi_to_db(threedi, threedi_db_settings):
     except InvalidSRIDException:
         logger.error("Cannot find a valid EPSG code for the schema.")
         return
-    session = db.get_session()
-    cross_section_dict = {}
-    for profile in threedi.cross_sections:
-        cross_section_dict[profile["code"]] = {
-            "width": profile["width"],
-            "height": profile["height"],
-            "shape": profile["shape"],
-        }
 
-    connection_node_list = []
-    for connection_node in threedi.connection_nodes:
-        x, y, source_epsg = connection_node["geom"]
-        x, y = transform(x, y, source_epsg, target_epsg)
-        connection_node_list.append(
-            ConnectionNode(
-                display_name=connection_node["display_name"],
-                code=connection_node["code"],
-                storage_area=connection_node["storage_area"],
-                geom=to_ewkt_point(x, y, target_epsg),
-                bottom_level=connection_node["bottom_level"],
-                manhole_surface_level=connection_node["manhole_surface_level"],
-                exchange_type=connection_node["exchange_type"],
-                visualisation=connection_node["visualisation"],
-            )
+    checkpoint = Checkpoint(db.path)
+    if resume:
+        finished_stages = checkpoint.load()
+    else:
+        finished_stages = {}
+        checkpoint.clear()
+
+    if incremental:
+        content_hashes = ContentHashes(db.path)
+        create_writer = partial(
+            IncrementalWriter,
+            threedi,
+            target_epsg=target_epsg,
+            chunk_size=chunk_size,
+            progress=progress,
+            previous_hashes=content_hashes.load(),
+        )
+    else:
+        create_writer = partial(
+            ThreediWriter,
+            threedi,
+            target_epsg=target_epsg,
+            chunk_size=chunk_size,
+            progress=progress,
+            finished_stages=finished_stages,
         )
+        # the export rewrites objects without recording their hashes
+        ContentHashes(db.path).clear()
+
+    if in_memory:
+        # staged stages only reach the file at the very end, so they are not
+        # recorded in the checkpoint
+        with staging_database(db) as staging_db:
+            writer = create_writer(session=staging_db.get_session())
+            commit_counts = writer.write()
+    else:
+        writer = create_writer(
+            session=db.get_session(),
+            checkpoint=None if incremental else checkpoint,
+        )
+        commit_counts = writer.write()
+    checkpoint.clear()
+    if incremental:
+        content_hashes.save(writer.hashes)
+    fingerprint.save(
+        commit_counts, source=source_fingerprint, content=content_fingerprint
+    )
+    return commit_counts
 
-    commit_counts["connection_nodes"] = len(connection_node_list)
-    session.bulk_save_objects(connection_node_list)
-    session.commit()
 
-    connection_node_list = (
-        session.query(ConnectionNode)
-        .options(load_only(ConnectionNode.id, ConnectionNode.code))
-        .order_by(ConnectionNode.id)
-        .all()
+def iter_chunks(items, chunk_size=None):
+    """Yield (start, chunk) slices of items, everything at once without chunk_size"""
+    if not chunk_size:
+        yield 0, items
+        return
+    for start in range(0, len(items), chunk_size):
+        yield start, items[start : start + chunk_size]
+
+
+class ThreediWriter:
+    """Write the collections of a Threedi instance using a database session
+
+    The objects are written stage by stage, see STAGES. Within a stage the
+    collection is processed in chunks of ``chunk_size`` objects: the ORM objects
+    of a chunk are built, inserted and released before the next chunk is built.
+    Every stage is committed separately.
+
+    After each committed stage the counts and inserted id ranges are saved to
+    ``checkpoint``, if given. Stages in ``finished_stages`` (as loaded from a
+    checkpoint) are skipped and their recorded counts are reused.
+    """
+
+    STAGES = (
+        "connection_nodes",
+        "pipes",
+        "pumps",
+        "weirs",
+        "orifices",
+        "outlets",
+        "surfaces",
+        "maps",
     )
-    connection_node_dict = {
-        m.code: {"id": m.id, "geom": m.geom} for m in connection_node_list
+    STAGE_MODELS = {
+        "connection_nodes": (ConnectionNode,),
+        "pipes": (Pipe,),
+        "pumps": (Pump, PumpMap),
+        "weirs": (Weir,),
+        "orifices": (Orifice,),
+        "outlets": (BoundaryCondition1D,),
+        "surfaces": (Surface, DryWeatherFlow),
+        "maps": (SurfaceMap, DryWeatherFlowMap),
     }
-    pipe_list = []
-    for pipe in threedi.pipes:
-        pipe = get_start_and_end_connection_node(pipe, connection_node_dict)
-        pipe = get_cross_section_fields(pipe, cross_section_dict)
-        pipe = get_line_between_nodes(
-            pipe, connection_node_dict, "start_node.code", "end_node.code", target_epsg
+    STAGE_COLLECTIONS = {
+        "connection_nodes": "connection_nodes",
+        "pipes": "pipes",
+        "pumps": "pumps",
+        "weirs": "weirs",
+        "orifices": "orifices",
+        "outlets": "outlets",
+        "surfaces": "impervious_surfaces",
+        "maps": "impervious_surface_maps",
+    }
+
+    def __init__(
+        self,
+        threedi,
+        session,
+        target_epsg,
+        chunk_size=None,
+        progress=None,
+        checkpoint=None,
+        finished_stages=None,
+    ):
+        self.threedi = threedi
+        self.session = session
+        self.target_epsg = target_epsg
+        self.chunk_size = chunk_size
+        self.progress = progress
+        self.checkpoint = checkpoint
+        self.finished_stages = finished_stages or {}
+        self.commit_counts = {}
+        self.stage = None
+        self.cross_section_dict = {
+            profile["code"]: {
+                "width": profile["width"],
+                "height": profile["height"],
+                "shape": profile["shape"],
+            }
+            for profile in threedi.cross_sections
+        }
+        self.node_coordinates = NodeCoordinates(threedi.connection_nodes, target_epsg)
+        self._connection_node_dict = None
+        self.surface_points = {}
+        self.dwf_points = {}
+
+    def write(self):
+        try:
+            for stage in self.STAGES:
+                if stage in self.finished_stages:
+                    logger.info(
+                        "Skipping %s, already exported according to checkpoint", stage
+                    )
+                    self.commit_counts.update(
+                        self.finished_stages[stage]["commit_counts"]
+                    )
+                else:
+                    self.write_stage(stage)
+        finally:
+            self.session.close()
+        return self.commit_counts
+
+    def write_stage(self, stage):
+        counted = set(self.commit_counts)
+        records_in = len(getattr(self.threedi, self.STAGE_COLLECTIONS[stage]))
+        self.stage = stage
+        with report_stage(f"write {stage}", records_in) as writing:
+            self.write_and_commit_stage(stage)
+            counts = [
+                value for key, value in self.commit_counts.items() if key not in counted
+            ]
+            # maps are not counted
+            writing.records_out = sum(counts) if counts else None
+
+    def write_and_commit_stage(self, stage):
+        if self.checkpoint is None:
+            getattr(self, f"write_{stage}")()
+            self.commit(stage)
+            return
+
+        first_ids = self.get_max_ids(stage)
+        counted = set(self.commit_counts)
+        getattr(self, f"write_{stage}")()
+        self.commit(stage)
+        last_ids = self.get_max_ids(stage)
+        self.checkpoint.save(
+            stage,
+            {
+                key: value
+                for key, value in self.commit_counts.items()
+                if key not in counted
+            },
+            {
+                table: [first_ids[table] + 1, last_id]
+                if last_id > first_ids[table]
+                else None
+                for table, last_id in last_ids.items()
+            },
         )
-        # Skip creating object without geometry; error handling is handled by the functions above
-        if pipe["geom"] is None:
-            continue
-        del pipe["start_node.code"]
-        del pipe["end_node.code"]
-        del pipe["cross_section_code"]
-        pipe_list.append(Pipe(**pipe))
-    commit_counts["pipes"] = len(pipe_list)
-    session.bulk_save_objects(pipe_list)
-    session.commit()
-
-    pump_list = []
-    pump_map_list = []
-    commit_counts["pumps"] = 0
-    for pump in threedi.pumps:
-        pump = get_start_and_end_connection_node(pump, connection_node_dict)
-        # breakpoint()
-        pump["connection_node_id"] = pump["connection_node_id_start"]
-        # skip if no connection node is linked
-        if pump["connection_node_id"] is None:
-            continue
-        pump["geom"] = get_node_geom(pump, connection_node_dict, "start_node.code")
-        connection_node_id_start = pump.pop("connection_node_id_start")
-        connection_node_id_end = pump.pop("connection_node_id_end")
-        if connection_node_id_start is not None and (
-            connection_node_id_start == connection_node_id_end
-        ):
-            logger.error(
-                f"Pump {pump['code']} will be skipped because it has same start and end node"
-            )
-            continue
-        del pump["start_node.code"]
-        del pump["end_node.code"]
-        pump_object = Pump(**pump)
-        pump_list.append(pump_object)
-        # without flushing and refreshing at this point there is no pump id to reference in pump_map
-        session.add(pump_object)
-        session.flush()
-        session.refresh(pump_object)
-
-        if connection_node_id_start is not None and connection_node_id_end is not None:
-            pump_map_geom = (
-                session.query(func.ST_AsText(func.MakeLine(ConnectionNode.geom)))
-                .filter(
-                    ConnectionNode.id.in_(
-                        [connection_node_id_start, connection_node_id_end]
+
+    def get_max_ids(self, stage):
+        return {
+            model.__tablename__: self.session.query(func.max(model.id)).scalar() or 0
+            for model in self.STAGE_MODELS[stage]
+        }
+
+    def iter_chunks(self, stage, items):
+        for start, chunk in iter_chunks(items, self.chunk_size):
+            yield start, chunk
+            self.report_progress(stage, start + len(chunk), len(items))
+
+    def report_progress(self, stage, done, total):
+        logger.info("Exported %d of %d %s", done, total, stage)
+        if self.progress is not None:
+            self.progress(stage, done, total)
+
+    def commit(self, stage):
+        with report_stage(f"commit {stage}"):
+            self.session.commit()
+
+    def save(self, objects):
+        with report_stage(f"flush {self.stage}", len(objects)):
+            self.session.bulk_save_objects(objects)
+
+    def save_with_ids(self, objects):
+        """Save objects and set their ids, at the cost of a unit of work flush"""
+        with report_stage(f"flush {self.stage}", len(objects)):
+            self.session.add_all(objects)
+            self.session.flush()
+
+    def query_codes_and_ids(self, model):
+        query = self.session.query(model.code, model.id).order_by(model.id)
+        if self.chunk_size:
+            query = query.yield_per(self.chunk_size)
+        return query
+
+    @property
+    def connection_node_dict(self):
+        if self._connection_node_dict is None:
+            self._connection_node_dict = {
+                code: {"id": id}
+                for code, id in self.query_codes_and_ids(ConnectionNode)
+            }
+        return self._connection_node_dict
+
+    def get_node_points(self, codes):
+        return to_ewkt(
+            get_points_at_rows(
+                self.node_coordinates, self.node_coordinates.lookup(codes)
+            ),
+            self.target_epsg,
+        )
+
+    def write_connection_nodes(self):
+        connection_nodes = self.threedi.connection_nodes
+        for start, chunk in self.iter_chunks("connection_nodes", connection_nodes):
+            xy = self.node_coordinates.xy[start : start + len(chunk)]
+            self.save(
+                [
+                    ConnectionNode(
+                        display_name=connection_node["display_name"],
+                        code=connection_node["code"],
+                        storage_area=connection_node["storage_area"],
+                        geom=geom,
+                        bottom_level=connection_node["bottom_level"],
+                        manhole_surface_level=connection_node["manhole_surface_level"],
+                        exchange_type=connection_node["exchange_type"],
+                        visualisation=connection_node["visualisation"],
+                    )
+                    for connection_node, geom in zip(
+                        chunk, to_ewkt(get_points(xy), self.target_epsg)
                     )
+                ]
+            )
+        self.commit_counts["connection_nodes"] = len(connection_nodes)
+        # the ids of the new nodes are looked up again when needed
+        self._connection_node_dict = None
+
+    def write_connections(self, stage, connections, model):
+        count = 0
+        for _, chunk in self.iter_chunks(stage, connections):
+            get_lines_between_nodes(
+                chunk, self.node_coordinates, "start_node.code", "end_node.code"
+            )
+            objects = []
+            for connection in chunk:
+                connection = get_start_and_end_connection_node(
+                    connection, self.connection_node_dict
                 )
-                .scalar()
+                connection = get_cross_section_fields(
+                    connection, self.cross_section_dict
+                )
+                # Skip creating object without geometry; error handling is handled by the functions above
+                if connection["geom"] is None:
+                    continue
+                del connection["start_node.code"]
+                del connection["end_node.code"]
+                del connection["cross_section_code"]
+                objects.append(model(**connection))
+            self.save(objects)
+            count += len(objects)
+        self.commit_counts[stage] = count
+
+    def write_pipes(self):
+        self.write_connections("pipes", self.threedi.pipes, Pipe)
+
+    def write_weirs(self):
+        self.write_connections("weirs", self.threedi.weirs, Weir)
+
+    def write_orifices(self):
+        self.write_connections("orifices", self.threedi.orifices, Orifice)
+
+    def write_pumps(self):
+        count = 0
+        for _, chunk in self.iter_chunks("pumps", self.threedi.pumps):
+            start_codes = [pump["start_node.code"] for pump in chunk]
+            end_codes = [pump["end_node.code"] for pump in chunk]
+            pump_map_geoms = to_ewkt(
+                get_lines_between_rows(
+                    self.node_coordinates,
+                    self.node_coordinates.lookup(start_codes),
+                    self.node_coordinates.lookup(end_codes),
+                ),
+                self.target_epsg,
             )
-            pump_map_list.append(
-                PumpMap(
-                    pump_id=pump_object.id,
-                    connection_node_id_end=connection_node_id_end,
-                    geom=pump_map_geom,
-                    code=pump["code"],
-                    display_name=pump["display_name"],
+            pumps = []
+            for pump, geom, pump_map_geom in zip(
+                chunk, self.get_node_points(start_codes), pump_map_geoms
+            ):
+                pump = get_start_and_end_connection_node(
+                    pump, self.connection_node_dict
+                )
+                pump["connection_node_id"] = pump["connection_node_id_start"]
+                # skip if no connection node is linked
+                if pump["connection_node_id"] is None:
+                    continue
+                pump["geom"] = geom
+                connection_node_id_start = pump.pop("connection_node_id_start")
+                connection_node_id_end = pump.pop("connection_node_id_end")
+                if connection_node_id_start is not None and (
+                    connection_node_id_start == connection_node_id_end
+                ):
+                    diagnostics.error(
+                        logger,
+                        "pump-same-start-and-end-node",
+                        "Pump %s will be skipped because it has same start and end node",
+                        pump["code"],
+                        record=pump["code"],
+                    )
+                    continue
+                del pump["start_node.code"]
+                del pump["end_node.code"]
+                pumps.append(
+                    (pump, Pump(**pump), connection_node_id_end, pump_map_geom)
                 )
+
+            # without ids at this point there is no pump id to reference in pump_map
+            self.save_with_ids([pump_object for _, pump_object, _, _ in pumps])
+            self.save(
+                [
+                    PumpMap(
+                        pump_id=pump_object.id,
+                        connection_node_id_end=connection_node_id_end,
+                        geom=pump_map_geom,
+                        code=pump["code"],
+                        display_name=pump["display_name"],
+                    )
+                    for pump, pump_object, connection_node_id_end, pump_map_geom in pumps
+                    if connection_node_id_end is not None
+                ]
             )
+            count += len(pumps)
+        self.commit_counts["pumps"] = count
 
-        commit_counts["pumps"] += 1
+    def write_outlets(self):
+        # Outlets (must be saved after weirs, orifice, pumpstation, etc.
+        # because of constraints) TO DO: bounds aan meerdere leidingen overslaan
+        count = 0
+        for _, chunk in self.iter_chunks("outlets", self.threedi.outlets):
+            objects = []
+            for outlet, geom in zip(
+                chunk,
+                self.get_node_points([outlet["node.code"] for outlet in chunk]),
+            ):
+                if outlet["node.code"] in self.connection_node_dict:
+                    outlet["connection_node_id"] = self.connection_node_dict[
+                        outlet["node.code"]
+                    ]["id"]
+                    outlet["geom"] = geom
+                else:
+                    outlet["connection_node_id"] = None
+                    diagnostics.error(
+                        logger,
+                        "missing-outlet-node",
+                        "Node of outlet not found in connection nodes",
+                        record=outlet["node.code"],
+                    )
+                    continue
+                del outlet["node.code"]
+                outlet["time_units"] = "minutes"
+                outlet["interpolate"] = 1
+                objects.append(BoundaryCondition1D(**outlet))
+            self.save(objects)
+            count += len(objects)
+        self.commit_counts["outlets"] = count
 
-    if len(pump_map_list) > 0:
-        session.bulk_save_objects(pump_map_list)
-    session.commit()
+    def get_surface_geometries(self, surfaces):
+        return get_surface_geometries(self.node_coordinates, surfaces)
 
-    weir_list = []
-    for weir in threedi.weirs:
-        weir = get_start_and_end_connection_node(weir, connection_node_dict)
-        weir = get_cross_section_fields(weir, cross_section_dict)
-        weir = get_line_between_nodes(
-            weir, connection_node_dict, "start_node.code", "end_node.code", target_epsg
-        )
-        if weir["geom"] is None:
-            continue
-        del weir["start_node.code"]
-        del weir["end_node.code"]
-        del weir["cross_section_code"]
-        weir_list.append(Weir(**weir))
-    commit_counts["weirs"] = len(weir_list)
-    session.bulk_save_objects(weir_list)
-    session.commit()
-
-    orifice_list = []
-    for orifice in threedi.orifices:
-        orifice = get_start_and_end_connection_node(orifice, connection_node_dict)
-        orifice = get_cross_section_fields(orifice, cross_section_dict)
-        orifice = get_line_between_nodes(
-            orifice,
-            connection_node_dict,
-            "start_node.code",
-            "end_node.code",
-            target_epsg,
-        )
-        if orifice["geom"] is None:
-            continue
-        del orifice["start_node.code"]
-        del orifice["end_node.code"]
-        del orifice["cross_section_code"]
-        orifice_list.append(Orifice(**orifice))
-    commit_counts["orifices"] = len(orifice_list)
-    session.bulk_save_objects(orifice_list)
-    session.commit()
-
-    # Outlets (must be saved after weirs, orifice, pumpstation, etc.
-    # because of constraints) TO DO: bounds aan meerdere leidingen overslaan
-    outlet_list = []
-    for outlet in threedi.outlets:
-        if outlet["node.code"] in connection_node_dict:
-            outlet["connection_node_id"] = connection_node_dict[outlet["node.code"]][
-                "id"
-            ]
-            outlet["geom"] = get_node_geom(outlet, connection_node_dict, "node.code")
-        else:
-            outlet["connection_node_id"] = None
-            logger.error("Node of outlet not found in connection nodes")
-            continue
-        del outlet["node.code"]
-        outlet["time_units"] = "minutes"
-        outlet["interpolate"] = 1
-        outlet_list.append(BoundaryCondition1D(**outlet))
-
-    commit_counts["outlets"] = len(outlet_list)
-    session.bulk_save_objects(outlet_list)
-    session.commit()
-
-    # 0d inflow
-    surf_list = []
-    dwf_list = []
-    for surface in threedi.impervious_surfaces:
-        surface["surface_parameters_id"] = get_surface_parameters_id(
-            surface_class=surface.pop("surface_class", None),
-            surface_inclination=surface.pop("surface_inclination", None),
-        )
-        if surface["surface_parameters_id"] is None:
-            logger.error("surface parameter id not found for surface")
-        connection_node = connection_node_dict.get(surface["node.code"], None)
-        if connection_node is None:
-            logger.error(f"node not found for surface {surface['code']}")
-        node_geom = connection_node["geom"]
-        if surface["area"] > 0:
-            side_length = math.sqrt(surface["area"])
-            node_x = session.query(func.ST_X(node_geom)).scalar()
-            node_y = session.query(func.ST_Y(node_geom)).scalar()
-            surface[
-                "geom"
-            ] = f"""
-                srid={target_epsg};POLYGON(({node_x - side_length / 2} {node_y - side_length / 2},
-                         {node_x + side_length / 2} {node_y - side_length / 2},
-                         {node_x + side_length / 2} {node_y + side_length / 2},
-                         {node_x - side_length / 2} {node_y + side_length / 2},
-                         {node_x - side_length / 2} {node_y - side_length / 2}
-                         ))"""
-        dwf = {
-            "code": surface["code"],
-            "display_name": surface["display_name"],
-            "daily_total": surface.pop("dry_weather_flow", None),
-            "multiplier": surface.pop("nr_of_inhabitants", None),
-        }
-        dwf["geom"] = (
-            session.query(func.ST_AsText(func.ST_Buffer(ConnectionNode.geom, 1)))
-            .filter(
-                ConnectionNode.id == connection_node_dict[surface["node.code"]]["id"]
+    def collect_surface_points(self):
+        """Fill surface_points and dwf_points without writing the surfaces
+
+        Used when resuming an export of which the surfaces were already written.
+        """
+        for _, chunk in iter_chunks(self.threedi.impervious_surfaces, self.chunk_size):
+            found, squares, buffers = self.get_surface_geometries(chunk)
+            for surface, is_found, square_xy, buffer_xy in zip(
+                chunk,
+                found.tolist(),
+                get_point_on_surface_coordinates(squares).tolist(),
+                get_point_on_surface_coordinates(buffers).tolist(),
+            ):
+                if not is_found:
+                    continue
+                if surface["area"] != 0:
+                    self.surface_points[surface["code"]] = square_xy
+                if (
+                    surface.get("dry_weather_flow") is not None
+                    and surface.get("nr_of_inhabitants") is not None
+                ):
+                    self.dwf_points[surface["code"]] = buffer_xy
+
+    def write_surfaces(self):
+        # 0d inflow
+        surface_count = 0
+        dwf_count = 0
+        for _, chunk in self.iter_chunks("surfaces", self.threedi.impervious_surfaces):
+            found, squares, buffers = self.get_surface_geometries(chunk)
+            surfaces = []
+            dwfs = []
+            for surface, is_found, square, square_xy, buffer, buffer_xy in zip(
+                chunk,
+                found.tolist(),
+                to_ewkt(squares, self.target_epsg),
+                get_point_on_surface_coordinates(squares).tolist(),
+                to_ewkt(buffers, self.target_epsg),
+                get_point_on_surface_coordinates(buffers).tolist(),
+            ):
+                surface["surface_parameters_id"] = get_surface_parameters_id(
+                    surface_class=surface.pop("surface_class", None),
+                    surface_inclination=surface.pop("surface_inclination", None),
+                )
+                if surface["surface_parameters_id"] is None:
+                    diagnostics.error(
+                        logger,
+                        "missing-surface-parameters",
+                        "surface parameter id not found for surface",
+                        record=surface["code"],
+                    )
+                if not is_found:
+                    diagnostics.error(
+                        logger,
+                        "missing-surface-node",
+                        "node not found for surface %s",
+                        surface["code"],
+                        record=surface["code"],
+                    )
+                    continue
+                if square is not None:
+                    surface["geom"] = square
+                dwf = {
+                    "code": surface["code"],
+                    "display_name": surface["display_name"],
+                    "daily_total": surface.pop("dry_weather_flow", None),
+                    "multiplier": surface.pop("nr_of_inhabitants", None),
+                    "geom": buffer,
+                }
+                surface.pop("node.code", None)
+                if surface["area"] != 0:
+                    surfaces.append(Surface(**surface))
+                    self.surface_points[surface["code"]] = square_xy
+                if dwf["daily_total"] is not None and dwf["multiplier"] is not None:
+                    dwfs.append(DryWeatherFlow(**dwf))
+                    self.dwf_points[dwf["code"]] = buffer_xy
+            self.save(surfaces)
+            self.save(dwfs)
+            surface_count += len(surfaces)
+            dwf_count += len(dwfs)
+        self.commit_counts["surfaces"] = surface_count
+        self.commit_counts["dry_weather_flows"] = dwf_count
+
+    def write_maps(self):
+        if "surfaces" in self.finished_stages:
+            self.collect_surface_points()
+        for obj_name, obj, map_obj, obj_points in [
+            ("surface", Surface, SurfaceMap, self.surface_points),
+            ("dry_weather_flow", DryWeatherFlow, DryWeatherFlowMap, self.dwf_points),
+        ]:
+            obj_map = {code: id for code, id in self.query_codes_and_ids(obj)}
+            for _, chunk in self.iter_chunks(
+                f"{obj_name}_maps", self.threedi.impervious_surface_maps
+            ):
+                items = []
+                for imp_map in chunk:
+                    if imp_map["imp_surface.code"] not in obj_map:
+                        continue
+                    if imp_map["imp_surface.code"] not in obj_points:
+                        continue
+                    item = copy.copy(imp_map)
+                    item[f"{obj_name}_id"] = obj_map[item["imp_surface.code"]]
+                    item["connection_node_id"] = self.connection_node_dict[
+                        item["node.code"]
+                    ]["id"]
+                    items.append(item)
+                obj_xy = np.array(
+                    [obj_points[item["imp_surface.code"]] for item in items],
+                    dtype=np.float64,
+                ).reshape(-1, 2)
+                node_xy = self.node_coordinates.xy[
+                    self.node_coordinates.lookup([item["node.code"] for item in items])
+                ]
+                # a map line needs two distinct points
+                obj_xy[(obj_xy == node_xy).all(axis=1), 1] += 1
+                map_list = []
+                for item, geom in zip(
+                    items, to_ewkt(get_lines(obj_xy, node_xy), self.target_epsg)
+                ):
+                    item["geom"] = geom
+                    del item["node.code"]
+                    del item["imp_surface.code"]
+                    map_list.append(map_obj(**item))
+                self.save(map_list)
+
+
+class IncrementalWriter(ThreediWriter):
+    """Write only the objects that changed since the previous export
+
+    Objects are matched with the rows in the schematisation on their key (see
+    KEYS), which are read in bulk per table. A matched row keeps its id, so
+    foreign keys stay valid. It is updated only if the content hash of the new
+    object differs from the hash recorded by the previous export. Unmatched
+    objects are inserted and rows that are not matched by any object are deleted
+    at the end, children before parents.
+
+    The new hashes are available as ``hashes`` after writing, and the number of
+    inserted, updated, unchanged and deleted rows per table as ``changes``.
+    """
+
+    KEYS = {
+        ConnectionNode: "code",
+        Pipe: "code",
+        Pump: "code",
+        PumpMap: "pump_id",
+        Weir: "code",
+        Orifice: "code",
+        BoundaryCondition1D: "connection_node_id",
+        Surface: "code",
+        DryWeatherFlow: "code",
+        SurfaceMap: "surface_id",
+        DryWeatherFlowMap: "dry_weather_flow_id",
+    }
+    # the maximum number of ids in one "DELETE ... WHERE id IN (...)"
+    DELETE_BATCH_SIZE = 500
+
+    def __init__(self, *args, previous_hashes=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.previous_hashes = previous_hashes or {}
+        self.hashes = {}
+        self.changes = {}
+        self.existing_ids = {}
+        self.matches = {}
+        self.kept_ids = {}
+
+    def write(self):
+        try:
+            for stage in self.STAGES:
+                self.write_stage(stage)
+            with report_stage("delete unmatched"):
+                for stage in reversed(self.STAGES):
+                    for model in reversed(self.STAGE_MODELS[stage]):
+                        self.delete_unmatched(model)
+                self.session.commit()
+        finally:
+            self.session.close()
+        for table, changes in self.changes.items():
+            logger.info("Incremental export of %s: %r", table, changes)
+        return self.commit_counts
+
+    def get_existing_ids(self, model):
+        """Return {key: [id, ...]} of the rows already in the schematisation"""
+        if model not in self.existing_ids:
+            key_column = getattr(model, self.KEYS[model])
+            query = self.session.query(key_column, model.id).order_by(model.id)
+            if self.chunk_size:
+                query = query.yield_per(self.chunk_size)
+            existing_ids = {}
+            for key, id in query:
+                existing_ids.setdefault(str(key), []).append(id)
+            self.existing_ids[model] = existing_ids
+            self.matches[model] = Counter()
+            self.kept_ids[model] = set()
+            self.hashes[model.__tablename__] = {}
+            self.changes[model.__tablename__] = dict.fromkeys(
+                ("inserted", "updated", "unchanged", "deleted"), 0
             )
-            .scalar()
-        )
-        surface.pop("node.code", None)
-        if surface["area"] != 0:
-            surf_list.append(Surface(**surface))
-        if dwf["daily_total"] is not None and dwf["multiplier"] is not None:
-            dwf_list.append(DryWeatherFlow(**dwf))
-    commit_counts["surfaces"] = len(surf_list)
-    commit_counts["dry_weather_flows"] = len(dwf_list)
-    session.bulk_save_objects(surf_list)
-    session.bulk_save_objects(dwf_list)
-    session.commit()
-
-    for obj_name, obj, map_obj in [
-        ("surface", Surface, SurfaceMap),
-        ("dry_weather_flow", DryWeatherFlow, DryWeatherFlowMap),
-    ]:
-        obj_list = (
-            session.query(obj)
-            .options(load_only(obj.id, obj.code))
-            .order_by(obj.id)
-            .all()
-        )
-        obj_map = {m.code: m.id for m in obj_list}
-        map_list = []
-        for imp_map in threedi.impervious_surface_maps:
-            import copy
+        return self.existing_ids[model]
 
-            item = copy.copy(imp_map)
-            if not item["imp_surface.code"] in obj_map:
+    def split_changes(self, objects):
+        """Sort objects into new objects and update mappings, per model
+
+        The n-th object with a certain key is matched with the n-th row with that
+        key, so that duplicate keys are matched one to one. Matched objects get
+        the id of their row.
+        """
+        new = []
+        updates = {}
+        for obj in objects:
+            model = type(obj)
+            table = model.__tablename__
+            key = str(getattr(obj, self.KEYS[model]))
+            existing_ids = self.get_existing_ids(model).get(key, [])
+            occurrence = self.matches[model][key]
+            self.matches[model][key] += 1
+            if occurrence > 0:
+                key = f"{key}#{occurrence}"
+            values = get_object_values(obj)
+            digest = content_hash(values)
+            self.hashes[table][key] = digest
+            if occurrence >= len(existing_ids):
+                new.append(obj)
+                self.changes[table]["inserted"] += 1
                 continue
-            item[f"{obj_name}_id"] = obj_map[item["imp_surface.code"]]
-            item["connection_node_id"] = connection_node_dict[item["node.code"]]["id"]
-            node_geom = connection_node_dict[item["node.code"]]["geom"]
-            node_x = session.query(func.ST_X(node_geom)).scalar()
-            node_y = session.query(func.ST_Y(node_geom)).scalar()
-            obj_geom = (
-                session.query(func.PointOnSurface(obj.geom))
-                .filter(obj.id == item[f"{obj_name}_id"])
-                .scalar()
+            obj.id = existing_ids[occurrence]
+            self.kept_ids[model].add(obj.id)
+            if self.previous_hashes.get(table, {}).get(key) == digest:
+                self.changes[table]["unchanged"] += 1
+            else:
+                updates.setdefault(model, []).append({"id": obj.id, **values})
+                self.changes[table]["updated"] += 1
+        return new, updates
+
+    def save(self, objects):
+        new, updates = self.split_changes(objects)
+        with report_stage(f"flush {self.stage}", len(objects)):
+            self.session.bulk_save_objects(new)
+            for model, mappings in updates.items():
+                self.session.bulk_update_mappings(model, mappings)
+
+    def save_with_ids(self, objects):
+        new, updates = self.split_changes(objects)
+        with report_stage(f"flush {self.stage}", len(objects)):
+            self.session.add_all(new)
+            self.session.flush()
+            for model, mappings in updates.items():
+                self.session.bulk_update_mappings(model, mappings)
+
+    def delete_unmatched(self, model):
+        kept_ids = self.kept_ids.get(model, set())
+        unmatched = [
+            id
+            for ids in self.get_existing_ids(model).values()
+            for id in ids
+            if id not in kept_ids
+        ]
+        for start in range(0, len(unmatched), self.DELETE_BATCH_SIZE):
+            batch = unmatched[start : start + self.DELETE_BATCH_SIZE]
+            self.session.query(model).filter(model.id.in_(batch)).delete(
+                synchronize_session=False
             )
-            obj_x = session.query(func.ST_X(obj_geom)).scalar()
-            obj_y = session.query(func.ST_Y(obj_geom)).scalar()
-            if obj_x == node_x and obj_y == node_y:
-                obj_y += 1
-            item[
-                "geom"
-            ] = f"srid={target_epsg};LINESTRING({obj_x} {obj_y}, {node_x} {node_y})"
-            del item["node.code"]
-            del item["imp_surface.code"]
-            map_list.append(map_obj(**item))
-        session.bulk_save_objects(map_list)
-        session.commit()
+        self.changes[model.__tablename__]["deleted"] = len(unmatched)
 
-    return commit_counts
+
+class DryRunWriter(ThreediWriter):
+    """Run all export stages without a database
+
+    Objects are built as in a real export, but instead of being saved they get
+    consecutive ids per table, which are used wherever the real writer queries
+    the database.
+    """
+
+    def __init__(self, threedi, target_epsg, chunk_size=None, progress=None):
+        super().__init__(
+            threedi, None, target_epsg, chunk_size=chunk_size, progress=progress
+        )
+        self.last_ids = Counter()
+        self.codes_and_ids = {}
+
+    def write(self):
+        for stage in self.STAGES:
+            self.write_stage(stage)
+        return self.commit_counts
+
+    def write_and_commit_stage(self, stage):
+        getattr(self, f"write_{stage}")()
+
+    def save(self, objects):
+        for obj in objects:
+            model = type(obj)
+            self.last_ids[model] += 1
+            obj.id = self.last_ids[model]
+            if hasattr(model, "code"):
+                self.codes_and_ids.setdefault(model, []).append((obj.code, obj.id))
+
+    def save_with_ids(self, objects):
+        self.save(objects)
+
+    def query_codes_and_ids(self, model):
+        return self.codes_and_ids.get(model, [])
+
+    def write_surfaces(self):
+        for surface in self.threedi.impervious_surfaces:
+            if surface["area"] == 0:
+                diagnostics.warning(
+                    logger,
+                    "surface-without-area",
+                    "Surface %s has no area, no surface is created for it",
+                    surface["code"],
+                    record=surface["code"],
+                )
+        super().write_surfaces()
 
 
 def get_surface_parameters_id(surface_class, surface_inclination):
@@ -395,8 +1008,13 @@ def get_connection_node(connection, connection_node_dict, node_key):
     if connection[node_key] in connection_node_dict:
         return connection_node_dict[connection[node_key]]["id"]
     else:
-        logger.error(
-            f"{node_key} of connection {connection['code']} not found in connection nodes",
+        diagnostics.error(
+            logger,
+            "missing-connection-node",
+            "%s of connection %s not found in connection nodes",
+            node_key,
+            connection["code"],
+            record=connection["code"],
         )
         return None
 
@@ -438,44 +1056,36 @@ def get_cross_section_fields(connection, cross_section_dict):
             connection["cross_section_width"] = profile["width"]
             connection["cross_section_height"] = profile["height"]
     else:
-        logger.error(
+        diagnostics.error(
+            logger,
+            "missing-cross-section",
             "Cross section definition of connection %r is not found in cross section definitions",
             connection["code"],
+            record=connection["code"],
         )
 
     return connection
 
 
-def get_node_geom(connection, connection_node_dict, node_key):
-    node_id = connection[node_key]
-    if node_id in connection_node_dict:
-        return connection_node_dict[node_id]["geom"]
-    else:
-        logger.error(
-            f'Node {node_key} of connection {connection["code"]} not found in connection nodes'
-        )
-        return None
-
+def get_lines_between_nodes(connections, node_coordinates, start_key, end_key):
+    """Set the linestring between the start and end node as geom of all connections
 
-def get_line_between_nodes(
-    connection, connection_node_dict, start_key, end_key, target_epsg
-):
-    start_node_geom = get_node_geom(connection, connection_node_dict, start_key)
-    end_node_geom = get_node_geom(connection, connection_node_dict, end_key)
-    if start_node_geom and end_node_geom:
-        start_node_geom = to_shape(start_node_geom)
-        end_node_geom = to_shape(end_node_geom)
-        geom = to_ewkt_linestring(
-            coordinates=(
-                (start_node_geom.x, start_node_geom.y),
-                (end_node_geom.x, end_node_geom.y),
-            ),
-            srid=target_epsg,
-        )
-    else:
-        logger.error(
-            f'Cannot calculate geom for connection {connection["code"]} without start and end node'
-        )
-        geom = None
-    connection["geom"] = geom
-    return connection
+    The lines are built in one go from the in-memory node coordinates. Connections
+    with a missing start or end node get geom None.
+    """
+    lines = get_lines_between_rows(
+        node_coordinates,
+        node_coordinates.lookup([connection[start_key] for connection in connections]),
+        node_coordinates.lookup([connection[end_key] for connection in connections]),
+    )
+    for connection, geom in zip(connections, to_ewkt(lines, node_coordinates.srid)):
+        if geom is None:
+            diagnostics.error(
+                logger,
+                "missing-connection-geometry",
+                "Cannot calculate geom for connection %s without start and end node",
+                connection["code"],
+                record=connection["code"],
+            )
+        connection["geom"] = geom
+    return connections
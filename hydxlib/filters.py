@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+"""Import a part of a delivery: the nodes in a bounding box or sewerage system
+
+A NodeFilter selects the connection nodes (``Knooppunt.csv``) in a bounding
+box and/or with certain ``RST_IDE`` while the file is read. The selected nodes
+then select the rest of the network, before records are created:
+
+- connections (``Verbinding.csv``) between two selected nodes;
+- structures, surfaces and discharges (``Kunstwerk.csv``, ``Oppervlak.csv``,
+  ``Debiet.csv``) of a selected node or connection;
+- profiles (``Profiel.csv``) of the selected connections and variations
+  (``Verloop.csv``) of the selected discharges. If the connections or
+  discharges are not imported, all profiles or variations are kept.
+
+So the files have to be read in the order of ``NodeFilter.CSVFILES``. A
+NodeFilter keeps the selection of one import; it is reset when the next
+import starts, so a filter can be reused.
+"""
+
+
+def to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class NodeFilter:
+    """Accept the records of the network of the selected nodes"""
+
+    CSVFILES = [
+        "Knooppunt.csv",
+        "Verbinding.csv",
+        "Kunstwerk.csv",
+        "Oppervlak.csv",
+        "Debiet.csv",
+        "Profiel.csv",
+        "Verloop.csv",
+    ]
+    CSVHEADERS = {
+        "Knooppunt.csv": ["UNI_IDE", "RST_IDE", "KNP_XCO", "KNP_YCO"],
+        "Verbinding.csv": ["UNI_IDE", "KN1_IDE", "KN2_IDE", "PRO_IDE"],
+        "Kunstwerk.csv": ["UNI_IDE"],
+        "Oppervlak.csv": ["UNI_IDE"],
+        "Debiet.csv": ["UNI_IDE", "VER_IDE"],
+        "Profiel.csv": ["PRO_IDE"],
+        "Verloop.csv": ["VER_IDE"],
+    }
+
+    def __init__(self, bbox=None, systems=None):
+        """
+        Args:
+            bbox (tuple):       (xmin, ymin, xmax, ymax) in the coordinates of
+                                the delivery, inclusive
+            systems (list):     the RST_IDE of the sewerage systems
+        """
+        if bbox is not None:
+            bbox = tuple(float(x) for x in bbox)
+            if len(bbox) != 4 or bbox[0] > bbox[2] or bbox[1] > bbox[3]:
+                raise ValueError("A bbox is (xmin, ymin, xmax, ymax), not %r" % (bbox,))
+        self.bbox = bbox
+        self.systems = None if systems is None else set(systems)
+        self.reset()
+
+    def __repr__(self):
+        systems = None if self.systems is None else sorted(self.systems)
+        return "NodeFilter(bbox=%r, systems=%r)" % (self.bbox, systems)
+
+    def reset(self):
+        """Forget the selection of a previous import"""
+        self.nodes = set()
+        self.connections = set()
+        # None until the file with the references is read
+        self.profiles = None
+        self.variations = None
+
+    def get_csvheaders(self, csvfilename):
+        """Return the columns of a hydx file that the filter needs"""
+        return self.CSVHEADERS[csvfilename]
+
+    def start(self, csvfilename):
+        """Called before the rows of a hydx file are read"""
+        if csvfilename == "Knooppunt.csv":
+            self.reset()
+        elif csvfilename == "Verbinding.csv":
+            self.profiles = set()
+        elif csvfilename == "Debiet.csv":
+            self.variations = set()
+
+    def accept(self, csvfilename, csvline):
+        """Return whether to import a (partial) csv line of a hydx file"""
+        return getattr(self, "accept_" + csvfilename[:-4].lower())(csvline)
+
+    def accept_knooppunt(self, csvline):
+        if self.systems is not None and csvline.get("RST_IDE") not in self.systems:
+            return False
+        if self.bbox is not None:
+            x, y = to_float(csvline.get("KNP_XCO")), to_float(csvline.get("KNP_YCO"))
+            if x is None or y is None:
+                return False
+            xmin, ymin, xmax, ymax = self.bbox
+            if not (xmin <= x <= xmax and ymin <= y <= ymax):
+                return False
+        self.nodes.add(csvline.get("UNI_IDE"))
+        return True
+
+    def accept_verbinding(self, csvline):
+        if not (
+            csvline.get("KN1_IDE") in self.nodes
+            and csvline.get("KN2_IDE") in self.nodes
+        ):
+            return False
+        self.connections.add(csvline.get("UNI_IDE"))
+        self.profiles.add(csvline.get("PRO_IDE"))
+        return True
+
+    def accept_kunstwerk(self, csvline):
+        code = csvline.get("UNI_IDE")
+        return code in self.nodes or code in self.connections
+
+    accept_oppervlak = accept_kunstwerk
+
+    def accept_debiet(self, csvline):
+        if not self.accept_kunstwerk(csvline):
+            return False
+        self.variations.add(csvline.get("VER_IDE"))
+        return True
+
+    def accept_profiel(self, csvline):
+        return self.profiles is None or csvline.get("PRO_IDE") in self.profiles
+
+    def accept_verloop(self, csvline):
+        return self.variations is None or csvline.get("VER_IDE") in self.variations
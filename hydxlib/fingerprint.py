@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import os
+
+from . import __version__
+from .hydx import Hydx
+from .sidecars import read_json_sidecar, write_json_atomic
+from .sources import open_source
+
+BLOCK_SIZE = 1024 * 1024
+# the output collections of a Threedi instance, in the order they are hashed
+THREEDI_COLLECTIONS = (
+    "connection_nodes",
+    "connections",
+    "cross_sections",
+    "impervious_surface_maps",
+    "impervious_surfaces",
+    "orifices",
+    "outlets",
+    "pipes",
+    "pumps",
+    "weirs",
+)
+
+
+def fingerprint_files(hydx_path):
+    """Return a fingerprint of the hydx csv files in a directory or zip archive
+
+    The decompressed content is used, so it does not matter how the files are
+    compressed.
+    """
+    fingerprint = hashlib.blake2b(digest_size=16)
+    with open_source(hydx_path) as source:
+        for csvfilename in sorted(Hydx.CSVFILES):
+            if source.find(csvfilename) is None:
+                continue
+            fingerprint.update(csvfilename.encode("utf-8"))
+            with source.open_binary(csvfilename) as f:
+                for block in iter(lambda: f.read(BLOCK_SIZE), b""):
+                    fingerprint.update(block)
+    return fingerprint.hexdigest()
+
+
+def fingerprint_threedi(threedi):
+    """Return a fingerprint of the collections of a Threedi instance
+
+    The hydxlib version is included, as the export of the same content may
+    change between versions.
+    """
+    fingerprint = hashlib.blake2b(__version__.encode("utf-8"), digest_size=16)
+    for name in THREEDI_COLLECTIONS:
+        collection = getattr(threedi, name, None)
+        if collection is None:
+            continue
+        fingerprint.update(name.encode("utf-8"))
+        for item in collection:
+            fingerprint.update(repr(item).encode("utf-8"))
+    return fingerprint.hexdigest()
+
+
+def get_file_state(path):
+    """Return the size and modification time of a file, None if it is missing"""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+class Fingerprint:
+    """Sidecar file with the fingerprints of the last export into a schematisation
+
+    The file is stored next to the schematisation as
+    ``<schematisation>.hydxlib-fingerprint.json``. It holds the fingerprints of
+    the source files and the converted content, the resulting commit counts and
+    the size and modification time of the schematisation after the export, so
+    that changes made to the schematisation afterwards invalidate it.
+    """
+
+    SUFFIX = ".hydxlib-fingerprint.json"
+
+    def __init__(self, db_path):
+        self.db_path = str(db_path)
+        self.path = self.db_path + self.SUFFIX
+
+    def load(self):
+        """Return the recorded export, empty if there is no (valid) fingerprint"""
+        return read_json_sidecar(self.path, "export fingerprint")
+
+    def load_current(self):
+        """Return the recorded export, empty if the schematisation changed since"""
+        recorded = self.load()
+        state = get_file_state(self.db_path)
+        if not recorded or state is None or recorded.get("database") != state:
+            return {}
+        return recorded
+
+    def get_commit_counts(self, source=None, content=None):
+        """Return the recorded commit counts if the source or content matches
+
+        Returns None if the fingerprints don't match or if the schematisation
+        was changed after the recorded export.
+        """
+        recorded = self.load_current()
+        if not recorded:
+            return None
+        if (source is not None and recorded.get("source") == source) or (
+            content is not None and recorded.get("content") == content
+        ):
+            return recorded["commit_counts"]
+        return None
+
+    def save(self, commit_counts, source=None, content=None):
+        recorded = {
+            "source": source,
+            "content": content,
+            "commit_counts": commit_counts,
+            "database": get_file_state(self.db_path),
+        }
+        write_json_atomic(self.path, recorded, indent=2)
+
+    def clear(self):
+        if os.path.isfile(self.path):
+            os.remove(self.path)
@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+"""Vectorized geometry construction for the 3Di export
+
+All geometries are built from the in-memory connection node coordinates with the
+shapely 2 array functions, so that nothing has to be read back from the database.
+"""
+from functools import lru_cache
+
+import numpy as np
+import shapely
+from pyproj import Transformer
+from pyproj.crs import CRS
+
+# Number of coordinates passed to pyproj at once, bounds the temporary arrays
+TRANSFORM_CHUNK_SIZE = 1_000_000
+
+# SpatiaLite's ST_Buffer approximates a quarter circle with 30 segments
+BUFFER_QUAD_SEGS = 30
+
+
+# Constructing a Transformer takes quite long, so we use caching here. The
+# function is deterministic so this doesn't have any side effects.
+@lru_cache(maxsize=16)
+def get_transformer(source_epsg, target_epsg):
+    return Transformer.from_crs(
+        CRS.from_epsg(source_epsg), CRS.from_epsg(target_epsg), always_xy=True
+    )
+
+
+def transform_coordinates(
+    xy, source_epsg, target_epsg, chunk_size=TRANSFORM_CHUNK_SIZE
+):
+    """Transform an (n, 2) coordinate array, chunk_size coordinates at a time"""
+    if source_epsg == target_epsg:
+        return xy.copy()
+    transformer = get_transformer(source_epsg, target_epsg)
+    result = np.empty_like(xy)
+    for start in range(0, len(xy), chunk_size):
+        end = start + chunk_size
+        x, y = transformer.transform(xy[start:end, 0], xy[start:end, 1])
+        result[start:end, 0] = x
+        result[start:end, 1] = y
+    return result
+
+
+def get_source_epsg(connection_nodes):
+    """Return the EPSG code of the first connection node, 28992 without nodes"""
+    return next((node["geom"][2] for node in connection_nodes), 28992)
+
+
+class NodeCoordinates:
+    """Connection node coordinates in the target CRS
+
+    The coordinates of all connection nodes are transformed at once and kept in
+    a compact (n, 2) float array, in the order of ``connection_nodes``. Missing
+    coordinates become NaN. Look up a node by code with ``node_coordinates[code]``.
+    """
+
+    def __init__(self, connection_nodes, target_epsg):
+        self.srid = target_epsg
+        # for duplicate codes the last node wins, like the database lookup does
+        self.index = {node["code"]: i for i, node in enumerate(connection_nodes)}
+        xy = np.array(
+            [node["geom"][:2] for node in connection_nodes], dtype=np.float64
+        ).reshape(-1, 2)
+        source_epsgs = np.array(
+            [node["geom"][2] for node in connection_nodes], dtype=np.int64
+        )
+        for source_epsg in np.unique(source_epsgs):
+            mask = source_epsgs == source_epsg
+            xy[mask] = transform_coordinates(xy[mask], int(source_epsg), target_epsg)
+        self.xy = xy
+
+    def __len__(self):
+        return len(self.xy)
+
+    def __contains__(self, code):
+        return code in self.index
+
+    def __getitem__(self, code):
+        x, y = self.xy[self.index[code]].tolist()
+        return x, y
+
+    def lookup(self, codes):
+        """Return the row of each code in ``xy``, -1 for unknown codes"""
+        return np.array([self.index.get(code, -1) for code in codes], dtype=np.int64)
+
+
+def to_ewkt(geometries, srid):
+    """Return a list of EWKT strings, None for missing geometries"""
+    return [
+        None if wkt is None else f"SRID={srid};{wkt}"
+        for wkt in shapely.to_wkt(geometries, rounding_precision=-1).tolist()
+    ]
+
+
+def get_points(xy):
+    return shapely.points(xy)
+
+
+def get_points_at_rows(node_coordinates, rows):
+    """Return points at node rows, None where a row is -1"""
+    points = np.full(len(rows), None, dtype=object)
+    found = rows >= 0
+    if found.any():
+        points[found] = get_points(node_coordinates.xy[rows[found]])
+    return points
+
+
+def get_lines(start_xy, end_xy):
+    """Return two-point linestrings from (n, 2) start and end coordinate arrays"""
+    return shapely.linestrings(np.stack([start_xy, end_xy], axis=1))
+
+
+def get_lines_between_rows(node_coordinates, start_rows, end_rows):
+    """Return linestrings between node rows, None where a row is -1"""
+    lines = np.full(len(start_rows), None, dtype=object)
+    found = (start_rows >= 0) & (end_rows >= 0)
+    if found.any():
+        lines[found] = get_lines(
+            node_coordinates.xy[start_rows[found]],
+            node_coordinates.xy[end_rows[found]],
+        )
+    return lines
+
+
+def get_squares(xy, areas):
+    """Return squares with the given areas centred on the coordinates"""
+    half_side = np.sqrt(areas) / 2
+    x, y = xy[:, 0], xy[:, 1]
+    return shapely.box(x - half_side, y - half_side, x + half_side, y + half_side)
+
+
+def get_buffers(xy, distance):
+    return shapely.buffer(get_points(xy), distance, quad_segs=BUFFER_QUAD_SEGS)
+
+
+def get_surface_geometries(node_coordinates, surfaces):
+    """Return the node found mask, squares and dry weather flow buffers
+
+    The squares have the area of the surface and are centred on its node;
+    surfaces without an area get no square.
+    """
+    rows = node_coordinates.lookup([surface["node.code"] for surface in surfaces])
+    found = rows >= 0
+    xy = node_coordinates.xy[rows]
+    areas = np.array([surface["area"] for surface in surfaces], dtype=np.float64)
+    has_square = found & (areas > 0)
+    squares = np.full(len(surfaces), None, dtype=object)
+    if has_square.any():
+        squares[has_square] = get_squares(xy[has_square], areas[has_square])
+    buffers = np.full(len(surfaces), None, dtype=object)
+    if found.any():
+        buffers[found] = get_buffers(xy[found], 1)
+    return found, squares, buffers
+
+
+def get_point_on_surface_coordinates(geometries):
+    """Return an (n, 2) array with a point on each surface, NaN for missing ones"""
+    points = shapely.point_on_surface(geometries)
+    return np.stack([shapely.get_x(points), shapely.get_y(points)], axis=1)
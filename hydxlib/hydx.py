@@ -2,6 +2,8 @@
 import logging
 from collections import Counter, OrderedDict
 
+from . import diagnostics
+
 logger = logging.getLogger(__name__)
 
 
@@ -13,11 +15,30 @@ class Generic:
         return [field["csvheader"] for field in cls.FIELDS]
 
     @classmethod
-    def import_csvline(cls, csvline):
+    def get_fields(cls, fieldnames=None):
+        """Return the FIELDS with these (case insensitive) names, all if None
+
+        The first field, the identification, is always included.
+        """
+        if fieldnames is None:
+            return cls.FIELDS
+        requested = {fieldname.lower() for fieldname in fieldnames}
+        unknown = requested - {field["fieldname"].lower() for field in cls.FIELDS}
+        if unknown:
+            raise ValueError(
+                "%s has no fields %s" % (cls.__name__, ", ".join(sorted(unknown)))
+            )
+        return [cls.FIELDS[0]] + [
+            field for field in cls.FIELDS[1:] if field["fieldname"].lower() in requested
+        ]
+
+    @classmethod
+    def import_csvline(cls, csvline, csvfilename=None, line=None, fields=None):
+        """Return an instance with the fields (default: all) of a csv line"""
         # AV - function looks like hydroObjectListFromSUFHYD in turtleurbanclasses.py
         instance = cls()
 
-        for field in cls.FIELDS:
+        for field in cls.FIELDS if fields is None else fields:
             fieldname = field["fieldname"].lower()
             csvheader = field["csvheader"]
             value = csvline[field["csvheader"]]
@@ -27,21 +48,31 @@ class Generic:
             # set fields to defined data type and load into object
             if value in (None, "", "null"):
                 if required:
-                    logger.error(
+                    diagnostics.error(
+                        logger,
+                        "missing-value",
                         "%s (%s) in %s is required but missing",
                         fieldname,
                         csvheader,
                         instance,
+                        record=csvline.get(cls.FIELDS[0]["csvheader"]),
+                        file=csvfilename,
+                        line=line,
                     )
                 setattr(instance, fieldname, None)
             elif datatype == float and not check_string_to_float(value):
                 setattr(instance, fieldname, None)
-                logger.error(
+                diagnostics.error(
+                    logger,
+                    "invalid-float",
                     "%s (%s) in %s does not contain a float: %r",
                     fieldname,
                     csvheader,
                     instance,
                     value,
+                    record=csvline.get(cls.FIELDS[0]["csvheader"]),
+                    file=csvfilename,
+                    line=line,
                 )
             else:
                 setattr(instance, fieldname, datatype(value))
@@ -51,10 +82,12 @@ class Generic:
         return self.__repr__().strip("<>")
 
     def dict(self):
+        """Return the imported fields by name"""
         return OrderedDict(
             [
                 (x["fieldname"].lower(), getattr(self, x["fieldname"].lower()))
                 for x in self.FIELDS
+                if hasattr(self, x["fieldname"].lower())
             ]
         )
 
@@ -838,10 +871,55 @@ class Hydx:
 
         for line in csvreader:
             hydx_class = csvfile_information["hydx_class"]
-            hydxelement = hydx_class.import_csvline(csvline=line)
+            hydxelement = hydx_class.import_csvline(
+                csvline=line, csvfilename=csvfilename, line=csvreader.line_num
+            )
             collection = getattr(self, csvfile_information["collection_name"])
             collection.append(hydxelement)
 
+    def import_csvrows(
+        self, header, csvreader, csvfilename, fieldnames=None, where=None
+    ):
+        """Import the rows of a csv.reader, of which the header has been read
+
+        Only the columns of the requested fields (see Generic.get_fields) are
+        looked up; the others are skipped. Rows that a filter (see
+        filters.NodeFilter) does not accept are skipped before records are
+        created.
+        """
+        hydx_class = self.CSVFILES[csvfilename]["hydx_class"]
+        check_headers(header, hydx_class.csvheaders())
+        fields = hydx_class.get_fields(fieldnames)
+        # like csv.DictReader: a missing column raises a KeyError on import
+        # and missing values at the end of a row are None
+        csvheaders = {field["csvheader"] for field in fields}
+        if where is not None:
+            csvheaders.update(where.get_csvheaders(csvfilename))
+            where.start(csvfilename)
+        columns = [
+            (index, csvheader)
+            for index, csvheader in enumerate(header)
+            if csvheader in csvheaders
+        ]
+        collection = getattr(self, self.CSVFILES[csvfilename]["collection_name"])
+        for row in csvreader:
+            if not row:
+                continue
+            csvline = {
+                csvheader: row[index] if index < len(row) else None
+                for index, csvheader in columns
+            }
+            if where is not None and not where.accept(csvfilename, csvline):
+                continue
+            collection.append(
+                hydx_class.import_csvline(
+                    csvline=csvline,
+                    csvfilename=csvfilename,
+                    line=csvreader.line_num,
+                    fields=fields,
+                )
+            )
+
     def check_import_data(self):
         self._check_on_unique(
             self.connection_nodes, "identificatieknooppuntofverbinding"
@@ -860,8 +938,13 @@ class Hydx:
             if value in seen:
                 continue
             seen.add(value)
-            logger.error(
-                "Non-unique '%s' value encountered in %s", unique_field, duplicate
+            diagnostics.error(
+                logger,
+                "duplicate-id",
+                "Non-unique '%s' value encountered in %s",
+                unique_field,
+                duplicate,
+                record=value,
             )
 
 
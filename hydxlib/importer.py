@@ -4,63 +4,153 @@ import logging
 import os
 
 from .hydx import Hydx
+from .report import stage
+from .sources import open_source
 
 logger = logging.getLogger(__name__)
 
 
-def import_hydx(hydx_path):
-    """Read set of hydx-csvfiles and return Hydx objects"""
+HYDX_CSVFILES = [
+    "Debiet.csv",
+    "ItObject.csv",
+    "Knooppunt.csv",
+    "Kunstwerk.csv",
+    "Meta.csv",
+    "Nwrw.csv",
+    "Oppervlak.csv",
+    "Profiel.csv",
+    "Verbinding.csv",
+    "Verloop.csv",
+]
+IMPLEMENTED_CSVFILES = [
+    "Debiet.csv",
+    # "ItObject1.csv",
+    "Knooppunt.csv",
+    "Kunstwerk.csv",
+    # "Meta1.csv",
+    # "Nwrw1.csv",
+    "Oppervlak.csv",
+    "Profiel.csv",
+    "Verbinding.csv",
+    "Verloop.csv",
+]
+
+COLLECTION_CSVFILES = {
+    information["collection_name"]: f for f, information in Hydx.CSVFILES.items()
+}
+
+
+def import_hydx(hydx_path, collections=None, fields=None, where=None):
+    """Read set of hydx-csvfiles and return Hydx objects
+
+    Args:
+        hydx_path (str):    directory or zip archive with the hydx files
+        collections (list): only read the files of these collections of Hydx,
+                            for instance ["connection_nodes", "connections"]
+        fields (dict):      only import these fields (attribute names) of the
+                            records of a collection, for instance
+                            {"connection_nodes": ["x_coordinaat", "y_coordinaat"]};
+                            the identification is always imported
+        where (NodeFilter): only import the network of the nodes it selects,
+                            see filters.py
+
+    The other collections stay empty and the records have no attributes for
+    the other fields.
+    """
     hydx = Hydx()
+    csvfilenames = get_selected_csvfiles(collections, fields)
+    if where is not None:
+        if csvfilenames is not None and "Knooppunt.csv" not in csvfilenames:
+            raise ValueError("A node filter needs the connection_nodes collection")
+        where.reset()
+        csvfilenames = [
+            f for f in where.CSVFILES if csvfilenames is None or f in csvfilenames
+        ]
+        # the not implemented files are still reported
+        csvfilenames += [f for f in HYDX_CSVFILES if f not in IMPLEMENTED_CSVFILES]
+    existing_files = get_csvfiles(hydx_path, csvfilenames)
+
+    # TODO check if number of csvfiles loaded is same as number inside meta1.csv
+
+    with stage("import"):
+        for f in existing_files:
+            parse_csvfile(hydx, hydx_path, f, get_fieldnames(f, fields), where)
+        check_hydx(hydx)
+
+    return hydx
 
-    hydxcsvfiles = [
-        "Debiet.csv",
-        "ItObject.csv",
-        "Knooppunt.csv",
-        "Kunstwerk.csv",
-        "Meta.csv",
-        "Nwrw.csv",
-        "Oppervlak.csv",
-        "Profiel.csv",
-        "Verbinding.csv",
-        "Verloop.csv",
-    ]
-    implementedcsvfiles = [
-        "Debiet.csv",
-        # "ItObject1.csv",
-        "Knooppunt.csv",
-        "Kunstwerk.csv",
-        # "Meta1.csv",
-        # "Nwrw1.csv",
-        "Oppervlak.csv",
-        "Profiel.csv",
-        "Verbinding.csv",
-        "Verloop.csv",
-    ]
 
+def get_selected_csvfiles(collections=None, fields=None):
+    """Return the hydx files to read, None for all files
+
+    Raises ValueError for unknown collections or fields.
+    """
+    unknown = set(collections or ()) | set(fields or ())
+    unknown -= set(COLLECTION_CSVFILES)
+    if unknown:
+        raise ValueError("Unknown collections: %s" % ", ".join(sorted(unknown)))
+    for collection, fieldnames in (fields or {}).items():
+        csvfilename = COLLECTION_CSVFILES[collection]
+        Hydx.CSVFILES[csvfilename]["hydx_class"].get_fields(fieldnames)
+    if collections is None:
+        return None
+    selected = {COLLECTION_CSVFILES[collection] for collection in collections}
+    return [f for f in HYDX_CSVFILES if f in selected]
+
+
+def get_fieldnames(csvfilename, fields=None):
+    """Return the requested fieldnames of a hydx file, None for all"""
+    if not fields:
+        return None
+    return fields.get(Hydx.CSVFILES[csvfilename]["collection_name"])
+
+
+def get_csvfiles(hydx_path, csvfilenames=None):
+    """Return the implemented hydx files in hydx_path, warn about the others
+
+    hydx_path is a directory or a zip archive, see sources.py. Only the files
+    in csvfilenames are considered, if given.
+    """
     existing_files = []
-    for f in hydxcsvfiles:
-        csvpath = os.path.join(hydx_path, f)
-        if not os.path.isfile(csvpath):
-            logger.warning(
-                "The following hydx file could not be found: %s",
-                os.path.abspath(csvpath),
-            )
-        elif f not in implementedcsvfiles:
-            logger.warning(
-                "The following hydx file is currently not implemented in this importer: %s",
-                csvpath,
-            )
-        else:
-            existing_files.append(f)
+    with open_source(hydx_path) as source:
+        for f in HYDX_CSVFILES if csvfilenames is None else csvfilenames:
+            name = source.find(f)
+            if name is None:
+                logger.warning(
+                    "The following hydx file could not be found: %s",
+                    os.path.abspath(source.describe(f)),
+                )
+            elif f not in IMPLEMENTED_CSVFILES:
+                logger.warning(
+                    "The following hydx file is currently not implemented in this importer: %s",
+                    source.describe(name),
+                )
+            else:
+                existing_files.append(f)
+    return existing_files
 
-    # TODO check if number of csvfiles loaded is same as number inside meta1.csv
 
-    for f in existing_files:
-        csvpath = os.path.join(hydx_path, f)
-        with open(csvpath, encoding="utf-8-sig") as csvfile:
-            csvreader = csv.DictReader(csvfile, delimiter=";")
-            hydx.import_csvfile(csvreader, f)
+def parse_csvfile(hydx, hydx_path, f, fieldnames=None, where=None):
+    """Add the records of hydx file f to hydx, return the number of records
 
-    hydx.check_import_data()
+    Only the fields in fieldnames are imported, all if it is None, of the
+    records that the filter accepts (see filters.NodeFilter).
+    """
+    collection = getattr(hydx, Hydx.CSVFILES[f]["collection_name"])
+    with stage(f"parse {f}") as parsing:
+        with open_source(hydx_path) as source, source.open(f) as csvfile:
+            csvreader = csv.reader(csvfile, delimiter=";")
+            header = next(csvreader, [])
+            hydx.import_csvrows(header, csvreader, f, fieldnames, where)
+            # line_num includes the header
+            parsing.records_in = max(csvreader.line_num - 1, 0)
+        parsing.records_out = len(collection)
+    return parsing.records_in
 
-    return hydx
+
+def check_hydx(hydx):
+    record_count = sum(
+        len(getattr(hydx, info["collection_name"])) for info in Hydx.CSVFILES.values()
+    )
+    with stage("check_import_data", record_count):
+        hydx.check_import_data()
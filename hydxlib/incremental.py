@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+"""Content hashes for incremental exports
+
+An incremental export compares every object it is about to write with the
+content hash that was recorded when the object was written last time. The
+hashes are kept per table and key in ``<schematisation>.hydxlib-hashes.json``,
+together with the size and modification time of the schematisation after the
+export. Hashes of a schematisation that was changed afterwards are ignored.
+"""
+import hashlib
+import logging
+import os
+
+from .fingerprint import get_file_state
+from .sidecars import read_json_sidecar, write_json_atomic
+
+logger = logging.getLogger(__name__)
+
+
+def get_object_values(obj):
+    """Return the attributes that were set on a new ORM object, without its id"""
+    return {
+        key: value
+        for key, value in vars(obj).items()
+        if not key.startswith("_") and key != "id"
+    }
+
+
+def content_hash(values):
+    """Return a short, stable hash of a dict of plain attribute values"""
+    data = repr(sorted(values.items())).encode("utf-8")
+    return hashlib.blake2b(data, digest_size=8).hexdigest()
+
+
+class ContentHashes:
+    """Sidecar file with the content hash of every exported object"""
+
+    SUFFIX = ".hydxlib-hashes.json"
+
+    def __init__(self, db_path):
+        self.db_path = str(db_path)
+        self.path = self.db_path + self.SUFFIX
+
+    def load(self):
+        """Return {table: {key: hash}}, empty if there are no (valid) hashes
+
+        The hashes are also ignored if the schematisation was changed after
+        they were recorded.
+        """
+        recorded = read_json_sidecar(self.path, "content hashes")
+        if not recorded:
+            return {}
+        state = get_file_state(self.db_path)
+        if state is None or recorded.get("database") != state:
+            logger.info("Ignoring the content hashes of changed %s", self.db_path)
+            return {}
+        return recorded.get("tables", {})
+
+    def save(self, hashes):
+        recorded = {"tables": hashes, "database": get_file_state(self.db_path)}
+        write_json_atomic(self.path, recorded)
+
+    def clear(self):
+        if os.path.isfile(self.path):
+            os.remove(self.path)
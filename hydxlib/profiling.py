@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+"""CPU profiling of a run
+
+A CpuProfiler runs cProfile and, at the same time, samples the call stack of
+the profiled thread at a fixed interval. The cProfile statistics are written
+as a ``.pstats`` file (for ``python -m pstats``, snakeviz and the like), the
+samples as a collapsed-stack file (for flamegraph.pl, speedscope and the
+like). Each sampled stack starts with the stages of the active Report that were
+running at that moment, as ``[import];[parse Knooppunt.csv];...``, so the
+flamegraph is split by stage.
+"""
+import cProfile
+import logging
+import os
+import sys
+import threading
+from collections import Counter
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+SAMPLE_INTERVAL = 0.005
+
+
+def get_frame_name(frame):
+    code = frame.f_code
+    return "%s (%s:%d)" % (
+        code.co_name,
+        os.path.basename(code.co_filename),
+        code.co_firstlineno,
+    )
+
+
+class StackSampler:
+    """Count the call stacks of a thread, sampled from a background thread"""
+
+    def __init__(self, thread_id, report=None, interval=SAMPLE_INTERVAL):
+        self.thread_id = thread_id
+        self.report = report
+        self.interval = interval
+        self.stacks = Counter()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(
+            target=self.run, name="hydxlib-stack-sampler", daemon=True
+        )
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            self.sample()
+
+    def sample(self):
+        frame = sys._current_frames().get(self.thread_id)
+        if frame is None:
+            return
+        names = []
+        while frame is not None:
+            names.append(get_frame_name(frame))
+            frame = frame.f_back
+        names.reverse()
+        if self.report is not None:
+            names = [f"[{name}]" for name in self.report.running_stages] + names
+        self.stacks[";".join(name.replace(";", ",") for name in names)] += 1
+
+    def write_collapsed(self, path):
+        """Write the stacks as lines of ``frame;frame;... count``"""
+        with open(path, "w") as f:
+            for stack, count in sorted(self.stacks.items()):
+                f.write(f"{stack} {count}\n")
+
+
+class CpuProfiler:
+    """Profile the current thread while activated, see the module docstring"""
+
+    def __init__(self, report=None, interval=SAMPLE_INTERVAL):
+        self.report = report
+        self.interval = interval
+        self.profile = None
+        self.sampler = None
+
+    @contextmanager
+    def activate(self):
+        self.profile = cProfile.Profile()
+        self.sampler = StackSampler(
+            threading.get_ident(), report=self.report, interval=self.interval
+        )
+        self.sampler.start()
+        self.profile.enable()
+        try:
+            yield self
+        finally:
+            self.profile.disable()
+            self.sampler.stop()
+
+    def write(self, path_prefix):
+        """Write ``<path_prefix>.pstats`` and ``<path_prefix>.collapsed``
+
+        returns: (pstats path, collapsed-stack path)
+        """
+        pstats_path = path_prefix + ".pstats"
+        collapsed_path = path_prefix + ".collapsed"
+        self.profile.dump_stats(pstats_path)
+        self.sampler.write_collapsed(collapsed_path)
+        return pstats_path, collapsed_path
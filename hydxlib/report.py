@@ -0,0 +1,194 @@
+# -*- coding: utf-8 -*-
+"""Per-stage timings and record counts
+
+Code that does a distinct piece of work wraps it in ``with stage(name):``.
+Stages are only recorded while a Report is active::
+
+    report = Report()
+    with report.activate():
+        run_import_export(hydx_path, out_path)
+    report.write_json("report.json")
+
+Without an active report, ``stage`` costs next to nothing. With
+``Report(trace_memory=True)`` the peak of the memory traced by tracemalloc
+during each stage is recorded too (which slows everything down), and with
+``allocation_sites=n`` also the n source lines that allocated the most memory
+that was still in use at the end of the stage.
+"""
+import json
+import logging
+import time
+import tracemalloc
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_FILTERS = (
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+)
+
+_active_report = ContextVar("hydxlib_report", default=None)
+
+
+class Stage:
+    """Wall time, CPU time and number of records in and out of one stage"""
+
+    def __init__(self, name, records_in=None, depth=0):
+        self.name = name
+        self.records_in = records_in
+        self.depth = depth
+        self.records_out = None
+        self.wall_time = None
+        self.cpu_time = None
+        self.memory_peak = None
+        self.allocation_sites = None
+
+    def as_dict(self):
+        return {
+            "name": self.name,
+            "depth": self.depth,
+            "wall_time": self.wall_time,
+            "cpu_time": self.cpu_time,
+            "memory_peak": self.memory_peak,
+            "allocation_sites": self.allocation_sites,
+            "records_in": self.records_in,
+            "records_out": self.records_out,
+        }
+
+
+class Report:
+    """The stages recorded while the report is active, in order of starting
+
+    Stages started within another stage have a larger ``depth``.
+    """
+
+    def __init__(self, trace_memory=False, allocation_sites=0):
+        self.stages = []
+        self.trace_memory = trace_memory or allocation_sites > 0
+        self.allocation_sites = allocation_sites
+        self._running = []
+
+    @property
+    def running_stages(self):
+        """The names of the stages that are running, outermost first"""
+        return [stage.name for stage in list(self._running)]
+
+    @contextmanager
+    def activate(self):
+        start_tracing = self.trace_memory and not tracemalloc.is_tracing()
+        if start_tracing:
+            tracemalloc.start()
+        token = _active_report.set(self)
+        try:
+            yield self
+        finally:
+            _active_report.reset(token)
+            if start_tracing:
+                tracemalloc.stop()
+
+    @contextmanager
+    def stage(self, name, records_in=None):
+        stage = Stage(name, records_in, depth=len(self._running))
+        self.stages.append(stage)
+        parent = self._running[-1] if self._running else None
+        self._running.append(stage)
+        snapshot = self.take_snapshot() if self.allocation_sites else None
+        if self.trace_memory:
+            # the peak is reset per stage; the peak so far is kept by the parent
+            if parent is not None:
+                parent.memory_peak = max(
+                    parent.memory_peak, tracemalloc.get_traced_memory()[1]
+                )
+            tracemalloc.reset_peak()
+            stage.memory_peak = 0
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        try:
+            yield stage
+        finally:
+            stage.wall_time = time.perf_counter() - wall_start
+            stage.cpu_time = time.process_time() - cpu_start
+            self._running.pop()
+            if self.trace_memory:
+                stage.memory_peak = max(
+                    stage.memory_peak, tracemalloc.get_traced_memory()[1]
+                )
+                if parent is not None:
+                    parent.memory_peak = max(parent.memory_peak, stage.memory_peak)
+                logger.info("Peak memory of %s: %.1f MB", name, stage.memory_peak / 1e6)
+            if snapshot is not None:
+                stage.allocation_sites = self.get_allocation_sites(snapshot)
+
+    def take_snapshot(self):
+        return tracemalloc.take_snapshot().filter_traces(SNAPSHOT_FILTERS)
+
+    def get_allocation_sites(self, snapshot):
+        """Return the lines that allocated most since snapshot, as dicts"""
+        statistics = self.take_snapshot().compare_to(snapshot, "lineno")
+        return [
+            {
+                "file": statistic.traceback[0].filename,
+                "line": statistic.traceback[0].lineno,
+                "size": statistic.size_diff,
+                "count": statistic.count_diff,
+            }
+            for statistic in statistics[: self.allocation_sites]
+            if statistic.size_diff > 0
+        ]
+
+    def as_dict(self):
+        return {"stages": [stage.as_dict() for stage in self.stages]}
+
+    def write_json(self, path):
+        with open(path, "w") as f:
+            json.dump(self.as_dict(), f, indent=2)
+
+    def format(self):
+        """Return the lines of a plain text table of the stages"""
+        lines = [
+            "%-40s %10s %10s %10s %10s %10s"
+            % ("stage", "wall [s]", "cpu [s]", "peak [MB]", "in", "out")
+        ]
+        for stage in self.stages:
+            lines.append(
+                "%-40s %10.3f %10.3f %10s %10s %10s"
+                % (
+                    "  " * stage.depth + stage.name,
+                    stage.wall_time or 0.0,
+                    stage.cpu_time or 0.0,
+                    ""
+                    if stage.memory_peak is None
+                    else "%.1f" % (stage.memory_peak / 1e6),
+                    "" if stage.records_in is None else stage.records_in,
+                    "" if stage.records_out is None else stage.records_out,
+                )
+            )
+            for site in stage.allocation_sites or []:
+                lines.append(
+                    "%s  %s:%d %.1f MB in %d blocks"
+                    % (
+                        "  " * stage.depth,
+                        site["file"],
+                        site["line"],
+                        site["size"] / 1e6,
+                        site["count"],
+                    )
+                )
+        return lines
+
+
+@contextmanager
+def stage(name, records_in=None):
+    """Record a stage in the active report, if there is one
+
+    Yields a Stage, on which ``records_out`` can be set.
+    """
+    report = _active_report.get()
+    if report is None:
+        yield Stage(name, records_in)
+        return
+    with report.stage(name, records_in) as recorded_stage:
+        yield recorded_stage
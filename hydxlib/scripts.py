@@ -5,28 +5,66 @@ A library for the GWSW-hydx exchange format
 Consists of a import and export functionality for currently hydx and threedi.
 Author: Arnold van 't Veld - Nelen & Schuurmans
 """
+import functools
 import logging
 import os
 import sys
 from argparse import ArgumentDefaultsHelpFormatter, ArgumentParser
+from contextlib import nullcontext
 from datetime import datetime
 
-from .exporter import export_threedi
+from .batch import format_summary, read_manifest, run_batch, write_summary
+from .benchmark import (
+    compare,
+    format_comparison,
+    load_results,
+    run_benchmark,
+    save_results,
+)
+from .diagnostics import Diagnostics, MAX_SAMPLES
+from .diff import diff_hydx, format_diff
+from .filters import NodeFilter
+from .fingerprint import Fingerprint, fingerprint_files
 from .importer import import_hydx
+from .profiling import CpuProfiler
+from .report import Report
+from .server import CACHE_SIZE, QUEUE_SIZE, serve
+from .sources import get_log_dir
+from .synthetic import generate_hydx, SYSTEM_SIZE
 
 logger = logging.getLogger(__name__)
 
+MEMORY_ALLOCATION_SITES = 10
+
 
 class OptionException(Exception):
     pass
 
 
-def run_import_export(hydx_path=None, out_path=None):
+def run_import_export(
+    hydx_path=None,
+    out_path=None,
+    in_memory=False,
+    chunk_size=None,
+    resume=False,
+    incremental=False,
+    output_format="threedi",
+    where=None,
+    workers=None,
+):
     """Run import and export functionality of hydxlib
 
     Args:
         hydx_path (str):            folder with your hydx *.csv files
         out_path (str):             output path
+        in_memory (bool):           stage the schematisation in memory
+        chunk_size (int):           number of objects inserted at once
+        resume (bool):              continue an interrupted export
+        incremental (bool):         only write what changed since the last export
+        output_format (str):        "threedi", "gpkg" or "geoparquet"
+        where (NodeFilter):         only convert the network of these nodes
+        workers (int):              convert the sewerage systems in parallel
+                                    with this many processes
 
     Returns:
         string: "INFO: method is finished"threedi_db_settings
@@ -52,14 +90,101 @@ def run_import_export(hydx_path=None, out_path=None):
 
     """
     logger.info("Started exchange of GWSW-hydx at %s", datetime.now())
+    convert_hydx(
+        hydx_path,
+        out_path,
+        in_memory=in_memory,
+        chunk_size=chunk_size,
+        resume=resume,
+        incremental=incremental,
+        output_format=output_format,
+        where=where,
+        workers=workers,
+    )
+    logger.info("Exchange of GWSW-hydx finished")
 
-    hydx = import_hydx(hydx_path)
+    return "method is finished"  # Return value only for testing
 
-    export_threedi(hydx, out_path)
 
-    logger.info("Exchange of GWSW-hydx finished")
+def convert_hydx(
+    hydx_path,
+    out_path,
+    in_memory=False,
+    chunk_size=None,
+    resume=False,
+    incremental=False,
+    output_format="threedi",
+    progress=None,
+    load_hydx=None,
+    where=None,
+    workers=None,
+    source_fingerprint=None,
+):
+    """Convert a hydx directory, see run_import_export for the arguments
 
-    return "method is finished"  # Return value only for testing
+    progress is passed to the exporter or sink, load_hydx(hydx_path) returns
+    the Hydx instance (default: import_hydx; the server uses a cache).
+    source_fingerprint is fingerprint_files(hydx_path), if already known.
+    Otherwise the files are only fingerprinted before the import if out_path
+    has a recorded export that could be up to date; else after the import.
+
+    Returns:
+        dict: the number of objects (or rows) written per type
+    """
+    if load_hydx is None:
+        load_hydx = functools.partial(import_hydx, where=where)
+    # the exporters load sqlalchemy, shapely, pyproj and threedi-schema, which
+    # takes a while: only import them when they are needed
+    if output_format != "threedi":
+        from .sinks import export_geopackage, export_geoparquet
+
+        hydx = load_hydx(hydx_path)
+        export = {"gpkg": export_geopackage, "geoparquet": export_geoparquet}
+        counts = export[output_format](
+            hydx, out_path, chunk_size=chunk_size, workers=workers, progress=progress
+        )
+        logger.info("GWSW-hydx exchange created rows: %r", counts)
+        return counts
+
+    def get_source_fingerprint():
+        fingerprint = source_fingerprint
+        if fingerprint is None:
+            fingerprint = fingerprint_files(hydx_path)
+        if where is not None:
+            # another selection of the same files is another source
+            fingerprint += " %r" % where
+        return fingerprint
+
+    source = None
+    fingerprint = Fingerprint(out_path)
+    if source_fingerprint is not None or fingerprint.load_current():
+        source = get_source_fingerprint()
+        commit_counts = fingerprint.get_commit_counts(source=source)
+        if commit_counts is not None:
+            logger.info(
+                "%s is up to date with the hydx files, created elements: %r",
+                out_path,
+                commit_counts,
+            )
+            return commit_counts
+
+    from .exporter import convert_and_write
+
+    hydx = load_hydx(hydx_path)
+    if source is None:
+        # only recorded for the next run, the files were just read
+        source = get_source_fingerprint()
+    return convert_and_write(
+        hydx,
+        out_path,
+        in_memory=in_memory,
+        chunk_size=chunk_size,
+        progress=progress,
+        resume=resume,
+        incremental=incremental,
+        source_fingerprint=source,
+        workers=workers,
+    )[1]
 
 
 def write_logging_to_file(log_relpath):
@@ -80,13 +205,107 @@ def get_parser():
     parser.add_argument(
         "hydx_path",
         nargs=1,
-        help="Folder with your hydx *.csv files",
+        help="Folder or zip archive with your hydx *.csv (or .csv.gz, .csv.zst) "
+        "files",
     )
     parser.add_argument(
         "out_path",
         nargs=1,
         help="Output path",
     )
+    parser.add_argument(
+        "--in-memory",
+        action="store_true",
+        dest="in_memory",
+        default=False,
+        help="Stage the schematisation in memory and write it back in one pass",
+    )
+    parser.add_argument(
+        "--chunk-size",
+        type=int,
+        dest="chunk_size",
+        default=None,
+        help="Insert objects in chunks of this size to keep memory use flat",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        dest="workers",
+        default=None,
+        help="Convert the sewerage systems (RST_IDE) in parallel with this many "
+        "processes",
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        dest="resume",
+        default=False,
+        help="Skip the stages an interrupted export into out_path already committed",
+    )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        dest="incremental",
+        default=False,
+        help="Update the objects of a previous export into out_path in place",
+    )
+    parser.add_argument(
+        "--output-format",
+        choices=["threedi", "gpkg", "geoparquet"],
+        dest="output_format",
+        default="threedi",
+        help="Write a 3Di schematisation, a GeoPackage or a directory of GeoParquet "
+        "files to out_path",
+    )
+    parser.add_argument(
+        "--bbox",
+        type=float,
+        nargs=4,
+        metavar=("XMIN", "YMIN", "XMAX", "YMAX"),
+        default=None,
+        help="Only convert the network of the nodes in this bounding box",
+    )
+    parser.add_argument(
+        "--system",
+        action="append",
+        dest="systems",
+        default=None,
+        metavar="RST_IDE",
+        help="Only convert the network of the nodes of this sewerage system "
+        "(can be repeated)",
+    )
+    parser.add_argument(
+        "--report",
+        action="store_true",
+        dest="report",
+        default=False,
+        help="Write the timings and record counts per stage as JSON next to the "
+        "log file",
+    )
+    parser.add_argument(
+        "--profile-memory",
+        action="store_true",
+        dest="profile_memory",
+        default=False,
+        help="Trace the peak memory and the top allocation sites per stage "
+        "(slow), implies --report",
+    )
+    parser.add_argument(
+        "--max-samples",
+        type=int,
+        default=MAX_SAMPLES,
+        dest="max_samples",
+        help="Number of records per kind of problem that are written to the "
+        "diagnostics csv next to the log file; the others are only counted",
+    )
+    parser.add_argument(
+        "--profile-cpu",
+        action="store_true",
+        dest="profile_cpu",
+        default=False,
+        help="Write a cProfile .pstats file and a collapsed-stack file for "
+        "flamegraphs next to the log file",
+    )
     parser.add_argument(
         "-v",
         "--verbose",
@@ -98,8 +317,302 @@ def get_parser():
     return parser
 
 
+def get_diff_parser():
+    """Return argument parser of the diff subcommand."""
+    parser = ArgumentParser(
+        prog="run-hydxlib diff",
+        description="Compare two GWSW-hydx deliveries",
+        formatter_class=ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument("old_path", help="Folder with the old hydx *.csv files")
+    parser.add_argument("new_path", help="Folder with the new hydx *.csv files")
+    parser.add_argument(
+        "-v",
+        "--verbose",
+        action="store_true",
+        dest="verbose",
+        default=False,
+        help="List the added, removed and modified records",
+    )
+    return parser
+
+
+def diff_main(argv):
+    """Print the differences between two deliveries, exit 1 if there are any."""
+    options = get_diff_parser().parse_args(argv)
+    logging.basicConfig(level=logging.WARNING, format="%(levelname)s: %(message)s")
+    diff = diff_hydx(options.old_path, options.new_path)
+    for line in format_diff(diff, details=options.verbose):
+        print(line)
+    sys.exit(1 if diff else 0)
+
+
+def get_generate_parser():
+    """Return argument parser of the generate subcommand."""
+    parser = ArgumentParser(
+        prog="run-hydxlib generate",
+        description="Write a synthetic GWSW-hydx network, for benchmarks",
+        formatter_class=ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument("hydx_path", help="Folder to write the hydx *.csv files to")
+    parser.add_argument(
+        "--nodes", type=int, default=1000, dest="node_count", help="Number of nodes"
+    )
+    parser.add_argument("--seed", type=int, default=0, help="Random seed")
+    parser.add_argument(
+        "--system-size",
+        type=int,
+        default=SYSTEM_SIZE,
+        dest="system_size",
+        help="Number of nodes per sewerage system",
+    )
+    return parser
+
+
+def generate_main(argv):
+    """Write a synthetic network and print the number of rows per file."""
+    options = get_generate_parser().parse_args(argv)
+    counts = generate_hydx(
+        options.hydx_path,
+        options.node_count,
+        seed=options.seed,
+        system_size=options.system_size,
+    )
+    for csvfilename, count in counts.items():
+        print("%-16s %10d" % (csvfilename, count))
+
+
+def get_benchmark_parser():
+    """Return argument parser of the benchmark subcommand."""
+    parser = ArgumentParser(
+        prog="run-hydxlib benchmark",
+        description=(
+            "Benchmark a synthetic network against a baseline, exit 1 on "
+            "regressions. Without a baseline file, the run becomes the baseline."
+        ),
+        formatter_class=ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument("baseline_path", help="JSON file with the baseline")
+    parser.add_argument(
+        "--nodes", type=int, default=10000, dest="node_count", help="Number of nodes"
+    )
+    parser.add_argument("--seed", type=int, default=0, help="Random seed")
+    parser.add_argument(
+        "--repeat", type=int, default=3, help="Number of timed runs per stage"
+    )
+    parser.add_argument(
+        "--time-tolerance",
+        type=float,
+        default=0.2,
+        dest="time_tolerance",
+        help="Allowed relative increase of the time of a stage",
+    )
+    parser.add_argument(
+        "--memory-tolerance",
+        type=float,
+        default=0.1,
+        dest="memory_tolerance",
+        help="Allowed relative increase of the peak memory of a stage",
+    )
+    parser.add_argument(
+        "--update",
+        action="store_true",
+        default=False,
+        help="Replace the baseline with this run",
+    )
+    return parser
+
+
+def benchmark_main(argv):
+    """Run the benchmark and compare it with the baseline."""
+    options = get_benchmark_parser().parse_args(argv)
+    logging.basicConfig(level=logging.WARNING, format="%(levelname)s: %(message)s")
+    result = run_benchmark(options.node_count, options.repeat, options.seed)
+    if options.update or not os.path.exists(options.baseline_path):
+        save_results(result, options.baseline_path)
+        print("Baseline is written to %s" % options.baseline_path)
+        return
+
+    baseline = load_results(options.baseline_path)
+    for line in format_comparison(baseline, result):
+        print(line)
+    regressions = compare(
+        baseline,
+        result,
+        time_tolerance=options.time_tolerance,
+        memory_tolerance=options.memory_tolerance,
+    )
+    for name, metric, old, new in regressions:
+        print("Regression in %s: %s %.3f -> %.3f" % (name, metric, old, new))
+    sys.exit(1 if regressions else 0)
+
+
+def get_batch_parser():
+    """Return argument parser of the batch subcommand."""
+    parser = ArgumentParser(
+        prog="run-hydxlib batch",
+        description=(
+            "Convert the deliveries of a manifest on a pool of worker processes, "
+            "exit 1 if any of them failed"
+        ),
+        formatter_class=ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument(
+        "manifest_path",
+        help="csv (columns hydx_path and out_path) or JSON file with the deliveries",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="Number of worker processes, default: the number of cpus",
+    )
+    parser.add_argument(
+        "--summary",
+        dest="summary_path",
+        default=None,
+        help="Write the status, counts and duration per delivery to this csv "
+        "(or .json) file",
+    )
+    parser.add_argument(
+        "--in-memory",
+        action="store_true",
+        dest="in_memory",
+        default=False,
+        help="Stage the schematisations in memory and write them back in one pass",
+    )
+    parser.add_argument(
+        "--chunk-size",
+        type=int,
+        dest="chunk_size",
+        default=None,
+        help="Insert objects in chunks of this size to keep memory use flat",
+    )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        dest="incremental",
+        default=False,
+        help="Update the objects of previous exports in place",
+    )
+    parser.add_argument(
+        "--output-format",
+        choices=["threedi", "gpkg", "geoparquet"],
+        dest="output_format",
+        default="threedi",
+        help="Write 3Di schematisations, GeoPackages or GeoParquet directories",
+    )
+    parser.add_argument(
+        "--max-samples",
+        type=int,
+        default=MAX_SAMPLES,
+        dest="max_samples",
+        help="Number of records per kind of problem in the diagnostics csv files",
+    )
+    return parser
+
+
+def batch_main(argv):
+    """Convert the deliveries of a manifest and print a summary."""
+    options = get_batch_parser().parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s: %(message)s")
+    jobs = read_manifest(options.manifest_path)
+    results = run_batch(
+        jobs,
+        workers=options.workers,
+        in_memory=options.in_memory,
+        chunk_size=options.chunk_size,
+        incremental=options.incremental,
+        output_format=options.output_format,
+        max_samples=options.max_samples,
+    )
+    for line in format_summary(results):
+        print(line)
+    if options.summary_path:
+        write_summary(results, options.summary_path)
+    sys.exit(1 if any(result["status"] != "ok" for result in results) else 0)
+
+
+def get_serve_parser():
+    """Return argument parser of the serve subcommand."""
+    parser = ArgumentParser(
+        prog="run-hydxlib serve",
+        description=(
+            "Run conversion jobs posted to a JSON API, keeping the exporter and "
+            "recently parsed deliveries in memory"
+        ),
+        formatter_class=ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument("--host", default="127.0.0.1", help="Address to listen on")
+    parser.add_argument("--port", type=int, default=8000, help="Port to listen on")
+    parser.add_argument(
+        "--socket",
+        dest="socket_path",
+        default=None,
+        help="Listen on this unix socket instead of a TCP port",
+    )
+    parser.add_argument(
+        "--queue-size",
+        type=int,
+        default=QUEUE_SIZE,
+        dest="queue_size",
+        help="Maximum number of queued jobs, more are refused",
+    )
+    parser.add_argument(
+        "--threads",
+        type=int,
+        default=1,
+        help="Number of jobs that run at the same time",
+    )
+    parser.add_argument(
+        "--cache-size",
+        type=int,
+        default=CACHE_SIZE,
+        dest="cache_size",
+        help="Number of parsed deliveries kept in memory",
+    )
+    parser.add_argument(
+        "-v",
+        "--verbose",
+        action="store_true",
+        dest="verbose",
+        default=False,
+        help="Verbose output",
+    )
+    return parser
+
+
+def serve_main(argv):
+    """Serve the conversion API until interrupted."""
+    options = get_serve_parser().parse_args(argv)
+    logging.basicConfig(
+        level=logging.DEBUG if options.verbose else logging.INFO,
+        format="%(levelname)s: %(message)s",
+    )
+    serve(
+        options.host,
+        options.port,
+        options.socket_path,
+        queue_size=options.queue_size,
+        threads=options.threads,
+        cache_size=options.cache_size,
+    )
+
+
+SUBCOMMANDS = {
+    "batch": batch_main,
+    "benchmark": benchmark_main,
+    "diff": diff_main,
+    "generate": generate_main,
+    "serve": serve_main,
+}
+
+
 def main():
     """Call command with args from parser."""
+    if sys.argv[1:2] and sys.argv[1] in SUBCOMMANDS:
+        return SUBCOMMANDS[sys.argv[1]](sys.argv[2:])
+
     options = get_parser().parse_args()
 
     if options.verbose:
@@ -109,18 +622,53 @@ def main():
     logging.basicConfig(level=log_level, format="%(levelname)s: %(message)s")
 
     # add file handler to logging options
-    log_relpath = os.path.join(
-        os.path.abspath(options.hydx_path[0]), "import_hydx_hydxlib.log"
-    )
+    log_dir = get_log_dir(options.hydx_path[0])
+    log_relpath = os.path.join(log_dir, "import_hydx_hydxlib.log")
     write_logging_to_file(log_relpath)
     logger.info("Log file is created in hydx directory: %r", log_relpath)
 
+    if options.profile_memory:
+        report = Report(allocation_sites=MEMORY_ALLOCATION_SITES)
+    else:
+        report = Report()
+    profiler = CpuProfiler(report) if options.profile_cpu else None
+    diagnostics = Diagnostics(max_samples=options.max_samples)
     try:
-        run_import_export(
-            options.export_type,
-            options.hydx_path[0],
-            options.out_path[0],
-        )
+        with report.activate(), diagnostics.activate(), (
+            profiler.activate() if profiler else nullcontext()
+        ):
+            run_import_export(
+                options.hydx_path[0],
+                options.out_path[0],
+                in_memory=options.in_memory,
+                chunk_size=options.chunk_size,
+                resume=options.resume,
+                incremental=options.incremental,
+                output_format=options.output_format,
+                where=(
+                    NodeFilter(options.bbox, options.systems)
+                    if options.bbox or options.systems
+                    else None
+                ),
+                workers=options.workers,
+            )
     except OptionException as e:
         logger.critical(e)
         sys.exit(1)
+
+    diagnostics.log_summary(logger)
+    if diagnostics:
+        diagnostics_path = os.path.join(log_dir, "import_hydx_hydxlib.diagnostics.csv")
+        diagnostics.write_csv(diagnostics_path)
+        logger.info("Diagnostics are written to %r", diagnostics_path)
+    for line in report.format():
+        logger.debug(line)
+    if profiler is not None:
+        pstats_path, collapsed_path = profiler.write(
+            os.path.join(log_dir, "import_hydx_hydxlib")
+        )
+        logger.info("CPU profile is written to %r and %r", pstats_path, collapsed_path)
+    if options.report or options.profile_memory:
+        report_path = os.path.join(log_dir, "import_hydx_hydxlib.report.json")
+        report.write_json(report_path)
+        logger.info("Report is written to %r", report_path)
@@ -0,0 +1,358 @@
+# -*- coding: utf-8 -*-
+"""Long running conversion service
+
+``run-hydxlib serve`` starts a process that keeps the exporter (sqlalchemy,
+threedi-schema), the pyproj transformers and recently parsed deliveries in
+memory and runs conversion jobs from a bounded queue. Clients talk JSON over
+HTTP on localhost or on a unix socket:
+
+- ``POST /jobs`` with ``{"hydx_path": ..., "out_path": ..., <options>}``
+  queues a job (options as ``convert_hydx``: ``in_memory``, ``chunk_size``,
+  ``resume``, ``incremental``, ``output_format``). Returns 202 and the job,
+  or 503 if the queue is full.
+- ``GET /jobs`` lists the jobs, ``GET /jobs/<id>`` returns one job with its
+  status (queued, running, done, failed or cancelled), progress, commit
+  counts, diagnostics and error.
+- ``DELETE /jobs/<id>`` cancels a job. A queued job is dropped. A running job
+  stops when its delivery is parsed or at the next progress report of the
+  exporter or sink, after every written chunk; the stages it already committed
+  stay in the schematisation (see ``resume``). The parse and the conversion
+  themselves cannot be interrupted.
+
+Parsed deliveries are cached by the fingerprint of their csv files, so
+converting the same upload again (for instance to another output) skips the
+parsing. The conversion changes some attributes of the Hydx instance, so every
+job gets a copy.
+"""
+import copy
+import itertools
+import json
+import logging
+import os
+import queue
+import socketserver
+import threading
+import time
+import traceback
+from collections import OrderedDict
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from .batch import preload
+from .diagnostics import Diagnostics
+from .fingerprint import fingerprint_files
+from .importer import import_hydx
+
+logger = logging.getLogger(__name__)
+
+QUEUE_SIZE = 16
+CACHE_SIZE = 4
+# finished jobs that are kept for status requests
+HISTORY_SIZE = 100
+JOB_OPTIONS = ("in_memory", "chunk_size", "resume", "incremental", "output_format")
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class Job:
+    """A conversion job and its status"""
+
+    def __init__(self, id, hydx_path, out_path, options):
+        self.id = id
+        self.hydx_path = hydx_path
+        self.out_path = out_path
+        self.options = options
+        self.status = "queued"
+        self.progress = None
+        self.commit_counts = None
+        self.diagnostics = None
+        self.error = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.cancel_requested = threading.Event()
+
+    @property
+    def is_finished(self):
+        return self.status in ("done", "failed", "cancelled")
+
+    def check_cancelled(self):
+        if self.cancel_requested.is_set():
+            raise JobCancelled()
+
+    def report_progress(self, stage, done, total):
+        """Progress callback of the exporter, raises if the job is cancelled"""
+        self.progress = {"stage": stage, "done": done, "total": total}
+        self.check_cancelled()
+
+    def as_dict(self):
+        return {
+            "id": self.id,
+            "hydx_path": self.hydx_path,
+            "out_path": self.out_path,
+            "options": self.options,
+            "status": self.status,
+            "progress": self.progress,
+            "commit_counts": self.commit_counts,
+            "diagnostics": self.diagnostics,
+            "error": self.error,
+            "created": self.created,
+            "started": self.started,
+            "finished": self.finished,
+        }
+
+
+class HydxCache:
+    """The last parsed deliveries with their import diagnostics, by fingerprint"""
+
+    def __init__(self, size=CACHE_SIZE):
+        self.size = size
+        self.items = OrderedDict()
+        self.lock = threading.Lock()
+
+    def load(self, hydx_path, diagnostics, key=None):
+        """Return a Hydx of hydx_path, add its import diagnostics to diagnostics
+
+        key is the fingerprint_files of hydx_path, computed if not given.
+        """
+        if key is None:
+            key = fingerprint_files(hydx_path)
+        with self.lock:
+            cached = self.items.get(key)
+            if cached is not None:
+                self.items.move_to_end(key)
+        if cached is None:
+            parsed = Diagnostics(max_samples=diagnostics.max_samples)
+            with parsed.activate():
+                hydx = import_hydx(hydx_path)
+            cached = (hydx, parsed)
+            if self.size:
+                with self.lock:
+                    self.items[key] = cached
+                    while len(self.items) > self.size:
+                        self.items.popitem(last=False)
+        else:
+            logger.info("Using the cached parse of %s", hydx_path)
+        hydx, parsed = cached
+        diagnostics.update(parsed)
+        return copy.deepcopy(hydx) if self.size else hydx
+
+
+class Worker:
+    """Runs the jobs of a bounded queue in worker threads"""
+
+    def __init__(
+        self,
+        queue_size=QUEUE_SIZE,
+        threads=1,
+        cache_size=CACHE_SIZE,
+        history_size=HISTORY_SIZE,
+    ):
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.threads = threads
+        self.cache = HydxCache(cache_size)
+        self.history_size = history_size
+        self.jobs = OrderedDict()
+        self.lock = threading.Lock()
+        self.ids = itertools.count(1)
+
+    def start(self):
+        preload()
+        for _ in range(self.threads):
+            threading.Thread(target=self.run, daemon=True).start()
+
+    def stop(self):
+        for _ in range(self.threads):
+            self.queue.put(None)
+
+    def submit(self, hydx_path, out_path, **options):
+        """Queue a job, raises queue.Full if the queue is full"""
+        unknown = set(options) - set(JOB_OPTIONS)
+        if unknown:
+            raise ValueError("Unknown options: %s" % ", ".join(sorted(unknown)))
+        with self.lock:
+            job = Job(str(next(self.ids)), hydx_path, out_path, options)
+            self.queue.put_nowait(job)
+            self.jobs[job.id] = job
+        logger.info("Queued job %s: %s -> %s", job.id, hydx_path, out_path)
+        return job
+
+    def get(self, id):
+        return self.jobs.get(id)
+
+    def list(self):
+        with self.lock:
+            return list(self.jobs.values())
+
+    def cancel(self, id):
+        """Request cancellation, return the job (None if unknown)"""
+        job = self.jobs.get(id)
+        if job is None or job.is_finished:
+            return job
+        job.cancel_requested.set()
+        with self.lock:
+            if job.status == "queued":
+                self.finish(job, "cancelled")
+        return job
+
+    def finish(self, job, status):
+        job.status = status
+        job.finished = time.time()
+        finished = [x.id for x in self.jobs.values() if x.is_finished]
+        for id in finished[: max(len(finished) - self.history_size, 0)]:
+            del self.jobs[id]
+
+    def run(self):
+        while True:
+            job = self.queue.get()
+            if job is None:
+                return
+            with self.lock:
+                if job.status != "queued":
+                    continue
+                job.status = "running"
+                job.started = time.time()
+            status = self.run_job(job)
+            with self.lock:
+                self.finish(job, status)
+            logger.info("Job %s %s", job.id, status)
+
+    def run_job(self, job):
+        """Convert, return the final status of the job"""
+        from .scripts import convert_hydx
+
+        diagnostics = Diagnostics()
+
+        def load_hydx(path):
+            hydx = self.cache.load(path, diagnostics, source_fingerprint)
+            # the parse does not report progress
+            job.check_cancelled()
+            return hydx
+
+        try:
+            with diagnostics.activate():
+                if not os.path.exists(job.hydx_path):
+                    raise ValueError("%s does not exist" % job.hydx_path)
+                # the files are read once for the cache and the up to date check
+                source_fingerprint = fingerprint_files(job.hydx_path)
+                job.check_cancelled()
+                job.commit_counts = convert_hydx(
+                    job.hydx_path,
+                    job.out_path,
+                    progress=job.report_progress,
+                    load_hydx=load_hydx,
+                    source_fingerprint=source_fingerprint,
+                    **job.options,
+                )
+        except JobCancelled:
+            return "cancelled"
+        except Exception as e:
+            logger.debug(traceback.format_exc())
+            job.error = "%s: %s" % (type(e).__name__, e)
+            return "failed"
+        finally:
+            job.diagnostics = diagnostics.as_dict()["diagnostics"]
+        if job.cancel_requested.is_set():
+            # the export finished after its last progress report
+            logger.info("Job %s finished before it could be cancelled", job.id)
+        if job.commit_counts is None:
+            job.error = "The export did not finish"
+            return "failed"
+        return "done"
+
+
+class RequestHandler(BaseHTTPRequestHandler):
+    """The JSON API of the worker of the server"""
+
+    def address_string(self):
+        # the client address of a unix socket is empty
+        return self.client_address[0] if self.client_address else "unix"
+
+    def log_message(self, format, *args):
+        logger.debug("%s - " + format, self.address_string(), *args)
+
+    def send_json(self, status, content):
+        body = json.dumps(content).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def get_job_id(self):
+        parts = self.path.strip("/").split("/")
+        if len(parts) == 2 and parts[0] == "jobs":
+            return parts[1]
+
+    def do_GET(self):
+        worker = self.server.worker
+        if self.path.rstrip("/") == "/jobs":
+            return self.send_json(
+                HTTPStatus.OK, {"jobs": [job.as_dict() for job in worker.list()]}
+            )
+        job = worker.get(self.get_job_id())
+        if job is None:
+            return self.send_json(HTTPStatus.NOT_FOUND, {"error": "Unknown job"})
+        self.send_json(HTTPStatus.OK, job.as_dict())
+
+    def do_POST(self):
+        if self.path.rstrip("/") != "/jobs":
+            return self.send_json(HTTPStatus.NOT_FOUND, {"error": "Unknown path"})
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            content = json.loads(self.rfile.read(length) or b"{}")
+            job = self.server.worker.submit(
+                content.pop("hydx_path"), content.pop("out_path"), **content
+            )
+        except queue.Full:
+            return self.send_json(
+                HTTPStatus.SERVICE_UNAVAILABLE, {"error": "The job queue is full"}
+            )
+        except (AttributeError, KeyError, TypeError, ValueError) as e:
+            return self.send_json(
+                HTTPStatus.BAD_REQUEST, {"error": "Invalid job: %s" % e}
+            )
+        self.send_json(HTTPStatus.ACCEPTED, job.as_dict())
+
+    def do_DELETE(self):
+        job = self.server.worker.cancel(self.get_job_id())
+        if job is None:
+            return self.send_json(HTTPStatus.NOT_FOUND, {"error": "Unknown job"})
+        self.send_json(HTTPStatus.OK, job.as_dict())
+
+
+class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def make_server(worker, host="127.0.0.1", port=8000, socket_path=None):
+    """Return an HTTP server for the worker, on a unix socket if given"""
+    if socket_path is not None:
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        server = UnixHTTPServer(socket_path, RequestHandler)
+    else:
+        server = ThreadingHTTPServer((host, port), RequestHandler)
+    server.worker = worker
+    return server
+
+
+def serve(host="127.0.0.1", port=8000, socket_path=None, **worker_options):
+    """Start a worker and serve its API until interrupted"""
+    worker = Worker(**worker_options)
+    worker.start()
+    server = make_server(worker, host, port, socket_path)
+    logger.info(
+        "Serving on %s", socket_path if socket_path else "http://%s:%d" % (host, port)
+    )
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        worker.stop()
+        if socket_path is not None and os.path.exists(socket_path):
+            os.remove(socket_path)
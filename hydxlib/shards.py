@@ -0,0 +1,423 @@
+# -*- coding: utf-8 -*-
+"""Convert the sewerage systems of a delivery in parallel
+
+``Threedi.import_hydx(hydx, workers=n)`` partitions the network into shards
+and converts them in a pool of n worker processes:
+
+- the nodes of a sewerage system (``RST_IDE``) are in one shard. Nodes without
+  a system join the nodes they are connected to, so without any ``RST_IDE``
+  the shards are the connected components of the network;
+- connections, and their structures, are in the shard of their nodes. The
+  connections between two systems (for instance the pump or overflow to a
+  neighbouring system) are converted in a separate shard that knows the codes
+  of all nodes;
+- surfaces and discharges are in the shard of their node or pipe;
+- an open connection (OPL) with a closed trapezium profile opens the profile
+  for all connections after it, so the connections using such a profile are
+  in one shard.
+
+The systems are packed into one shard per worker, largest first. The
+profiles, the display names of the connections (``<node>-<node>-<number>``)
+and the numbers of the surfaces depend on the whole delivery, so they are
+determined before the shards are converted. Every converted object and
+every diagnostic is tagged with the position of its hydx record, so the
+merged result, and the order of the diagnostics, is the same as that of the
+sequential conversion.
+"""
+import copy
+import logging
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from operator import itemgetter
+
+from threedi_schema.domain.constants import CrossSectionShape
+
+from . import diagnostics
+from .diagnostics import Diagnostics
+from .report import stage
+from .threedi import is_closed
+from .threedi import logger as threedi_logger
+from .threedi import Threedi
+
+logger = logging.getLogger(__name__)
+
+# the conversion stages, the first part of the position of a converted record
+NODES, PROFILES, CONNECTIONS, SURFACES, DISCHARGES = range(5)
+
+PIPE_TYPES = ("GSL", "OPL", "ITR")
+STRUCTURE_TYPES = ("PMP", "OVS", "DRL")
+# the Threedi collections that are merged by position
+COLLECTIONS = (
+    "connection_nodes",
+    "pipes",
+    "pumps",
+    "weirs",
+    "orifices",
+    "impervious_surfaces",
+    "impervious_surface_maps",
+    "outlets",
+    "cross_sections",
+)
+
+
+class Shard:
+    """The (position, record) pairs that one worker converts"""
+
+    def __init__(self, node_codes=None):
+        # None: the codes of the connection nodes of this shard
+        self.node_codes = node_codes
+        self.connection_nodes = []
+        self.connections = []  # (position, connection, display name)
+        self.structures = []
+        self.surfaces = []  # (position, surface, surface nr)
+        self.discharges = []  # (position, discharge, surface nr)
+        self.variations = []
+
+    def __len__(self):
+        return len(self.connection_nodes) + len(self.connections)
+
+
+class RecordingDiagnostics(Diagnostics):
+    """Keeps every diagnostic with the position of the record being converted"""
+
+    def __init__(self):
+        super().__init__()
+        self.position = None
+        self.events = []
+
+    def add(self, level, code, message, args, record=None, file=None, line=None):
+        self.events.append(
+            (self.position, level, code, message, args, record, file, line)
+        )
+
+
+class Partition:
+    """Union-find of the nodes, systems and shared profiles of a delivery"""
+
+    def __init__(self):
+        self.parents = {}
+
+    def find(self, key):
+        parents = self.parents
+        root = parents.setdefault(key, key)
+        while parents[root] != root:
+            root = parents[root]
+        while parents[key] != root:
+            parents[key], key = root, parents[key]
+        return root
+
+    def union(self, *keys):
+        roots = [self.find(key) for key in keys]
+        for root in roots[1:]:
+            self.parents[root] = roots[0]
+
+
+def get_display_names(hydx):
+    """Return the display name of every connection, as the sequential conversion
+
+    The number of a display name is one more than the number of structures
+    created before it whose display name starts with the same node names.
+    """
+    node_names = {
+        node.identificatieknooppuntofverbinding: node.identificatierioolput
+        for node in hydx.connection_nodes
+    }
+    structure_types = {}
+    for structure in hydx.structures:
+        structure_types.setdefault(
+            structure.identificatieknooppuntofverbinding, structure.typekunstwerk
+        )
+    # the number of structure display names per prefix
+    prefixes = Counter()
+    display_names = []
+    for connection in hydx.connections:
+        code = connection.identificatieknooppuntofverbinding
+        typeverbinding = connection.typeverbinding
+        if typeverbinding not in PIPE_TYPES and (
+            typeverbinding not in STRUCTURE_TYPES or code not in structure_types
+        ):
+            display_names.append(None)
+            continue
+        name = (
+            node_names.get(connection.identificatieknooppunt1, "")
+            + "-"
+            + node_names.get(connection.identificatieknooppunt2, "")
+        )
+        name += "-" + str(prefixes[name] + 1)
+        display_names.append(name)
+        is_structure = typeverbinding in STRUCTURE_TYPES
+        if is_structure and structure_types[code] in STRUCTURE_TYPES:
+            prefixes.update(name[:i] for i in range(len(name) + 1))
+    return display_names
+
+
+def get_opened_profiles(hydx, profiles):
+    """Return the codes of the closed trapezium profiles of open connections"""
+    opened = set()
+    for connection in hydx.connections:
+        code = connection.identificatieprofieldefinitie
+        if connection.typeverbinding != "OPL" or code is None or code in opened:
+            continue
+        cross_section = profiles.find_cross_section(code)
+        if (
+            cross_section is not None
+            and cross_section["shape"] == CrossSectionShape.TABULATED_TRAPEZIUM.value
+            and is_closed(cross_section)
+        ):
+            opened.add(code)
+    return opened
+
+
+def partition(hydx, profiles, workers):
+    """Return the shards of a delivery, the shared shard last
+
+    profiles is a Threedi instance with the converted profiles.
+    """
+    union_find = Partition()
+    systems = {}
+    for node in hydx.connection_nodes:
+        code = node.identificatieknooppuntofverbinding
+        system = getattr(node, "identificatierioolstelsel", None)
+        union_find.find(("node", code))
+        if system:
+            systems[code] = system
+            union_find.union(("node", code), ("system", system))
+
+    opened = get_opened_profiles(hydx, profiles)
+    connection_keys = []
+    for connection in hydx.connections:
+        node_codes = [
+            code
+            for code in (
+                connection.identificatieknooppunt1,
+                connection.identificatieknooppunt2,
+            )
+            if code is not None
+        ]
+        keys = [("node", code) for code in node_codes]
+        if (
+            connection.typeverbinding in PIPE_TYPES
+            and connection.identificatieprofieldefinitie in opened
+        ):
+            keys.append(("profile", connection.identificatieprofieldefinitie))
+            union_find.union(*keys)
+        elif not all(code in systems for code in node_codes):
+            # a connection between two systems does not join them
+            union_find.union(*keys)
+        connection_keys.append(keys)
+
+    # the systems (components) by size, in the order of their first node
+    sizes = Counter()
+    components = {}
+    for node in hydx.connection_nodes:
+        root = union_find.find(("node", node.identificatieknooppuntofverbinding))
+        components.setdefault(root, len(components))
+        sizes[root] += 1
+    connection_roots = []
+    for keys in connection_keys:
+        roots = {union_find.find(key) for key in keys}
+        root = roots.pop() if len(roots) == 1 else None
+        connection_roots.append(root)
+        if root is not None:
+            components.setdefault(root, len(components))
+            sizes[root] += 1
+
+    # pack the systems into one shard per worker, largest first
+    shards = [Shard() for _ in range(min(workers, len(components)))]
+    shared = Shard(
+        node_codes={x.identificatieknooppuntofverbinding for x in hydx.connection_nodes}
+    )
+    shard_of = {}
+    loads = [0] * len(shards)
+    for root in sorted(components, key=lambda x: (-sizes[x], components[x])):
+        index = loads.index(min(loads))
+        shard_of[root] = shards[index]
+        loads[index] += sizes[root]
+
+    for position, node in enumerate(hydx.connection_nodes):
+        root = union_find.find(("node", node.identificatieknooppuntofverbinding))
+        shard_of[root].connection_nodes.append((position, node))
+
+    display_names = get_display_names(hydx)
+    structure_shards = {}
+    # the shard of the surfaces and discharges of a node or pipe
+    record_shards = {}
+    for position, connection in enumerate(hydx.connections):
+        root = connection_roots[position]
+        shard = shared if root is None else shard_of[root]
+        shard.connections.append((position, connection, display_names[position]))
+        code = connection.identificatieknooppuntofverbinding
+        if connection.typeverbinding in STRUCTURE_TYPES:
+            structure_shards.setdefault(code, []).append(shard)
+        elif connection.typeverbinding in PIPE_TYPES:
+            record_shards.setdefault(code, shard)
+    for structure in hydx.structures:
+        shards_of_structure = structure_shards.get(
+            structure.identificatieknooppuntofverbinding, ()
+        )
+        for shard in dict.fromkeys(shards_of_structure, None):
+            shard.structures.append(structure)
+    for shard in shards:
+        for position, node in shard.connection_nodes:
+            record_shards[node.identificatieknooppuntofverbinding] = shard
+
+    # the surfaces are numbered first, then the discharges that can be converted
+    surface_nr = 1
+    for position, surface in enumerate(hydx.surfaces):
+        shard = record_shards.get(surface.identificatieknooppuntofverbinding, shared)
+        shard.surfaces.append((position, surface, surface_nr))
+        surface_nr += 1
+    variation_codes = {x.verloopidentificatie for x in hydx.variations}
+    for position, discharge in enumerate(hydx.discharges):
+        shard = record_shards.get(discharge.identificatieknooppuntofverbinding, shared)
+        shard.discharges.append((position, discharge, surface_nr))
+        if (
+            discharge.verloopidentificatie in variation_codes
+            or discharge.afvoerendoppervlak is not None
+        ):
+            surface_nr += 1
+    for shard in shards + [shared]:
+        codes = {discharge.verloopidentificatie for _, discharge, _ in shard.discharges}
+        shard.variations = [
+            x for x in hydx.variations if x.verloopidentificatie in codes
+        ]
+
+    shards = [shard for shard in shards if len(shard)]
+    if shared.connections or shared.surfaces or shared.discharges:
+        shards.append(shared)
+    return shards
+
+
+# the converted profiles, shared by the worker processes
+_worker_cross_sections = None
+
+
+def _init_worker(cross_sections):
+    global _worker_cross_sections
+    _worker_cross_sections = cross_sections
+
+
+def convert_shard(shard):
+    """Convert a shard, return its converted objects and diagnostics
+
+    Returns:
+        (dict, dict, list): the (position, object) pairs per collection, the
+        profiles that were changed by their index and the diagnostics
+    """
+    threedi = Threedi()
+    threedi.clear()
+    # the conversion changes and adds cross sections, so every shard gets a copy
+    threedi.cross_sections = copy.deepcopy(_worker_cross_sections)
+    profile_count = len(threedi.cross_sections)
+    if shard.node_codes is not None:
+        threedi._connection_node_codes = shard.node_codes
+    recorder = RecordingDiagnostics()
+    collected = {name: [] for name in COLLECTIONS}
+    sizes = {name: len(getattr(threedi, name)) for name in COLLECTIONS}
+
+    def convert(position, method, *args):
+        recorder.position = position
+        method(*args)
+        for name in COLLECTIONS:
+            items = getattr(threedi, name)
+            collected[name].extend((position, x) for x in items[sizes[name] :])
+            sizes[name] = len(items)
+
+    with recorder.activate():
+        for index, node in shard.connection_nodes:
+            convert((NODES, index), threedi.convert_connection_node, node)
+        for index, connection, display_name in shard.connections:
+            convert(
+                (CONNECTIONS, index),
+                threedi.convert_connection,
+                connection,
+                shard.structures,
+                display_name,
+            )
+        for index, surface, surface_nr in shard.surfaces:
+            convert(
+                (SURFACES, index),
+                threedi.add_impervious_surface_from_surface,
+                surface,
+                surface_nr,
+            )
+        for index, discharge, surface_nr in shard.discharges:
+            convert(
+                (DISCHARGES, index),
+                threedi.convert_discharge,
+                discharge,
+                shard.variations,
+                surface_nr,
+            )
+    changed = {
+        index: cross_section
+        for index, cross_section in enumerate(threedi.cross_sections[:profile_count])
+        if cross_section != _worker_cross_sections[index]
+    }
+    return collected, changed, recorder.events
+
+
+def import_hydx_sharded(threedi, hydx, workers):
+    """Convert hydx into threedi with a pool of workers, see the module"""
+    threedi.clear()
+    recorder = RecordingDiagnostics()
+    recorder.position = (PROFILES, 0)
+    with stage("convert profiles", len(hydx.profiles)) as conversion:
+        with recorder.activate():
+            threedi.convert_profiles(hydx.profiles)
+        conversion.records_out = len(threedi.cross_sections)
+    events = recorder.events
+
+    with stage("partition", len(hydx.connection_nodes)) as conversion:
+        shards = partition(hydx, threedi, workers)
+        conversion.records_out = len(shards)
+    if len(shards) < 2:
+        return threedi.import_hydx(hydx)
+    logger.info(
+        "Converting %d shards with %d workers (%s records)",
+        len(shards),
+        workers,
+        ", ".join(str(len(shard)) for shard in shards),
+    )
+
+    collected = {name: [] for name in COLLECTIONS}
+    with stage("convert shards", len(shards)):
+        with ProcessPoolExecutor(
+            max_workers=min(workers, len(shards)) or 1,
+            initializer=_init_worker,
+            initargs=(threedi.cross_sections,),
+        ) as executor:
+            for shard_collected, changed, shard_events in executor.map(
+                convert_shard, shards
+            ):
+                for name in COLLECTIONS:
+                    collected[name].extend(shard_collected[name])
+                for index, cross_section in changed.items():
+                    threedi.cross_sections[index] = cross_section
+                events.extend(shard_events)
+
+    with stage("merge shards"):
+        for name in COLLECTIONS:
+            items = sorted(collected[name], key=itemgetter(0))
+            getattr(threedi, name).extend(item for _, item in items)
+        threedi._connection_node_codes.update(
+            node["code"] for node in threedi.connection_nodes
+        )
+        # the diagnostics as if the records were converted one after the other
+        for _, level, code, message, args, record, file, line in sorted(
+            events, key=itemgetter(0)
+        ):
+            diagnostics.report(
+                threedi_logger,
+                level,
+                code,
+                message,
+                *args,
+                record=record,
+                file=file,
+                line=line,
+            )
+
+    with stage("convert outlets", len(hydx.structures)) as conversion:
+        threedi.convert_outlets(hydx.structures)
+        conversion.records_out = len(threedi.outlets)
@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+"""Reading and atomically writing the files that hydxlib keeps next to others
+
+The checkpoint, fingerprint and content hashes of an export are JSON files
+next to the schematisation. They are written to a temporary file first, so a
+crash never leaves a broken file, and an unreadable file is ignored.
+"""
+import json
+import logging
+import os
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+
+def read_json_sidecar(path, description):
+    """Return the JSON object in a file, {} if it is missing or unreadable"""
+    if not os.path.isfile(path):
+        return {}
+    try:
+        with open(path) as f:
+            content = json.load(f)
+    except (OSError, ValueError):
+        content = None
+    if not isinstance(content, dict):
+        logger.warning("Ignoring unreadable %s %s", description, path)
+        return {}
+    return content
+
+
+@contextmanager
+def open_atomic(path, newline=None):
+    """Open a temporary text file that replaces path when it is closed"""
+    tmp_path = str(path) + ".tmp"
+    try:
+        with open(tmp_path, "w", newline=newline) as f:
+            yield f
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    os.replace(tmp_path, path)
+
+
+def write_json_atomic(path, content, indent=None):
+    with open_atomic(path) as f:
+        json.dump(content, f, indent=indent)
@@ -0,0 +1,397 @@
+# -*- coding: utf-8 -*-
+"""GeoPackage and GeoParquet output for read-only consumers
+
+The connection nodes, pipes, weirs, orifices, pumps and surfaces of a Threedi
+instance are written as plain layers, one row per item with its attributes and
+a geometry built by the vectorized geometry pipeline. Nothing goes through the
+ORM, and every layer is written in chunks of ``chunk_size`` items.
+"""
+import json
+import logging
+import os
+import sqlite3
+import struct
+
+import numpy as np
+import shapely
+from pyproj.crs import CRS
+
+from .exporter import iter_chunks
+from .geometry import (
+    get_lines_between_rows,
+    get_points,
+    get_points_at_rows,
+    get_source_epsg,
+    get_surface_geometries,
+    NodeCoordinates,
+)
+from .threedi import Threedi
+
+logger = logging.getLogger(__name__)
+
+
+def get_node_geometries(node_coordinates, start, items):
+    return get_points(node_coordinates.xy[start : start + len(items)])
+
+
+def get_connection_geometries(node_coordinates, start, items):
+    return get_lines_between_rows(
+        node_coordinates,
+        node_coordinates.lookup([item["start_node.code"] for item in items]),
+        node_coordinates.lookup([item["end_node.code"] for item in items]),
+    )
+
+
+def get_pump_geometries(node_coordinates, start, items):
+    return get_points_at_rows(
+        node_coordinates,
+        node_coordinates.lookup([item["start_node.code"] for item in items]),
+    )
+
+
+def get_square_geometries(node_coordinates, start, items):
+    return get_surface_geometries(node_coordinates, items)[1]
+
+
+# (layer name, Threedi collection, geometry type, geometry function)
+LAYERS = (
+    ("connection_nodes", "connection_nodes", "POINT", get_node_geometries),
+    ("pipes", "pipes", "LINESTRING", get_connection_geometries),
+    ("weirs", "weirs", "LINESTRING", get_connection_geometries),
+    ("orifices", "orifices", "LINESTRING", get_connection_geometries),
+    ("pumps", "pumps", "POINT", get_pump_geometries),
+    ("surfaces", "impervious_surfaces", "POLYGON", get_square_geometries),
+)
+
+
+def get_column_type(types):
+    """Return the column type for the types of the values of a column
+
+    Integers and floats make a float column. A column that mixes strings (or
+    other values) and numbers becomes a str column.
+    """
+    if not types:
+        return str
+    if types == {bool}:
+        return bool
+    if types <= {bool, int}:
+        return int
+    if types <= {bool, int, float}:
+        return float
+    return str
+
+
+def get_columns(items):
+    """Return (key, column name, type) of the attributes of a collection
+
+    The type is derived from all values that are not None (see
+    get_column_type), ``str`` if there are none. Dots in keys (like
+    ``start_node.code``) become underscores.
+    """
+    keys = {}
+    for item in items:
+        for key, value in item.items():
+            if key == "geom":
+                continue
+            types = keys.setdefault(key, set())
+            if value is None:
+                continue
+            for datatype in (bool, int, float):
+                if isinstance(value, datatype):
+                    types.add(datatype)
+                    break
+            else:
+                types.add(str)
+    columns = []
+    for key, types in keys.items():
+        datatype = get_column_type(types)
+        if datatype is str and types - {str}:
+            logger.warning(
+                "Column %s mixes text and numbers, it is written as text", key
+            )
+        columns.append((key, key.replace(".", "_"), datatype))
+    return columns
+
+
+def convert_values(values, datatype):
+    """Convert values to a column type, leaving None as is"""
+    return [None if value is None else datatype(value) for value in values]
+
+
+def write_layers(threedi, writer, chunk_size=None, progress=None):
+    """Write the layers of a Threedi instance with a GeoPackage/GeoParquetWriter
+
+    progress is called as progress(layer, done, total) after each chunk.
+
+    returns: (dict) with the number of rows written per layer
+    """
+    node_coordinates = NodeCoordinates(threedi.connection_nodes, writer.srid)
+    counts = {}
+    try:
+        for name, collection_name, geometry_type, get_geometries in LAYERS:
+            items = getattr(threedi, collection_name)
+            columns = get_columns(items)
+            writer.create_layer(name, columns, geometry_type)
+            for start, chunk in iter_chunks(items, chunk_size):
+                writer.write(
+                    name,
+                    {
+                        column: convert_values(
+                            [item.get(key) for item in chunk], datatype
+                        )
+                        for key, column, datatype in columns
+                    },
+                    get_geometries(node_coordinates, start, chunk),
+                )
+                if progress is not None:
+                    progress(name, start + len(chunk), len(items))
+            counts[name] = len(items)
+            logger.info("Wrote %d %s", len(items), name)
+    finally:
+        writer.close()
+    return counts
+
+
+def export_geopackage(
+    hydx, path, target_epsg=None, chunk_size=None, workers=None, progress=None
+):
+    """Write the converted hydx delivery to a GeoPackage
+
+    An existing file at path is replaced. The target EPSG defaults to the one of
+    the connection nodes.
+    """
+    threedi = Threedi()
+    threedi.import_hydx(hydx, workers=workers)
+    if target_epsg is None:
+        target_epsg = get_source_epsg(threedi.connection_nodes)
+    return write_layers(
+        threedi, GeoPackageWriter(path, target_epsg), chunk_size, progress
+    )
+
+
+def export_geoparquet(
+    hydx, path, target_epsg=None, chunk_size=None, workers=None, progress=None
+):
+    """Write the converted hydx delivery as GeoParquet files, one per layer
+
+    The files are written into the directory at path as ``<layer>.parquet``.
+    Requires pyarrow.
+    """
+    threedi = Threedi()
+    threedi.import_hydx(hydx, workers=workers)
+    if target_epsg is None:
+        target_epsg = get_source_epsg(threedi.connection_nodes)
+    return write_layers(
+        threedi, GeoParquetWriter(path, target_epsg), chunk_size, progress
+    )
+
+
+GPKG_APPLICATION_ID = 0x47504B47  # "GPKG"
+GPKG_USER_VERSION = 10300  # version 1.3.0
+
+GPKG_TABLES = """
+CREATE TABLE gpkg_spatial_ref_sys (
+    srs_name TEXT NOT NULL,
+    srs_id INTEGER NOT NULL PRIMARY KEY,
+    organization TEXT NOT NULL,
+    organization_coordsys_id INTEGER NOT NULL,
+    definition TEXT NOT NULL,
+    description TEXT
+);
+CREATE TABLE gpkg_contents (
+    table_name TEXT NOT NULL PRIMARY KEY,
+    data_type TEXT NOT NULL,
+    identifier TEXT UNIQUE,
+    description TEXT DEFAULT '',
+    last_change DATETIME NOT NULL DEFAULT (strftime('%Y-%m-%dT%H:%M:%fZ','now')),
+    min_x DOUBLE,
+    min_y DOUBLE,
+    max_x DOUBLE,
+    max_y DOUBLE,
+    srs_id INTEGER,
+    CONSTRAINT fk_gc_r_srs_id FOREIGN KEY (srs_id)
+        REFERENCES gpkg_spatial_ref_sys(srs_id)
+);
+CREATE TABLE gpkg_geometry_columns (
+    table_name TEXT NOT NULL,
+    column_name TEXT NOT NULL,
+    geometry_type_name TEXT NOT NULL,
+    srs_id INTEGER NOT NULL,
+    z TINYINT NOT NULL,
+    m TINYINT NOT NULL,
+    CONSTRAINT pk_geom_cols PRIMARY KEY (table_name, column_name),
+    CONSTRAINT fk_gc_tn FOREIGN KEY (table_name)
+        REFERENCES gpkg_contents(table_name),
+    CONSTRAINT fk_gc_srs FOREIGN KEY (srs_id)
+        REFERENCES gpkg_spatial_ref_sys (srs_id)
+);
+"""
+
+SQLITE_TYPES = {bool: "BOOLEAN", int: "INTEGER", float: "DOUBLE", str: "TEXT"}
+
+
+def to_gpkg_blobs(geometries, srid):
+    """Return GeoPackage geometry blobs: a header without envelope and WKB"""
+    header = b"GP\x00\x01" + struct.pack("<i", srid)
+    return [
+        None if wkb is None else header + wkb
+        for wkb in shapely.to_wkb(geometries, output_dimension=2, byte_order=1)
+    ]
+
+
+def update_bounds(bounds, geometries):
+    """Return the bounds extended with the bounds of geometries"""
+    chunk_bounds = shapely.total_bounds(geometries)
+    if np.isnan(chunk_bounds).any():
+        return bounds
+    if bounds is None:
+        return chunk_bounds
+    return np.concatenate(
+        [
+            np.minimum(bounds[:2], chunk_bounds[:2]),
+            np.maximum(bounds[2:], chunk_bounds[2:]),
+        ]
+    )
+
+
+class GeoPackageWriter:
+    """Write layers to a new GeoPackage with plain SQLite bulk inserts"""
+
+    def __init__(self, path, srid):
+        self.path = path
+        self.srid = srid
+        self.bounds = {}
+        if os.path.exists(path):
+            os.remove(path)
+        self.connection = sqlite3.connect(path)
+        self.connection.execute("PRAGMA application_id = %d" % GPKG_APPLICATION_ID)
+        self.connection.execute("PRAGMA user_version = %d" % GPKG_USER_VERSION)
+        self.connection.executescript(GPKG_TABLES)
+        crs = CRS.from_epsg(srid)
+        self.connection.executemany(
+            "INSERT INTO gpkg_spatial_ref_sys VALUES (?, ?, ?, ?, ?, ?)",
+            [
+                ("Undefined cartesian SRS", -1, "NONE", -1, "undefined", None),
+                ("Undefined geographic SRS", 0, "NONE", 0, "undefined", None),
+                (
+                    "WGS 84 geodetic",
+                    4326,
+                    "EPSG",
+                    4326,
+                    CRS.from_epsg(4326).to_wkt("WKT1_GDAL"),
+                    None,
+                ),
+            ]
+            + (
+                []
+                if srid == 4326
+                else [(crs.name, srid, "EPSG", srid, crs.to_wkt("WKT1_GDAL"), None)]
+            ),
+        )
+        self.connection.commit()
+
+    def create_layer(self, name, columns, geometry_type):
+        column_definitions = "".join(
+            f', "{column}" {SQLITE_TYPES[datatype]}' for _, column, datatype in columns
+        )
+        self.connection.execute(
+            f'CREATE TABLE "{name}" (fid INTEGER PRIMARY KEY AUTOINCREMENT, '
+            f"geom {geometry_type}{column_definitions})"
+        )
+        self.connection.execute(
+            "INSERT INTO gpkg_contents (table_name, data_type, identifier, srs_id) "
+            "VALUES (?, 'features', ?, ?)",
+            (name, name, self.srid),
+        )
+        self.connection.execute(
+            "INSERT INTO gpkg_geometry_columns VALUES (?, 'geom', ?, ?, 0, 0)",
+            (name, geometry_type, self.srid),
+        )
+        self.bounds[name] = None
+
+    def write(self, name, columns, geometries):
+        placeholders = ", ".join(["?"] * (len(columns) + 1))
+        column_names = "".join(f', "{column}"' for column in columns)
+        self.connection.executemany(
+            f'INSERT INTO "{name}" (geom{column_names}) VALUES ({placeholders})',
+            zip(to_gpkg_blobs(geometries, self.srid), *columns.values()),
+        )
+        self.connection.commit()
+        self.bounds[name] = update_bounds(self.bounds[name], geometries)
+
+    def close(self):
+        for name, bounds in self.bounds.items():
+            if bounds is not None:
+                self.connection.execute(
+                    "UPDATE gpkg_contents SET min_x = ?, min_y = ?, max_x = ?, "
+                    "max_y = ? WHERE table_name = ?",
+                    (*bounds.tolist(), name),
+                )
+        self.connection.commit()
+        self.connection.close()
+
+
+GEOPARQUET_TYPES = {
+    "POINT": "Point",
+    "LINESTRING": "LineString",
+    "POLYGON": "Polygon",
+}
+
+
+class GeoParquetWriter:
+    """Write layers as GeoParquet 1.0 files with WKB geometries
+
+    Every chunk becomes a row group of the file of its layer.
+    """
+
+    def __init__(self, path, srid):
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            raise ImportError("Writing GeoParquet requires pyarrow") from None
+        self.path = path
+        self.srid = srid
+        self.writers = {}
+        os.makedirs(path, exist_ok=True)
+
+    def create_layer(self, name, columns, geometry_type):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        types = {
+            bool: pa.bool_(),
+            int: pa.int64(),
+            float: pa.float64(),
+            str: pa.string(),
+        }
+        geo = {
+            "version": "1.0.0",
+            "primary_column": "geom",
+            "columns": {
+                "geom": {
+                    "encoding": "WKB",
+                    "geometry_types": [GEOPARQUET_TYPES[geometry_type]],
+                    "crs": CRS.from_epsg(self.srid).to_json_dict(),
+                }
+            },
+        }
+        schema = pa.schema(
+            [pa.field("geom", pa.binary())]
+            + [pa.field(column, types[datatype]) for _, column, datatype in columns],
+            metadata={"geo": json.dumps(geo)},
+        )
+        self.writers[name] = pq.ParquetWriter(
+            os.path.join(self.path, f"{name}.parquet"), schema, compression="zstd"
+        )
+
+    def write(self, name, columns, geometries):
+        import pyarrow as pa
+
+        writer = self.writers[name]
+        data = {"geom": shapely.to_wkb(geometries, output_dimension=2).tolist()}
+        data.update(columns)
+        writer.write_table(pa.Table.from_pydict(data, schema=writer.schema))
+
+    def close(self):
+        for writer in self.writers.values():
+            writer.close()
@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+"""Hydx deliveries in a directory or in a zip archive
+
+A hydx file, for instance ``Knooppunt.csv``, may also be stored compressed as
+``Knooppunt.csv.gz`` or ``Knooppunt.csv.zst`` (zstd requires the zstandard
+package). In a zip archive, the files may be in a subdirectory. Files are
+decompressed while they are read; nothing is extracted to disk.
+"""
+import gzip
+import io
+import logging
+import os
+import zipfile
+
+logger = logging.getLogger(__name__)
+
+COMPRESSIONS = ("", ".gz", ".zst")
+
+
+def open_source(hydx_path):
+    """Return the source of the hydx files at hydx_path (a directory or a zip)"""
+    if os.path.isfile(hydx_path) and zipfile.is_zipfile(hydx_path):
+        return ZipSource(hydx_path)
+    return DirectorySource(hydx_path)
+
+
+def get_log_dir(hydx_path):
+    """Return the hydx directory, or the directory of the zip archive"""
+    hydx_path = os.path.abspath(hydx_path)
+    if os.path.isdir(hydx_path):
+        return hydx_path
+    return os.path.dirname(hydx_path)
+
+
+def decompress(f, name):
+    """Return a binary stream with the decompressed content of file f"""
+    if name.endswith(".gz"):
+        decompressed = gzip.GzipFile(fileobj=f)
+        # GzipFile only closes the files it opened itself
+        decompressed.myfileobj = f
+        return decompressed
+    if name.endswith(".zst"):
+        try:
+            import zstandard
+        except ImportError:
+            raise ImportError("Reading .zst files requires zstandard") from None
+        return zstandard.ZstdDecompressor().stream_reader(f)
+    return f
+
+
+class Source:
+    """Base class of the sources: find and open the (compressed) hydx files"""
+
+    def __init__(self, path):
+        self.path = path
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        pass
+
+    def find(self, csvfilename):
+        """Return the name of the (compressed) file of csvfilename, or None"""
+        for compression in COMPRESSIONS:
+            name = csvfilename + compression
+            if self.exists(name):
+                return name
+
+    def describe(self, name):
+        """Return the path of a file for messages"""
+        return os.path.join(self.path, name)
+
+    def open_binary(self, csvfilename):
+        """Return a binary stream with the decompressed content of a hydx file"""
+        name = self.find(csvfilename)
+        if name is None:
+            raise FileNotFoundError(self.describe(csvfilename))
+        return decompress(self.open_raw(name), name)
+
+    def open(self, csvfilename):
+        """Return a text stream of a hydx file, for csv.reader"""
+        return io.TextIOWrapper(
+            self.open_binary(csvfilename), encoding="utf-8-sig", newline=""
+        )
+
+
+class DirectorySource(Source):
+    def exists(self, name):
+        return os.path.isfile(os.path.join(self.path, name))
+
+    def open_raw(self, name):
+        return open(os.path.join(self.path, name), "rb")
+
+
+class ZipSource(Source):
+    def __init__(self, path):
+        super().__init__(path)
+        self.zipfile = zipfile.ZipFile(path)
+        # the files by name, also if the zip has them in a subdirectory
+        self.members = {}
+        for info in self.zipfile.infolist():
+            name = info.filename.rsplit("/", 1)[-1]
+            if info.is_dir() or info.filename.startswith("__MACOSX/"):
+                continue
+            if name in self.members:
+                logger.warning(
+                    "%s contains %s more than once, using %s",
+                    path,
+                    name,
+                    self.members[name].filename,
+                )
+                continue
+            self.members[name] = info
+
+    def close(self):
+        self.zipfile.close()
+
+    def exists(self, name):
+        return name in self.members
+
+    def describe(self, name):
+        info = self.members.get(name)
+        return os.path.join(self.path, info.filename if info else name)
+
+    def open_raw(self, name):
+        return self.zipfile.open(self.members[name])
@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+import logging
+import os
+import sqlite3
+import sys
+from contextlib import contextmanager
+
+from threedi_schema import ThreediDatabase
+
+logger = logging.getLogger(__name__)
+
+# Schematisations larger than this are written directly instead of being staged
+# in memory; the staging copy holds the complete database in RAM.
+DEFAULT_MAX_STAGING_SIZE = 512 * 1024 * 1024
+
+
+def get_driver_connection(engine):
+    """Return the sqlite3 connection underlying an in-memory engine
+
+    In-memory engines use a SingletonThreadPool, so this is the very connection
+    that sessions bound to the engine use in the current thread.
+    """
+    connection = engine.raw_connection()
+    driver_connection = connection.driver_connection
+    connection.close()
+    return driver_connection
+
+
+def get_peak_memory():
+    """Return the peak resident memory of the process in bytes, None if unknown"""
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def get_database_size(connection):
+    page_count = connection.execute("PRAGMA page_count").fetchone()[0]
+    page_size = connection.execute("PRAGMA page_size").fetchone()[0]
+    return page_count * page_size
+
+
+@contextmanager
+def staging_database(db, max_size=DEFAULT_MAX_STAGING_SIZE):
+    """Stage a schematisation in memory and flush it back to disk on success
+
+    The file behind ``db`` is copied into an in-memory (SpatiaLite) database with
+    the SQLite backup API. The yielded ThreediDatabase refers to that copy. When
+    the block exits without errors, the copy is written back to the original file
+    in one sequential pass. On errors the original file is left untouched.
+
+    If the file is larger than ``max_size`` bytes, ``db`` itself is yielded and
+    all writes go directly to disk.
+    """
+    size = os.path.getsize(db.path)
+    if size > max_size:
+        logger.warning(
+            "Schematisation %s is too large for in-memory staging (%d bytes), "
+            "writing directly to disk",
+            db.path,
+            size,
+        )
+        yield db
+        return
+
+    peak_before = get_peak_memory()
+    staging_db = ThreediDatabase("")
+    engine = staging_db.get_engine()
+    try:
+        memory_connection = get_driver_connection(engine)
+        source = sqlite3.connect(db.path)
+        try:
+            source.backup(memory_connection)
+        finally:
+            source.close()
+
+        yield staging_db
+
+        logger.info(
+            "In-memory staging database reached %.1f MiB",
+            get_database_size(memory_connection) / 2**20,
+        )
+        target = sqlite3.connect(db.path)
+        try:
+            memory_connection.backup(target)
+        finally:
+            target.close()
+        peak = get_peak_memory()
+        if peak is not None:
+            logger.info(
+                "Peak memory use while staging: %.1f MiB (%.1f MiB above the "
+                "peak before staging)",
+                peak / 2**20,
+                max(peak - peak_before, 0) / 2**20,
+            )
+    finally:
+        engine.dispose()
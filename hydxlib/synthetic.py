@@ -0,0 +1,339 @@
+# -*- coding: utf-8 -*-
+"""Synthetic GWSW-hydx networks for benchmarks
+
+The network consists of sewerage systems (RST_IDE) of ``system_size`` nodes.
+Each system is a grid of manholes at 50 m distance, drained by pipes towards
+its first manhole; every 8th column has cross connections, so the network has
+loops. From the first manholes a pump, a weir and (for every 5th system) an
+orifice discharge to an outlet node of the system. Pipes get surfaces and dry
+weather flow. Profiles grow towards the outlet and bed levels rise upstream.
+
+Everything is written row by row, so networks of millions of nodes can be
+generated with little memory. The same seed gives the same network.
+"""
+import csv
+import math
+import os
+import random
+
+from .hydx import Hydx
+
+SYSTEM_SIZE = 1000
+GRID_WIDTH = 40
+SPACING = 50.0
+LOOP_COLUMN_INTERVAL = 8
+ORIFICE_SYSTEM_INTERVAL = 5
+ORIGIN = (100000.0, 400000.0)
+
+PROFILES = [("PVC", "RND", diameter, None) for diameter in (250, 315, 400)] + [
+    ("BET", "RND", diameter, None) for diameter in range(500, 1100, 100)
+]
+RECTANGULAR_PROFILES = [("BET", "RHK", 1200, 800), ("BET", "RHK", 1500, 1000)]
+
+# (AFV_IDE, relative frequency, median area in m2)
+SURFACE_TYPES = [
+    ("GVH_VLA", 40, 200),
+    ("OVH_VLA", 20, 150),
+    ("DAK_HEL", 20, 100),
+    ("DAK_VLA", 15, 120),
+    ("ONV_VLU", 5, 300),
+]
+SURFACE_MEDIANS = {surface_type: median for surface_type, _, median in SURFACE_TYPES}
+
+# hourly distribution of the dry weather flow, in percent
+INHABITANT_PATTERN = [1.5] * 5 + [3, 4, 5, 6, 6.5, 7.5, 8.5, 7.5, 6.5, 6, 5, 5, 5]
+INHABITANT_PATTERN += [4, 3.5, 3, 2.5, 2, 2]
+COMPANY_PATTERN = [0] * 8 + [10] * 10 + [0] * 6
+
+
+def get_profile_code(profile):
+    material, shape, width, height = profile
+    return f"{material}{width}" if height is None else f"{material}{width}x{height}"
+
+
+def get_system_sizes(node_count, system_size=SYSTEM_SIZE):
+    """Split node_count into systems; a system has at least 4 nodes"""
+    if node_count < 4:
+        raise ValueError("A synthetic network needs at least 4 nodes")
+    sizes = [system_size] * (node_count // system_size)
+    remainder = node_count % system_size
+    if remainder >= 4 or not sizes:
+        sizes.append(remainder)
+    else:
+        sizes[-1] += remainder
+    return sizes
+
+
+def get_bed_level(row, column):
+    """Bed level of a manhole, rising with the distance to the first manhole"""
+    return -1.5 + (row + column) * SPACING * 0.0005
+
+
+def get_pipe_profile(row, column):
+    """Larger profiles towards the first manhole of the system"""
+    distance = row + column
+    if distance < 2:
+        return RECTANGULAR_PROFILES[1 - distance]
+    index = max(len(PROFILES) - 1 - (distance - 2) // 4, 0)
+    return PROFILES[index]
+
+
+class CsvWriters:
+    """One csv.DictWriter per hydx file, with the row counts"""
+
+    def __init__(self, hydx_path):
+        self.files = {}
+        self.writers = {}
+        self.counts = {}
+        for filename, information in Hydx.CSVFILES.items():
+            f = open(os.path.join(hydx_path, filename), "w", newline="")
+            writer = csv.DictWriter(
+                f,
+                information["hydx_class"].csvheaders(),
+                delimiter=";",
+                restval="",
+                lineterminator="\n",
+            )
+            writer.writeheader()
+            self.files[filename] = f
+            self.writers[filename] = writer
+            self.counts[filename] = 0
+
+    def write(self, filename, row):
+        self.writers[filename].writerow(row)
+        self.counts[filename] += 1
+
+    def close(self):
+        for f in self.files.values():
+            f.close()
+
+
+def generate_hydx(hydx_path, node_count, seed=0, system_size=SYSTEM_SIZE):
+    """Write a synthetic hydx network of node_count nodes to hydx_path
+
+    returns: (dict) with the number of rows written per file
+    """
+    os.makedirs(hydx_path, exist_ok=True)
+    rng = random.Random(seed)
+    writers = CsvWriters(hydx_path)
+    try:
+        write_profiles(writers)
+        write_variations(writers)
+        sizes = get_system_sizes(node_count, system_size)
+        systems_per_row = math.ceil(math.sqrt(len(sizes)))
+        first_node = 0
+        pipe_nr = 0
+        for system_nr, size in enumerate(sizes):
+            origin = (
+                ORIGIN[0] + (system_nr % systems_per_row) * (GRID_WIDTH + 10) * SPACING,
+                ORIGIN[1]
+                + (system_nr // systems_per_row)
+                * (system_size // GRID_WIDTH + 10)
+                * SPACING,
+            )
+            pipe_nr = write_system(
+                writers, rng, system_nr, size, first_node, pipe_nr, origin
+            )
+            first_node += size
+    finally:
+        writers.close()
+    return writers.counts
+
+
+def write_profiles(writers):
+    for profile in PROFILES + RECTANGULAR_PROFILES:
+        material, shape, width, height = profile
+        writers.write(
+            "Profiel.csv",
+            {
+                "PRO_IDE": get_profile_code(profile),
+                "PRO_MAT": material,
+                "PRO_VRM": shape,
+                "PRO_BRE": width,
+                "PRO_HGT": "" if height is None else height,
+            },
+        )
+
+
+def write_variations(writers):
+    for name, volume, pattern in (
+        ("Inwoner", 0.12, INHABITANT_PATTERN),
+        ("Bedrijf", 0.06, COMPANY_PATTERN),
+    ):
+        row = {"VER_IDE": name, "VER_TYP": "DAG", "VER_VOL": volume}
+        row.update({f"U{hour:02d}_DAG": value for hour, value in enumerate(pattern)})
+        writers.write("Verloop.csv", row)
+
+
+def write_system(writers, rng, system_nr, size, first_node, pipe_nr, origin):
+    """Write the nodes, pipes, structures and loads of one system
+
+    returns: (int) the number of pipes written so far
+    """
+    system = f"{system_nr + 1:02d}/Gemengd"
+    grid_size = size - 1  # the last node is the outlet
+    outlet = f"knp{first_node + grid_size + 1}"
+
+    def node_code(index):
+        return f"knp{first_node + index + 1}"
+
+    for index in range(grid_size):
+        row, column = divmod(index, GRID_WIDTH)
+        bed_level = get_bed_level(row, column)
+        width = rng.choice((1000, 1000, 1000, 1250, 1500))
+        writers.write(
+            "Knooppunt.csv",
+            {
+                "UNI_IDE": node_code(index),
+                "RST_IDE": system,
+                "PUT_IDE": str(first_node + index + 1),
+                "KNP_XCO": "%.2f" % (origin[0] + column * SPACING + rng.gauss(0, 3)),
+                "KNP_YCO": "%.2f" % (origin[1] + row * SPACING + rng.gauss(0, 3)),
+                "MVD_NIV": "%.2f" % (bed_level + 1.5 + rng.uniform(0, 1.5)),
+                "MVD_SCH": rng.choices(("RES", "VRL", "KNV"), (7, 2, 1))[0],
+                "WOS_OPP": 100,
+                "KNP_MAT": "BET",
+                "KNP_VRM": "RND" if width == 1000 else "RHK",
+                "KNP_BOK": "%.2f" % (bed_level - 0.05),
+                "KNP_BRE": width,
+                "KNP_LEN": width,
+                "KNP_TYP": "INS",
+            },
+        )
+    writers.write(
+        "Knooppunt.csv",
+        {
+            "UNI_IDE": outlet,
+            "RST_IDE": system,
+            "PUT_IDE": str(first_node + grid_size + 1),
+            "KNP_XCO": "%.2f" % (origin[0] - 2 * SPACING),
+            "KNP_YCO": "%.2f" % origin[1],
+            "MVD_NIV": "1.00",
+            "MVD_SCH": "RES",
+            "KNP_VRM": "RND",
+            "KNP_BOK": "-2.00",
+            "KNP_BRE": 1000,
+            "KNP_TYP": "UIT",
+        },
+    )
+    writers.write("Kunstwerk.csv", {"UNI_IDE": outlet, "KWK_TYP": "UIT", "BWS_NIV": -1})
+
+    for index in range(1, grid_size):
+        row, column = divmod(index, GRID_WIDTH)
+        downstream = [index - 1] if column > 0 else [index - GRID_WIDTH]
+        if column > 0 and column % LOOP_COLUMN_INTERVAL == 0 and row > 0:
+            downstream.append(index - GRID_WIDTH)
+        for other in downstream:
+            pipe_nr += 1
+            write_pipe(
+                writers,
+                rng,
+                f"lei{pipe_nr}",
+                node_code(index),
+                node_code(other),
+                get_bed_level(row, column),
+                get_bed_level(*divmod(other, GRID_WIDTH)),
+                get_pipe_profile(row, column),
+            )
+
+    write_structures(writers, rng, system_nr, node_code, outlet, grid_size)
+    return pipe_nr
+
+
+def write_pipe(writers, rng, code, start, end, start_level, end_level, profile):
+    writers.write(
+        "Verbinding.csv",
+        {
+            "UNI_IDE": code,
+            "KN1_IDE": start,
+            "KN2_IDE": end,
+            "VRB_TYP": "GSL",
+            "BOB_KN1": "%.2f" % start_level,
+            "BOB_KN2": "%.2f" % end_level,
+            "STR_RCH": "OPN",
+            "VRB_LEN": "%.2f" % SPACING,
+            "INZ_TYP": "GMD",
+            "PRO_IDE": get_profile_code(profile),
+            "STA_OBJ": "ACT",
+        },
+    )
+    surface_types, weights, _ = zip(*SURFACE_TYPES)
+    for surface_type in sorted(
+        set(rng.choices(surface_types, weights, k=rng.randint(1, 3)))
+    ):
+        median = SURFACE_MEDIANS[surface_type]
+        writers.write(
+            "Oppervlak.csv",
+            {
+                "UNI_IDE": code,
+                "AFV_DEF": "nwrw.csv",
+                "AFV_IDE": surface_type,
+                "AFV_OPP": "%.0f" % (median * rng.lognormvariate(0, 0.5)),
+            },
+        )
+    dice = rng.random()
+    if dice < 0.35:
+        variation, units = ("Inwoner", 30) if dice < 0.3 else ("Bedrijf", 10)
+        units = rng.randint(1, units)
+        writers.write(
+            "Debiet.csv",
+            {
+                "UNI_IDE": code,
+                "DEB_TYP": "VWD",
+                "VER_IDE": variation,
+                "AVV_ENH": units,
+                "AFV_OPP": units * 40,
+            },
+        )
+
+
+def write_structures(writers, rng, system_nr, node_code, outlet, grid_size):
+    """A pump, a weir and sometimes an orifice from the first nodes to the outlet"""
+    system_code = system_nr + 1
+    bed_level = get_bed_level(0, 0)
+    structures = [
+        (
+            f"pmp{system_code}",
+            node_code(0),
+            {
+                "KWK_TYP": "PMP",
+                "PMP_CAP": "%.1f" % rng.uniform(36, 360),
+                "PMP_AN1": "%.2f" % (bed_level + 0.5),
+                "PMP_AF1": "%.2f" % (bed_level + 0.1),
+            },
+            {"STR_RCH": "1_2"},
+        ),
+        (
+            f"ovs{system_code}",
+            node_code(min(GRID_WIDTH, grid_size - 1)),
+            {
+                "KWK_TYP": "OVS",
+                "OVS_BRE": "%.2f" % rng.uniform(2, 6),
+                "OVS_NIV": "%.2f" % rng.uniform(1, 2),
+                "OVS_COE": "0.800",
+            },
+            {"STR_RCH": "OPN"},
+        ),
+    ]
+    if system_nr % ORIFICE_SYSTEM_INTERVAL == 0:
+        structures.append(
+            (
+                f"drl{system_code}",
+                node_code(1),
+                {"KWK_TYP": "DRL", "PRO_BOK": "%.2f" % bed_level, "DRL_COE": "0.600"},
+                {"STR_RCH": "1_2", "PRO_IDE": "PVC400"},
+            )
+        )
+    for code, start, structure, connection in structures:
+        writers.write(
+            "Verbinding.csv",
+            {
+                "UNI_IDE": code,
+                "KN1_IDE": start,
+                "KN2_IDE": outlet,
+                "VRB_TYP": structure["KWK_TYP"],
+                "INZ_TYP": "NVT",
+                **connection,
+            },
+        )
+        writers.write("Kunstwerk.csv", {"UNI_IDE": code, **structure})
@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+"""Tests for aio.py"""
+import asyncio
+import threading
+import time
+from unittest import mock
+
+import pytest
+
+from hydxlib.aio import Cancelled, Conversion, export_async, import_hydx_async
+from hydxlib.diagnostics import Diagnostics
+from hydxlib.importer import import_hydx
+
+EXAMPLE_PATH = "hydxlib/tests/example_files_structures_hydx/"
+
+
+def test_import_hydx_async():
+    events = []
+    diagnostics = Diagnostics()
+
+    async def run():
+        with diagnostics.activate():
+            return await import_hydx_async(EXAMPLE_PATH, progress=events.append)
+
+    hydx = asyncio.run(run())
+    expected = import_hydx(EXAMPLE_PATH)
+    for name in ("connection_nodes", "connections", "surfaces", "variations"):
+        assert repr(getattr(hydx, name)) == repr(getattr(expected, name))
+    assert len(events) == 7
+    assert {event.kind for event in events} == {"parsed"}
+    assert events[-1].done == events[-1].total == 7
+    # diagnostics of the worker processes are added to the active collector
+    assert diagnostics["duplicate-id"].count == 1
+
+
+def test_import_hydx_async_cancel():
+    cancel = threading.Event()
+    cancel.set()
+    with pytest.raises(Cancelled):
+        asyncio.run(import_hydx_async(EXAMPLE_PATH, cancel=cancel))
+
+
+written = []
+
+
+def fake_convert_hydx(hydx_path, out_path, progress=None, load_hydx=None, **options):
+    load_hydx(hydx_path)
+    for done in range(10, 101, 10):
+        written.append(done)
+        progress("pipes", done, 100)
+    return {"pipes": 100}
+
+
+@mock.patch("hydxlib.aio.convert_hydx", fake_convert_hydx)
+def test_export_async_cancel():
+    cancel = threading.Event()
+    cancel.set()
+    written.clear()
+    with pytest.raises(Cancelled):
+        asyncio.run(export_async(None, "a", "a.sqlite", cancel=cancel))
+    # the writer thread stops after the first chunk
+    assert written == [10]
+
+
+def test_export_async_task_cancelled():
+    started = threading.Event()
+    stopped = threading.Event()
+    chunks = []
+
+    def slow_convert_hydx(hydx_path, out_path, progress=None, **options):
+        try:
+            for done in range(1, 1001):
+                chunks.append(done)
+                started.set()
+                progress("pipes", done, 1000)
+                time.sleep(0.01)
+        finally:
+            stopped.set()
+
+    async def run():
+        task = asyncio.ensure_future(export_async(None, "a", "a.sqlite"))
+        await asyncio.get_running_loop().run_in_executor(None, started.wait, 10)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    with mock.patch("hydxlib.aio.convert_hydx", slow_convert_hydx):
+        asyncio.run(run())
+        # the writer thread stops at its next chunk instead of writing on
+        assert stopped.wait(10)
+    assert len(chunks) < 1000
+
+
+def test_conversion(tmp_path):
+    conversion = Conversion(
+        EXAMPLE_PATH, str(tmp_path / "out.gpkg"), output_format="gpkg"
+    )
+
+    async def run():
+        return [event async for event in conversion]
+
+    events = asyncio.run(run())
+    kinds = [event.kind for event in events]
+    stage = kinds.index("stage")
+    assert events[stage] == ("stage", "import", None, None)
+    assert set(kinds[stage + 1 : -1]) == {"written"}
+    assert events[-2] == ("written", "surfaces", 330, 330)
+    assert events[-1] == ("stage", "export", None, None)
+    assert conversion.commit_counts["pipes"] == 80
+
+
+def test_conversion_cancel(tmp_path):
+    conversion = Conversion(
+        EXAMPLE_PATH, str(tmp_path / "out.gpkg"), output_format="gpkg"
+    )
+
+    async def run():
+        async for event in conversion:
+            conversion.cancel()
+
+    with pytest.raises(Cancelled):
+        asyncio.run(run())
+    assert conversion.commit_counts is None
+    assert not (tmp_path / "out.gpkg").exists()
@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+"""Tests for batch.py"""
+import json
+import shutil
+
+import pytest
+
+from hydxlib.batch import (
+    format_summary,
+    read_manifest,
+    run_batch,
+    run_job,
+    write_summary,
+)
+
+EXAMPLE_PATH = "hydxlib/tests/example_files_structures_hydx/"
+
+
+@pytest.mark.parametrize("delimiter", [",", ";"])
+def test_read_manifest_csv(tmp_path, delimiter):
+    manifest_path = tmp_path / "manifest.csv"
+    manifest_path.write_text(
+        f"hydx_path{delimiter}out_path\na{delimiter}a.sqlite\n/b{delimiter}/b.sqlite\n"
+    )
+    assert read_manifest(manifest_path) == [
+        (str(tmp_path / "a"), str(tmp_path / "a.sqlite")),
+        ("/b", "/b.sqlite"),
+    ]
+
+
+def test_read_manifest_csv_missing_column(tmp_path):
+    manifest_path = tmp_path / "manifest.csv"
+    manifest_path.write_text("hydx_path;output\na;a.sqlite\n")
+    with pytest.raises(ValueError, match="out_path"):
+        read_manifest(manifest_path)
+
+
+@pytest.mark.parametrize(
+    "content",
+    [
+        [{"hydx_path": "a", "out_path": "a.sqlite"}],
+        {"a": "a.sqlite"},
+    ],
+)
+def test_read_manifest_json(tmp_path, content):
+    manifest_path = tmp_path / "manifest.json"
+    manifest_path.write_text(json.dumps(content))
+    assert read_manifest(manifest_path) == [
+        (str(tmp_path / "a"), str(tmp_path / "a.sqlite"))
+    ]
+
+
+def test_run_job_failure(tmp_path):
+    result = run_job(str(tmp_path / "missing"), str(tmp_path / "out.gpkg"))
+    assert result["status"] == "failed"
+    assert "does not exist" in result["error"]
+
+
+def test_run_batch(tmp_path):
+    shutil.copytree(EXAMPLE_PATH, tmp_path / "hydx")
+    jobs = [
+        (str(tmp_path / "hydx"), str(tmp_path / "out.gpkg")),
+        (str(tmp_path / "missing"), str(tmp_path / "missing.gpkg")),
+    ]
+    results = run_batch(jobs, workers=2, output_format="gpkg")
+    assert [result["status"] for result in results] == ["ok", "failed"]
+    assert results[0]["commit_counts"]["pipes"] == 80
+    assert (tmp_path / "out.gpkg").exists()
+    assert (tmp_path / "hydx" / "import_hydx_hydxlib.diagnostics.csv").exists()
+
+
+RESULTS = [
+    {
+        "hydx_path": "a",
+        "out_path": "a.sqlite",
+        "status": "ok",
+        "duration": 1.5,
+        "commit_counts": {"pipes": 80, "pumps": 8},
+        "error": None,
+    },
+    {
+        "hydx_path": "b",
+        "out_path": "b.sqlite",
+        "status": "failed",
+        "duration": 0.1,
+        "commit_counts": None,
+        "error": "FileNotFoundError: b",
+    },
+]
+
+
+def test_format_summary():
+    lines = format_summary(RESULTS)
+    assert "pipes: 80, pumps: 8" in lines[1]
+    assert "FileNotFoundError: b" in lines[2]
+    assert lines[-1] == "1 of 2 deliveries failed"
+
+
+@pytest.mark.parametrize("filename", ["summary.csv", "summary.json"])
+def test_write_summary(tmp_path, filename):
+    write_summary(RESULTS, tmp_path / filename)
+    content = (tmp_path / filename).read_text()
+    assert "FileNotFoundError: b" in content
+    assert not (tmp_path / (filename + ".tmp")).exists()
@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+"""Tests for benchmark.py"""
+import pytest
+
+from hydxlib.benchmark import (
+    calibrate,
+    compare,
+    format_comparison,
+    load_results,
+    run_benchmark,
+    save_results,
+)
+
+
+def get_results(time, memory_peak, node_count=100):
+    return {
+        "node_count": node_count,
+        "seed": 0,
+        "calibration": 0.1,
+        "stages": {"convert connections": {"time": time, "memory_peak": memory_peak}},
+    }
+
+
+def test_calibrate():
+    assert calibrate(repeat=1) > 0
+
+
+def test_compare_no_regressions():
+    assert compare(get_results(10, 50e6), get_results(11, 52e6)) == []
+
+
+def test_compare_time_regression():
+    assert compare(get_results(10, 50e6), get_results(13, 50e6)) == [
+        ("convert connections", "time", 10, 13)
+    ]
+
+
+def test_compare_ignores_fast_stages():
+    assert compare(get_results(0.1, 50e6), get_results(0.3, 50e6)) == []
+
+
+def test_compare_memory_regression():
+    regressions = compare(get_results(10, 50e6), get_results(10, 60e6))
+    assert regressions == [("convert connections", "memory_peak", 50e6, 60e6)]
+
+
+def test_compare_other_network():
+    with pytest.raises(ValueError):
+        compare(get_results(10, 50e6), get_results(10, 50e6, node_count=200))
+
+
+def test_save_and_load_results(tmp_path):
+    save_results(get_results(10, 50e6), tmp_path / "baseline.json")
+    baseline = load_results(tmp_path / "baseline.json")
+    assert baseline == get_results(10, 50e6)
+    assert format_comparison(baseline, baseline)[1].startswith("convert connections")
+
+
+def test_run_benchmark():
+    result = run_benchmark(node_count=50, repeat=1)
+    assert result["node_count"] == 50
+    assert result["stages"]["parse Knooppunt.csv"]["time"] > 0
+    assert result["stages"]["write connection_nodes"]["memory_peak"] > 0
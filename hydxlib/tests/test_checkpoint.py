@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+"""Tests for checkpoint.py"""
+from hydxlib.checkpoint import Checkpoint
+
+
+def test_checkpoint_save_and_load(tmp_path):
+    checkpoint = Checkpoint(tmp_path / "model.sqlite")
+    assert checkpoint.load() == {}
+    checkpoint.save("pipes", {"pipes": 2}, {"pipe": [1, 2]})
+    checkpoint.save("pumps", {"pumps": 0}, {"pump": None})
+    assert checkpoint.load() == {
+        "pipes": {"commit_counts": {"pipes": 2}, "ids": {"pipe": [1, 2]}},
+        "pumps": {"commit_counts": {"pumps": 0}, "ids": {"pump": None}},
+    }
+    assert (tmp_path / "model.sqlite.hydxlib-checkpoint.json").exists()
+
+
+def test_checkpoint_clear(tmp_path):
+    checkpoint = Checkpoint(tmp_path / "model.sqlite")
+    checkpoint.save("pipes", {"pipes": 2}, {"pipe": [1, 2]})
+    checkpoint.clear()
+    assert checkpoint.load() == {}
+    checkpoint.clear()
+
+
+def test_checkpoint_unreadable(tmp_path, caplog):
+    (tmp_path / "model.sqlite.hydxlib-checkpoint.json").write_text("{broken")
+    assert Checkpoint(tmp_path / "model.sqlite").load() == {}
+    assert "unreadable" in caplog.text
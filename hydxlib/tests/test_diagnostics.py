@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+"""Tests for diagnostics.py"""
+import csv
+import logging
+
+from hydxlib import diagnostics
+from hydxlib.diagnostics import Diagnostics
+from hydxlib.importer import import_hydx
+
+logger = logging.getLogger(__name__)
+
+
+def test_error_without_collector(caplog):
+    diagnostics.error(logger, "some-code", "Record %r is wrong", "a", record="a")
+    assert "Record 'a' is wrong" in caplog.text
+
+
+def test_collector_counts_and_samples(caplog):
+    collector = Diagnostics(max_samples=2)
+    with collector.activate():
+        for i in range(5):
+            diagnostics.error(logger, "wrong", "Record %d is wrong", i, record=i)
+        diagnostics.warning(logger, "odd", "Record %d is odd", 9, record=9)
+    assert caplog.text == ""
+    assert collector.counts() == {"wrong": 5, "odd": 1}
+    assert [x["record"] for x in collector["wrong"].samples] == [0, 1]
+    assert collector["wrong"].samples[1]["message"] == "Record 1 is wrong"
+    assert collector.format() == [
+        "wrong (5 times), e.g.: Record 0 is wrong",
+        "odd (1 times), e.g.: Record 9 is odd",
+    ]
+
+    collector.log_summary(logger)
+    assert "wrong (5 times)" in caplog.text
+
+
+def test_collector_write_csv(tmp_path):
+    collector = Diagnostics()
+    with collector.activate():
+        diagnostics.error(
+            logger, "wrong", "Record a is wrong", record="a", file="x.csv", line=3
+        )
+    collector.write_csv(tmp_path / "diagnostics.csv")
+    with open(tmp_path / "diagnostics.csv") as f:
+        rows = list(csv.DictReader(f, delimiter=";"))
+    assert rows == [
+        {
+            "code": "wrong",
+            "level": "ERROR",
+            "count": "1",
+            "record": "a",
+            "file": "x.csv",
+            "line": "3",
+            "message": "Record a is wrong",
+        }
+    ]
+    assert collector.as_dict()["diagnostics"][0]["count"] == 1
+
+
+def test_import_diagnostics_have_file_and_line(tmp_path):
+    (tmp_path / "Oppervlak.csv").write_text(
+        "UNI_IDE;NSL_STA;AFV_DEF;AFV_IDE;AFV_OPP;ALG_TOE\n"
+        "lei1;;nwrw.csv;GVH_VLA;500;\n"
+        "lei2;;nwrw.csv;GVH_VLA;large;\n"
+    )
+    collector = Diagnostics()
+    with collector.activate():
+        import_hydx(tmp_path)
+    sample = collector["invalid-float"].samples[0]
+    assert (sample["record"], sample["file"], sample["line"]) == (
+        "lei2",
+        "Oppervlak.csv",
+        3,
+    )
+
+
+def test_diagnostics_update():
+    first, second = Diagnostics(max_samples=2), Diagnostics(max_samples=2)
+    for i in range(2):
+        first.add(logging.ERROR, "duplicate-id", "%r", (i,))
+    second.add(logging.ERROR, "duplicate-id", "%r", (2,))
+    second.add(logging.WARNING, "missing-value", "message", ())
+    first.update(second)
+    assert first.counts() == {"duplicate-id": 3, "missing-value": 1}
+    assert len(first["duplicate-id"].samples) == 2
+
+
+def test_diagnostics_keep_all_samples():
+    collected = Diagnostics(max_samples=None)
+    for i in range(20):
+        collected.add(logging.ERROR, "duplicate-id", "%r", (i,))
+    assert len(collected["duplicate-id"].samples) == 20
+    merged = Diagnostics(max_samples=None)
+    merged.update(collected)
+    assert len(merged["duplicate-id"].samples) == 20
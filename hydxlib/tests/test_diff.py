@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+"""Tests for diff.py"""
+import shutil
+from unittest import mock
+
+import pytest
+
+from hydxlib import scripts
+from hydxlib.diff import convert_value, diff_hydx, format_diff, iter_records
+from hydxlib.importer import import_hydx
+
+EXAMPLE_PATH = "hydxlib/tests/example_files_structures_hydx"
+
+
+@pytest.fixture
+def changed_path(tmp_path):
+    path = tmp_path / "changed"
+    shutil.copytree(EXAMPLE_PATH, path)
+    knooppunt = path / "Knooppunt.csv"
+    lines = knooppunt.read_text(encoding="utf-8-sig").splitlines()
+    # move the first node and remove the last one
+    header, first = lines[0].split(";"), lines[1].split(";")
+    first[header.index("KNP_XCO")] = "123.4"
+    knooppunt.write_text(
+        "\n".join([lines[0], ";".join(first)] + lines[2:-1]) + "\n", encoding="utf-8"
+    )
+    return path
+
+
+def test_convert_value():
+    assert convert_value("", float) is None
+    assert convert_value("null", str) is None
+    assert convert_value("1.5", float) == 1.5
+    assert convert_value("x", float) is None
+
+
+def test_iter_records_repeated_keys():
+    keys = [key for key, _ in iter_records(EXAMPLE_PATH, "Verloop.csv")]
+    assert keys[:3] == ["Proceslozer", "Proceslozer#1", "Proceslozer#2"]
+
+
+def test_diff_hydx_identical():
+    diff = diff_hydx(import_hydx(EXAMPLE_PATH), EXAMPLE_PATH)
+    assert not diff
+    assert len(diff.summary()) == 7
+
+
+def test_diff_hydx_changed(changed_path):
+    diff = diff_hydx(EXAMPLE_PATH, str(changed_path))
+    assert diff
+    connection_nodes = diff["connection_nodes"]
+    assert connection_nodes.added == []
+    assert len(connection_nodes.removed) == 1
+    ((key, fields),) = connection_nodes.modified.items()
+    assert list(fields) == ["x_coordinaat"]
+    assert fields["x_coordinaat"][1] == 123.4
+    assert not diff["connections"]
+
+
+def test_diff_hydx_added(changed_path):
+    diff = diff_hydx(str(changed_path), EXAMPLE_PATH)
+    assert len(diff["connection_nodes"].added) == 1
+    assert diff["connection_nodes"].removed == []
+
+
+def test_format_diff(changed_path):
+    lines = format_diff(diff_hydx(EXAMPLE_PATH, str(changed_path)), details=True)
+    assert lines[1].split() == ["connection_nodes", "0", "1", "1"]
+    assert any(line.startswith("~ connection_nodes") for line in lines)
+
+
+def test_diff_subcommand(changed_path, capsys):
+    with mock.patch("sys.argv", ["program", "diff", EXAMPLE_PATH, EXAMPLE_PATH]):
+        with pytest.raises(SystemExit) as e:
+            scripts.main()
+    assert e.value.code == 0
+    with mock.patch("sys.argv", ["program", "diff", EXAMPLE_PATH, str(changed_path)]):
+        with pytest.raises(SystemExit) as e:
+            scripts.main()
+    assert e.value.code == 1
+    assert "connection_nodes" in capsys.readouterr().out
@@ -1,20 +1,31 @@
 # -*- coding: utf-8 -*-
 """Tests for importer.py"""
+import copy
+import os
+from unittest import mock
 
 import pytest
-from geoalchemy2.shape import from_shape
-from shapely import wkt
-from threedi_schema import models
+from threedi_schema import models, ThreediDatabase
 
+from hydxlib.checkpoint import Checkpoint
+from hydxlib.diagnostics import Diagnostics
 from hydxlib.exporter import (
+    dry_run_threedi,
+    DryRunWriter,
     export_threedi,
+    export_threedi_many,
     get_connection_node,
     get_cross_section_fields,
-    get_line_between_nodes,
-    get_node_geom,
+    get_lines_between_nodes,
     get_start_and_end_connection_node,
+    iter_chunks,
+    ThreediWriter,
     write_threedi_to_db,
 )
+from hydxlib.geometry import NodeCoordinates
+from hydxlib.hydx import Hydx
+from hydxlib.incremental import ContentHashes
+from hydxlib.report import Report
 from hydxlib.threedi import Threedi
 
 
@@ -61,37 +72,31 @@ class TestGetCrossSectionFields:
         assert updated_connection["cross_section_table"] == "1.1,0.1\n2.2,0.2\n3.3,0.3"
 
 
-def test_get_node_geom():
-    connection = {"code": "pmp1", "nodeA.code": "knp3", "nodeB.code": "knp4"}
-    connection_node_dict = {"knp3": {"geom": "foo"}}
-    assert get_node_geom(connection, connection_node_dict, "nodeA.code") == "foo"
-
-
-def test_get_node_geom_missing(caplog):
-    connection = {"code": "pmp1", "nodeA.code": "knp3", "nodeB.code": "knp4"}
-    connection_node_dict = {"knp3": {"geom": "foo"}}
-    assert get_node_geom(connection, connection_node_dict, "nodeB.code") is None
-    assert caplog.records[0].levelname == "ERROR"
-
-
-def test_get_line_between_nodes():
-    geom1 = from_shape(wkt.loads("POINT (400 50)"), srid=28992)
-    geom2 = from_shape(wkt.loads("POINT (400 60)"), srid=28992)
-    connection = {"code": "pmp1", "nodeA.code": "knp3", "nodeB.code": "knp4"}
-    connection_node_dict = {"knp3": {"geom": geom1}, "knp4": {"geom": geom2}}
-    line = get_line_between_nodes(
-        connection, connection_node_dict, "nodeA.code", "nodeB.code", target_epsg=28992
+def test_get_lines_between_nodes():
+    node_coordinates = NodeCoordinates(
+        [
+            {"code": "knp3", "geom": (400.0, 50.0, 28992)},
+            {"code": "knp4", "geom": (400.0, 60.0, 28992)},
+        ],
+        28992,
     )
-    assert line["geom"] == "SRID=28992;LINESTRING (400.0 50.0, 400.0 60.0)"
+    connections = [{"code": "pmp1", "nodeA.code": "knp3", "nodeB.code": "knp4"}]
+    get_lines_between_nodes(connections, node_coordinates, "nodeA.code", "nodeB.code")
+    assert connections[0]["geom"] == "SRID=28992;LINESTRING (400 50, 400 60)"
 
 
-def test_get_line_between_nodes_incomplete(caplog):
-    connection = {"code": "pmp1", "nodeA.code": "knp3", "nodeB.code": "knp4"}
-    connection_node_dict = {"knp3": {"geom": "foo"}}
-    line = get_line_between_nodes(
-        connection, connection_node_dict, "nodeA.code", "nodeB.code", target_epsg=28992
+def test_get_lines_between_nodes_incomplete(caplog):
+    node_coordinates = NodeCoordinates(
+        [{"code": "knp3", "geom": (400.0, 50.0, 28992)}], 28992
     )
-    assert line["geom"] is None
+    connections = [
+        {"code": "pmp1", "nodeA.code": "knp3", "nodeB.code": "knp4"},
+        {"code": "pmp2", "nodeA.code": "knp3", "nodeB.code": "knp3"},
+    ]
+    get_lines_between_nodes(connections, node_coordinates, "nodeA.code", "nodeB.code")
+    assert connections[0]["geom"] is None
+    assert connections[1]["geom"] == "SRID=28992;LINESTRING (400 50, 400 50)"
+    assert len(caplog.records) == 1
     assert caplog.records[0].levelname == "ERROR"
 
 
@@ -116,6 +121,12 @@ def test_get_start_and_end_connection_node():
     assert connection["connection_node_id_end"] == 3061
 
 
+def test_iter_chunks():
+    assert list(iter_chunks([1, 2, 3, 4, 5], 2)) == [(0, [1, 2]), (2, [3, 4]), (4, [5])]
+    assert list(iter_chunks([1, 2, 3])) == [(0, [1, 2, 3])]
+    assert list(iter_chunks([], 2)) == []
+
+
 @pytest.fixture
 def hydx_setup(hydx):
     threedi = Threedi()
@@ -161,3 +172,202 @@ def test_write_to_db(hydx_setup, mock_exporter_db, threedi_db):
     }
     for name, model in MODELS.items():
         assert session.query(model).count() == commit_counts_expected[name]
+
+
+def test_write_to_db_in_memory(hydx_setup, mock_exporter_db, threedi_db):
+    commit_counts = write_threedi_to_db(
+        hydx_setup[1], {"db_file": "/some/path"}, in_memory=True
+    )
+    assert commit_counts["connection_nodes"] == 85
+    session = threedi_db.get_session()
+    assert session.query(models.ConnectionNode).count() == 85
+    assert session.query(models.Pipe).count() == commit_counts["pipes"]
+
+
+def test_write_to_db_chunked(hydx_setup, mock_exporter_db, threedi_db):
+    progress = mock.Mock()
+    commit_counts = write_threedi_to_db(
+        hydx_setup[1], "/some/path", chunk_size=7, progress=progress
+    )
+    assert commit_counts == {
+        "connection_nodes": 85,
+        "pipes": 80,
+        "pumps": 8,
+        "weirs": 6,
+        "orifices": 2,
+        "outlets": 3,
+        "surfaces": 262,
+        "dry_weather_flows": 67,
+    }
+    progress.assert_any_call("connection_nodes", 7, 85)
+    progress.assert_any_call("connection_nodes", 85, 85)
+    session = threedi_db.get_session()
+    assert session.query(models.SurfaceMap).count() == 262
+    assert session.query(models.PumpMap).count() == 8
+
+
+def test_write_to_db_resume(hydx, mock_exporter_db, threedi_db):
+    threedi = Threedi()
+    threedi.import_hydx(hydx)
+    with mock.patch.object(ThreediWriter, "write_maps", side_effect=RuntimeError):
+        with pytest.raises(RuntimeError):
+            write_threedi_to_db(threedi, "/some/path")
+    checkpoint = Checkpoint(threedi_db.path)
+    assert set(checkpoint.load()) == set(ThreediWriter.STAGES) - {"maps"}
+    assert checkpoint.load()["pipes"]["ids"] == {"pipe": [1, 80]}
+
+    threedi = Threedi()
+    threedi.import_hydx(hydx)
+    commit_counts = write_threedi_to_db(threedi, "/some/path", resume=True)
+    assert commit_counts["connection_nodes"] == 85
+    assert commit_counts["dry_weather_flows"] == 67
+    assert checkpoint.load() == {}
+    session = threedi_db.get_session()
+    assert session.query(models.ConnectionNode).count() == 85
+    assert session.query(models.SurfaceMap).count() == 262
+
+
+def test_write_to_db_incremental(hydx, mock_exporter_db, threedi_db):
+    for _ in range(2):
+        threedi = Threedi()
+        threedi.import_hydx(hydx)
+        commit_counts = write_threedi_to_db(threedi, "/some/path", incremental=True)
+        assert commit_counts["pipes"] == 80
+    session = threedi_db.get_session()
+    assert session.query(models.ConnectionNode).count() == 85
+    assert session.query(models.Pipe).count() == 80
+    assert session.query(models.SurfaceMap).count() == 262
+
+
+def test_write_to_db_incremental_removes_objects(hydx, mock_exporter_db, threedi_db):
+    threedi = Threedi()
+    threedi.import_hydx(hydx)
+    write_threedi_to_db(threedi, "/some/path", incremental=True)
+    session = threedi_db.get_session()
+    pipe_ids = dict(session.query(models.Pipe.code, models.Pipe.id))
+    session.close()
+
+    threedi = Threedi()
+    threedi.import_hydx(hydx)
+    threedi.pipes = [x for x in threedi.pipes if x["code"] != "lei13"]
+    write_threedi_to_db(threedi, "/some/path", incremental=True)
+    session = threedi_db.get_session()
+    assert session.query(models.Pipe).count() == 79
+    # the remaining pipes keep their ids
+    del pipe_ids["lei13"]
+    assert dict(session.query(models.Pipe.code, models.Pipe.id)) == pipe_ids
+
+
+def test_write_to_db_incremental_changed_schematisation(
+    hydx, mock_exporter_db, threedi_db
+):
+    threedi = Threedi()
+    threedi.import_hydx(hydx)
+    write_threedi_to_db(threedi, "/some/path", incremental=True)
+    session = threedi_db.get_session()
+    pipes = session.query(models.Pipe).filter_by(code="lei13")
+    display_name = pipes.one().display_name
+    pipes.update({"display_name": "changed by hand"})
+    session.commit()
+    session.close()
+
+    # the recorded hashes no longer describe the schematisation
+    threedi = Threedi()
+    threedi.import_hydx(hydx)
+    write_threedi_to_db(threedi, "/some/path", incremental=True)
+    session = threedi_db.get_session()
+    assert pipes.with_session(session).one().display_name == display_name
+
+
+def test_write_to_db_clears_content_hashes(hydx, mock_exporter_db, threedi_db):
+    threedi = Threedi()
+    threedi.import_hydx(hydx)
+    write_threedi_to_db(threedi, "/some/path", incremental=True)
+    assert ContentHashes(threedi_db.path).load()
+    threedi.pipes.pop()
+    write_threedi_to_db(threedi, "/some/path")
+    assert not os.path.exists(ContentHashes(threedi_db.path).path)
+
+
+def test_write_to_db_resume_and_incremental():
+    with pytest.raises(ValueError):
+        write_threedi_to_db(Threedi(), "/some/path", resume=True, incremental=True)
+
+
+def test_write_to_db_up_to_date(hydx, mock_exporter_db, threedi_db):
+    threedi = Threedi()
+    threedi.import_hydx(hydx)
+    commit_counts = write_threedi_to_db(threedi, "/some/path")
+
+    threedi = Threedi()
+    threedi.import_hydx(hydx)
+    with mock.patch.object(ThreediWriter, "write") as write:
+        assert write_threedi_to_db(threedi, "/some/path") == commit_counts
+    assert not write.called
+
+
+def test_write_to_db_report_stages(hydx, mock_exporter_db, threedi_db):
+    threedi = Threedi()
+    threedi.import_hydx(hydx)
+    with Report().activate() as report:
+        write_threedi_to_db(threedi, "/some/path")
+    stages = {(x.name, x.depth): x for x in report.stages}
+    assert stages[("write connection_nodes", 0)].records_out == 85
+    assert stages[("flush connection_nodes", 1)].records_in == 85
+    assert ("commit connection_nodes", 1) in stages
+
+
+def test_export_threedi_many(hydx, tmp_path):
+    targets = []
+    for name in ("a.sqlite", "b.sqlite", "c.sqlite"):
+        db = ThreediDatabase(str(tmp_path / name))
+        db.schema.upgrade(backup=False, epsg_code_override=28992)
+        targets.append(str(tmp_path / name))
+    results = export_threedi_many(hydx, targets, workers=2)
+    assert [result["target"] for result in results] == targets
+    for result in results:
+        assert result["commit_counts"]["pipes"] == 80
+        assert result["duration"] > 0
+        session = ThreediDatabase(result["target"]).get_session()
+        assert session.query(models.ConnectionNode).count() == 85
+
+
+def test_export_threedi_many_failure(hydx, tmp_path):
+    (result,) = export_threedi_many(hydx, [str(tmp_path / "missing" / "x.sqlite")])
+    assert result["commit_counts"] is None
+
+
+def test_dry_run_threedi(hydx):
+    commit_counts, skip_reasons = dry_run_threedi(hydx)
+    assert commit_counts == {
+        "connection_nodes": 85,
+        "pipes": 80,
+        "pumps": 8,
+        "weirs": 6,
+        "orifices": 2,
+        "outlets": 3,
+        "surfaces": 262,
+        "dry_weather_flows": 67,
+    }
+    assert "Surface 330 has no area, no surface is created for it" in skip_reasons
+
+
+def test_dry_run_threedi_active_diagnostics(hydx):
+    expected_counts, expected_reasons = dry_run_threedi(copy.deepcopy(hydx))
+    active = Diagnostics()
+    with active.activate():
+        commit_counts, skip_reasons = dry_run_threedi(copy.deepcopy(hydx))
+    assert commit_counts == expected_counts
+    assert skip_reasons == expected_reasons
+    assert sum(active.counts().values()) == len(skip_reasons)
+
+
+def test_dry_run_writer_ids():
+    threedi = Threedi()
+    threedi.import_hydx(Hydx())
+    writer = DryRunWriter(threedi, 28992)
+    nodes = [models.ConnectionNode(code="a"), models.ConnectionNode(code="b")]
+    writer.save(nodes)
+    assert [node.id for node in nodes] == [1, 2]
+    assert writer.query_codes_and_ids(models.ConnectionNode) == [("a", 1), ("b", 2)]
+    assert writer.query_codes_and_ids(models.Pipe) == []
@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+"""Tests for filters.py"""
+import pytest
+
+from hydxlib.filters import NodeFilter
+from hydxlib.importer import import_hydx
+from hydxlib.synthetic import generate_hydx
+
+
+@pytest.fixture(scope="module")
+def hydx_path(tmp_path_factory):
+    """Two systems of 100 nodes"""
+    path = tmp_path_factory.mktemp("hydx")
+    generate_hydx(str(path), 200, system_size=100)
+    return str(path)
+
+
+def test_filter_systems(hydx_path):
+    hydx = import_hydx(hydx_path, where=NodeFilter(systems=["02/Gemengd"]))
+    assert len(hydx.connection_nodes) == 100
+    assert {x.identificatierioolstelsel for x in hydx.connection_nodes} == {
+        "02/Gemengd"
+    }
+    nodes = {x.identificatieknooppuntofverbinding for x in hydx.connection_nodes}
+    connections = {x.identificatieknooppuntofverbinding for x in hydx.connections}
+    for connection in hydx.connections:
+        assert connection.identificatieknooppunt1 in nodes
+        assert connection.identificatieknooppunt2 in nodes
+    for collection in (hydx.structures, hydx.surfaces, hydx.discharges):
+        assert collection
+        for x in collection:
+            assert x.identificatieknooppuntofverbinding in nodes | connections
+    # only the profiles that are still used
+    profiles = {x.identificatieprofieldefinitie for x in hydx.connections}
+    assert {x.identificatieprofieldefinitie for x in hydx.profiles} == profiles - {None}
+
+
+def test_filter_bbox(hydx_path):
+    full = import_hydx(hydx_path)
+    first = full.connection_nodes[0]
+    x, y = float(first.x_coordinaat), float(first.y_coordinaat)
+    hydx = import_hydx(hydx_path, where=NodeFilter(bbox=(x - 1, y - 1, x + 1, y + 1)))
+    assert [x.identificatieknooppuntofverbinding for x in hydx.connection_nodes] == [
+        first.identificatieknooppuntofverbinding
+    ]
+    assert hydx.connections == hydx.profiles == hydx.variations == []
+
+
+def test_filter_keeps_profiles_without_connections(hydx_path):
+    hydx = import_hydx(
+        hydx_path,
+        collections=["connection_nodes", "profiles"],
+        where=NodeFilter(systems=["01/Gemengd"]),
+    )
+    assert len(hydx.profiles) == len(import_hydx(hydx_path).profiles)
+
+
+def test_filter_reused_for_two_deliveries(hydx_path, tmp_path):
+    generate_hydx(str(tmp_path), 40, system_size=20)
+    where = NodeFilter(systems=["01/Gemengd"])
+    first = import_hydx(hydx_path, where=where)
+    second = import_hydx(str(tmp_path), where=where)
+    again = import_hydx(str(tmp_path), where=NodeFilter(systems=["01/Gemengd"]))
+    assert len(first.connection_nodes) == 100
+    for name in ("connection_nodes", "connections", "profiles", "variations"):
+        assert len(getattr(second, name)) == len(getattr(again, name)), name
+
+
+def test_filter_needs_connection_nodes(hydx_path):
+    with pytest.raises(ValueError):
+        import_hydx(hydx_path, collections=["connections"], where=NodeFilter())
+
+
+def test_filter_invalid_bbox():
+    with pytest.raises(ValueError):
+        NodeFilter(bbox=(1, 0, 0, 1))
@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+"""Tests for fingerprint.py"""
+import os
+import shutil
+import subprocess
+import sys
+
+from hydxlib.fingerprint import (
+    Fingerprint,
+    fingerprint_files,
+    fingerprint_threedi,
+    get_file_state,
+)
+from hydxlib.threedi import Threedi
+
+EXAMPLE_PATH = "hydxlib/tests/example_files_structures_hydx"
+
+
+def test_fingerprint_files(tmp_path):
+    shutil.copytree(EXAMPLE_PATH, tmp_path / "hydx")
+    fingerprint = fingerprint_files(tmp_path / "hydx")
+    assert fingerprint == fingerprint_files(EXAMPLE_PATH)
+    with open(tmp_path / "hydx" / "Knooppunt.csv", "a") as f:
+        f.write("\n")
+    assert fingerprint_files(tmp_path / "hydx") != fingerprint
+
+
+def test_fingerprint_threedi(hydx):
+    threedi = Threedi()
+    threedi.import_hydx(hydx)
+    fingerprint = fingerprint_threedi(threedi)
+    assert fingerprint == fingerprint_threedi(threedi)
+    threedi.pipes.pop()
+    assert fingerprint_threedi(threedi) != fingerprint
+
+
+def test_fingerprint_threedi_ignores_other_attributes(hydx):
+    threedi = Threedi()
+    threedi.import_hydx(hydx)
+    fingerprint = fingerprint_threedi(threedi)
+    threedi.helper = {"a", "b"}
+    assert fingerprint_threedi(threedi) == fingerprint
+
+
+FINGERPRINT_SCRIPT = """
+from hydxlib.fingerprint import fingerprint_threedi
+from hydxlib.importer import import_hydx
+from hydxlib.threedi import Threedi
+
+threedi = Threedi()
+threedi.import_hydx(import_hydx({!r}))
+print(fingerprint_threedi(threedi))
+"""
+
+
+def test_fingerprint_threedi_across_processes():
+    # the hash of a str differs between processes
+    script = FINGERPRINT_SCRIPT.format(EXAMPLE_PATH)
+    fingerprints = [
+        subprocess.run(
+            [sys.executable, "-c", script],
+            env={**os.environ, "PYTHONHASHSEED": seed},
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout
+        for seed in ("1", "2")
+    ]
+    assert fingerprints[0]
+    assert fingerprints[0] == fingerprints[1]
+
+
+def test_get_file_state(tmp_path):
+    assert get_file_state(tmp_path / "missing.sqlite") is None
+    (tmp_path / "model.sqlite").write_bytes(b"abc")
+    assert get_file_state(tmp_path / "model.sqlite")[0] == 3
+
+
+def test_fingerprint_commit_counts(tmp_path):
+    (tmp_path / "model.sqlite").write_bytes(b"abc")
+    fingerprint = Fingerprint(tmp_path / "model.sqlite")
+    assert fingerprint.get_commit_counts(source="a") is None
+    fingerprint.save({"pipes": 2}, source="a", content="b")
+    assert fingerprint.get_commit_counts(source="a") == {"pipes": 2}
+    assert fingerprint.get_commit_counts(content="b") == {"pipes": 2}
+    assert fingerprint.get_commit_counts(source="b", content="a") is None
+    fingerprint.clear()
+    assert fingerprint.get_commit_counts(source="a") is None
+
+
+def test_fingerprint_schematisation_changed(tmp_path):
+    (tmp_path / "model.sqlite").write_bytes(b"abc")
+    fingerprint = Fingerprint(tmp_path / "model.sqlite")
+    fingerprint.save({"pipes": 2}, source="a", content="b")
+    assert fingerprint.load_current()["source"] == "a"
+    (tmp_path / "model.sqlite").write_bytes(b"abcd")
+    assert fingerprint.get_commit_counts(source="a") is None
+    assert fingerprint.load_current() == {}
+
+
+def test_fingerprint_unreadable(tmp_path, caplog):
+    (tmp_path / "model.sqlite.hydxlib-fingerprint.json").write_text("{broken")
+    assert Fingerprint(tmp_path / "model.sqlite").load() == {}
+    assert "unreadable" in caplog.text
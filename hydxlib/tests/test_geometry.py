@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+"""Tests for geometry.py"""
+import numpy as np
+import pytest
+
+from hydxlib.geometry import (
+    get_buffers,
+    get_lines,
+    get_lines_between_rows,
+    get_point_on_surface_coordinates,
+    get_squares,
+    NodeCoordinates,
+    to_ewkt,
+    transform_coordinates,
+)
+
+
+@pytest.fixture
+def node_coordinates():
+    connection_nodes = [
+        {"code": "knp1", "geom": (400.0, 50.0, 28992)},
+        {"code": "knp2", "geom": (None, None, 28992)},
+        {"code": "knp1", "geom": (400.0, 60.0, 28992)},
+        {"code": "knp3", "geom": (410.0, 60.0, 28992)},
+    ]
+    return NodeCoordinates(connection_nodes, 28992)
+
+
+def test_transform_coordinates_chunked():
+    xy = np.array([[155000.0 + i, 463000.0] for i in range(5)])
+    expected = transform_coordinates(xy, 28992, 4326)
+    actual = transform_coordinates(xy, 28992, 4326, chunk_size=2)
+    assert expected[0, 0] == pytest.approx(5.3872, abs=1e-4)
+    assert np.array_equal(actual, expected)
+
+
+def test_transform_coordinates_same_epsg():
+    xy = np.array([[400.0, 50.0]])
+    assert np.array_equal(transform_coordinates(xy, 28992, 28992), xy)
+
+
+def test_node_coordinates(node_coordinates):
+    assert node_coordinates.xy.shape == (4, 2)
+    assert node_coordinates["knp1"] == (400.0, 60.0)
+    assert np.isnan(node_coordinates.xy[1]).all()
+    assert "knp4" not in node_coordinates
+
+
+def test_node_coordinates_lookup(node_coordinates):
+    rows = node_coordinates.lookup(["knp3", "knp4", "knp1"])
+    assert rows.tolist() == [3, -1, 2]
+
+
+def test_node_coordinates_transformed():
+    connection_nodes = [{"code": "knp1", "geom": (155000.0, 463000.0, 28992)}]
+    node_coordinates = NodeCoordinates(connection_nodes, 4326)
+    assert node_coordinates["knp1"] == pytest.approx((5.3872, 52.1552), abs=1e-4)
+
+
+def test_to_ewkt():
+    lines = get_lines(np.array([[400.0, 50.0]]), np.array([[400.5, 60.0]]))
+    assert to_ewkt(np.array([lines[0], None]), 28992) == [
+        "SRID=28992;LINESTRING (400 50, 400.5 60)",
+        None,
+    ]
+
+
+def test_get_lines_between_rows(node_coordinates):
+    lines = get_lines_between_rows(
+        node_coordinates, np.array([2, 0, -1]), np.array([3, -1, 3])
+    )
+    assert to_ewkt(lines, 28992) == [
+        "SRID=28992;LINESTRING (400 60, 410 60)",
+        None,
+        None,
+    ]
+
+
+def test_get_squares():
+    squares = get_squares(np.array([[400.0, 50.0]]), np.array([4.0]))
+    assert squares[0].area == pytest.approx(4.0)
+    assert squares[0].bounds == (399.0, 49.0, 401.0, 51.0)
+
+
+def test_get_buffers():
+    buffers = get_buffers(np.array([[400.0, 50.0]]), 1)
+    assert buffers[0].area == pytest.approx(np.pi, rel=1e-2)
+
+
+def test_get_point_on_surface_coordinates():
+    squares = get_squares(np.array([[400.0, 50.0]]), np.array([4.0]))
+    xy = get_point_on_surface_coordinates(np.array([squares[0], None]))
+    assert xy[0].tolist() == [400.0, 50.0]
+    assert np.isnan(xy[1]).all()
@@ -267,3 +267,9 @@ def test_repr_uninitialized(cls):
 )
 def test_str_uninitialized(cls):
     assert str(cls())
+
+
+def test_get_fields():
+    fields = ConnectionNode.get_fields(["Y_COORDINAAT"])
+    assert [field["csvheader"] for field in fields] == ["UNI_IDE", "KNP_YCO"]
+    assert ConnectionNode.get_fields() is ConnectionNode.FIELDS
@@ -2,6 +2,8 @@
 """Tests for importer.py"""
 import logging
 
+import pytest
+
 from hydxlib.importer import import_hydx
 
 
@@ -18,3 +20,40 @@ def test_import_profile_csv_into_hydx_class(hydx, caplog):
         caplog.records[0].message
         == "Non-unique 'identificatieknooppuntofverbinding' value encountered in Knooppunt knp9"
     )
+
+
+def test_import_hydx_selected_collections_and_fields(caplog):
+    caplog.set_level(logging.WARNING)
+    hydx_path = "hydxlib/tests/example_files_structures_hydx/"
+    hydx = import_hydx(
+        hydx_path,
+        collections=["connection_nodes", "profiles"],
+        fields={"connection_nodes": ["X_coordinaat", "y_coordinaat"]},
+    )
+    assert len(hydx.connection_nodes) == 85
+    assert hydx.connections == hydx.variations == []
+    node = hydx.connection_nodes[1]
+    assert node.x_coordinaat == 300
+    assert node.dict() == {
+        "identificatieknooppuntofverbinding": node.identificatieknooppuntofverbinding,
+        "x_coordinaat": 300,
+        "y_coordinaat": node.y_coordinaat,
+    }
+    assert not hasattr(node, "niveaumaaiveld")
+    # all fields of the collections without a field selection
+    assert hydx.profiles[37].breedte_diameterprofiel == "400"
+    # only the selected files are checked for existence
+    assert "Meta.csv" not in caplog.text
+
+
+@pytest.mark.parametrize(
+    "selection",
+    [
+        {"collections": ["nodes"]},
+        {"fields": {"nodes": ["x_coordinaat"]}},
+        {"fields": {"connection_nodes": ["x"]}},
+    ],
+)
+def test_import_hydx_unknown_selection(selection):
+    with pytest.raises(ValueError):
+        import_hydx("hydxlib/tests/example_files_structures_hydx/", **selection)
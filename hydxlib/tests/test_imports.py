@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+"""Tests that the heavy dependencies are only imported when exporting"""
+import subprocess
+import sys
+
+import pytest
+
+HEAVY_MODULES = ("sqlalchemy", "geoalchemy2", "shapely", "pyproj", "threedi_schema")
+
+
+def get_imported_heavy_modules(module):
+    """Import module in a new interpreter, return the heavy modules it loaded"""
+    code = (
+        f"import sys, {module}; "
+        f"print(' '.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))"
+    )
+    output = subprocess.run(
+        [sys.executable, "-c", code], capture_output=True, text=True, check=True
+    ).stdout
+    return output.split()
+
+
+@pytest.mark.parametrize(
+    "module",
+    [
+        "hydxlib.hydx",
+        "hydxlib.importer",
+        "hydxlib.diff",
+        "hydxlib.synthetic",
+        "hydxlib.scripts",
+    ],
+)
+def test_no_heavy_imports(module):
+    assert get_imported_heavy_modules(module) == []
+
+
+def test_heavy_imports_of_exporter():
+    assert "threedi_schema" in get_imported_heavy_modules("hydxlib.exporter")
@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+"""Tests for incremental.py"""
+from threedi_schema import models
+
+from hydxlib.incremental import content_hash, ContentHashes, get_object_values
+
+
+def test_get_object_values():
+    node = models.ConnectionNode(id=3, code="knp1", bottom_level=1.5)
+    assert get_object_values(node) == {"code": "knp1", "bottom_level": 1.5}
+
+
+def test_content_hash_ignores_order():
+    assert content_hash({"a": 1, "b": 2}) == content_hash({"b": 2, "a": 1})
+    assert content_hash({"a": 1}) != content_hash({"a": 2})
+
+
+def test_content_hashes_save_and_load(tmp_path):
+    (tmp_path / "model.sqlite").write_bytes(b"x")
+    hashes = ContentHashes(tmp_path / "model.sqlite")
+    assert hashes.load() == {}
+    hashes.save({"pipe": {"lei1": "0123456789abcdef"}})
+    assert hashes.load() == {"pipe": {"lei1": "0123456789abcdef"}}
+    assert (tmp_path / "model.sqlite.hydxlib-hashes.json").exists()
+
+
+def test_content_hashes_unreadable(tmp_path, caplog):
+    (tmp_path / "model.sqlite.hydxlib-hashes.json").write_text("{broken")
+    assert ContentHashes(tmp_path / "model.sqlite").load() == {}
+    assert "unreadable" in caplog.text
+
+
+def test_content_hashes_changed_schematisation(tmp_path):
+    (tmp_path / "model.sqlite").write_bytes(b"x")
+    hashes = ContentHashes(tmp_path / "model.sqlite")
+    hashes.save({"pipe": {"lei1": "0123456789abcdef"}})
+    (tmp_path / "model.sqlite").write_bytes(b"xy")
+    assert hashes.load() == {}
+
+
+def test_content_hashes_clear(tmp_path):
+    hashes = ContentHashes(tmp_path / "model.sqlite")
+    hashes.save({})
+    hashes.clear()
+    assert not (tmp_path / "model.sqlite.hydxlib-hashes.json").exists()
+    hashes.clear()
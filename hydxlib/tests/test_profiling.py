@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+"""Tests for profiling.py"""
+import pstats
+import time
+
+from hydxlib.profiling import CpuProfiler, StackSampler
+from hydxlib.report import Report, stage
+
+
+def busy(seconds):
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        sum(range(1000))
+
+
+def test_cpu_profiler(tmp_path):
+    report = Report()
+    profiler = CpuProfiler(report, interval=0.001)
+    with report.activate(), profiler.activate():
+        with stage("outer"):
+            with stage("inner"):
+                busy(0.2)
+    pstats_path, collapsed_path = profiler.write(str(tmp_path / "profile"))
+
+    assert pstats_path.endswith(".pstats")
+    stats = pstats.Stats(pstats_path)
+    assert any(function == "busy" for _, _, function in stats.stats)
+    lines = open(collapsed_path).read().splitlines()
+    assert lines
+    stack, count = lines[-1].rsplit(" ", 1)
+    assert int(count) > 0
+    assert any(line.startswith("[outer];[inner];") for line in lines)
+    assert any("busy (test_profiling.py:" in line for line in lines)
+
+
+def test_stack_sampler_unknown_thread():
+    sampler = StackSampler(thread_id=-1)
+    sampler.sample()
+    assert not sampler.stacks
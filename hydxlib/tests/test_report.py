@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+"""Tests for report.py"""
+import json
+
+from hydxlib.importer import import_hydx
+from hydxlib.report import Report, stage
+
+
+def test_stage_without_report():
+    with stage("nothing", 3) as current:
+        current.records_out = 2
+    assert current.wall_time is None
+
+
+def test_report_stages():
+    report = Report()
+    with report.activate():
+        with stage("first", 3) as current:
+            current.records_out = 2
+        with stage("second"):
+            pass
+    with stage("not recorded"):
+        pass
+    assert [x.name for x in report.stages] == ["first", "second"]
+    first = report.stages[0].as_dict()
+    assert first["records_in"] == 3
+    assert first["records_out"] == 2
+    assert first["wall_time"] >= 0
+    assert first["cpu_time"] >= 0
+
+
+def test_report_write_json(tmp_path):
+    report = Report()
+    with report.activate():
+        with stage("first"):
+            pass
+    report.write_json(tmp_path / "report.json")
+    data = json.loads((tmp_path / "report.json").read_text())
+    assert data["stages"][0]["name"] == "first"
+    assert report.format()[1].startswith("first")
+
+
+def test_import_hydx_stages():
+    with Report().activate() as report:
+        import_hydx("hydxlib/tests/example_files_structures_hydx/")
+    stages = {x.name: x for x in report.stages}
+    assert stages["parse Knooppunt.csv"].records_in == 85
+    assert stages["parse Knooppunt.csv"].records_out == 85
+    assert "check_import_data" in stages
+
+
+def test_report_trace_memory():
+    report = Report(trace_memory=True)
+    with report.activate():
+        with stage("outer"):
+            with stage("inner"):
+                data = [0] * 1000000  # 8 MB of pointers
+            del data
+    outer, inner = report.stages
+    assert inner.memory_peak > 8000000
+    assert outer.memory_peak >= inner.memory_peak
+
+
+def test_report_without_trace_memory():
+    report = Report()
+    with report.activate():
+        with stage("first"):
+            pass
+    assert report.stages[0].memory_peak is None
+
+
+def test_report_allocation_sites():
+    report = Report(allocation_sites=3)
+    with report.activate():
+        with stage("outer"):
+            with stage("inner"):
+                data = [str(i) for i in range(100000)]
+    outer, inner = report.stages
+    assert inner.depth == 1
+    assert len(inner.allocation_sites) <= 3
+    assert inner.allocation_sites[0]["file"] == __file__
+    assert inner.allocation_sites[0]["size"] > 1000000
+    assert outer.allocation_sites
+    assert any("MB in" in line for line in report.format())
+    del data
@@ -1,8 +1,13 @@
 # -*- coding: utf-8 -*-
 """Tests for scripts.py"""
+import shutil
 from unittest import mock
 
+import pytest
+
 from hydxlib import scripts
+from hydxlib.filters import NodeFilter
+from hydxlib.fingerprint import Fingerprint, fingerprint_files
 
 
 @mock.patch("sys.argv", ["program", "a", "b"])
@@ -18,3 +23,175 @@ def test_run_import_export_log_file(mock_exporter_db):
     hydx_path = "hydxlib/tests/example_files_structures_hydx/"
     finished = scripts.run_import_export(hydx_path, "/some/path")
     assert finished == "method is finished"
+
+
+@mock.patch(
+    "sys.argv",
+    ["program", "a", "b", "--in-memory", "--chunk-size", "500", "--resume"],
+)
+def test_get_parser_export_options():
+    options = scripts.get_parser().parse_args()
+    assert options.in_memory is True
+    assert options.chunk_size == 500
+    assert options.resume is True
+    assert options.incremental is False
+
+
+@mock.patch("sys.argv", ["program", "a", "b", "--incremental"])
+def test_get_parser_incremental():
+    options = scripts.get_parser().parse_args()
+    assert options.incremental is True
+
+
+def test_run_import_export_up_to_date(tmp_path):
+    hydx_path = "hydxlib/tests/example_files_structures_hydx/"
+    out_path = tmp_path / "model.sqlite"
+    out_path.write_bytes(b"")
+    Fingerprint(out_path).save({"pipes": 80}, source=fingerprint_files(hydx_path))
+    with mock.patch("hydxlib.scripts.import_hydx") as import_hydx:
+        scripts.run_import_export(hydx_path, str(out_path))
+    assert not import_hydx.called
+
+
+def test_run_import_export_fingerprints_after_import(tmp_path):
+    # without a recorded export the fingerprint cannot match, so the files are
+    # not read an extra time before the import
+    hydx_path = "hydxlib/tests/example_files_structures_hydx/"
+    calls = []
+    with mock.patch(
+        "hydxlib.scripts.import_hydx",
+        side_effect=lambda *args, **kwargs: calls.append("import"),
+    ), mock.patch(
+        "hydxlib.scripts.fingerprint_files",
+        side_effect=lambda path: calls.append("fingerprint") or "abc",
+    ), mock.patch(
+        "hydxlib.exporter.convert_and_write", return_value=(0, {})
+    ) as convert_and_write:
+        scripts.run_import_export(hydx_path, str(tmp_path / "model.sqlite"))
+    assert calls == ["import", "fingerprint"]
+    assert convert_and_write.call_args.kwargs["source_fingerprint"] == "abc"
+
+
+@mock.patch("sys.argv", ["program", "a", "b", "--output-format", "gpkg"])
+def test_get_parser_output_format():
+    options = scripts.get_parser().parse_args()
+    assert options.output_format == "gpkg"
+    assert options.report is False
+    assert options.profile_memory is False
+    assert options.profile_cpu is False
+    assert options.max_samples == 10
+
+
+@mock.patch("sys.argv", ["program", "a", "b", "--profile-memory"])
+def test_get_parser_profile_memory():
+    options = scripts.get_parser().parse_args()
+    assert options.profile_memory is True
+
+
+def test_run_import_export_gpkg(tmp_path):
+    hydx_path = "hydxlib/tests/example_files_structures_hydx/"
+    out_path = tmp_path / "model.gpkg"
+    scripts.run_import_export(hydx_path, str(out_path), output_format="gpkg")
+    assert out_path.exists()
+
+
+def test_generate_main(tmp_path, capsys):
+    with mock.patch("sys.argv", ["run-hydxlib", "generate", str(tmp_path)]):
+        scripts.main()
+    assert (tmp_path / "Knooppunt.csv").is_file()
+    assert "Knooppunt.csv" in capsys.readouterr().out
+
+
+def test_benchmark_main(tmp_path, capsys):
+    baseline_path = tmp_path / "baseline.json"
+    result = {"node_count": 10, "seed": 0, "stages": {}}
+    argv = ["run-hydxlib", "benchmark", str(baseline_path), "--nodes", "10"]
+    with mock.patch("hydxlib.scripts.run_benchmark", return_value=result):
+        with mock.patch("sys.argv", argv):
+            scripts.main()
+        assert baseline_path.is_file()
+        with mock.patch("sys.argv", argv):
+            with pytest.raises(SystemExit) as e:
+                scripts.main()
+    assert e.value.code == 0
+
+
+def test_main_profile_cpu(tmp_path):
+    hydx_path = tmp_path / "hydx"
+    shutil.copytree("hydxlib/tests/example_files_structures_hydx/", hydx_path)
+    argv = [
+        "run-hydxlib",
+        str(hydx_path),
+        str(tmp_path / "out.gpkg"),
+        "--output-format",
+        "gpkg",
+        "--profile-cpu",
+    ]
+    with mock.patch("sys.argv", argv):
+        scripts.main()
+    assert (hydx_path / "import_hydx_hydxlib.pstats").is_file()
+    assert "[import];" in (hydx_path / "import_hydx_hydxlib.collapsed").read_text()
+
+
+def test_main_diagnostics(tmp_path):
+    hydx_path = tmp_path / "hydx"
+    shutil.copytree("hydxlib/tests/example_files_structures_hydx/", hydx_path)
+    argv = ["run-hydxlib", str(hydx_path), str(tmp_path / "out.gpkg")]
+    argv += ["--output-format", "gpkg"]
+    with mock.patch("sys.argv", argv):
+        scripts.main()
+    diagnostics = (hydx_path / "import_hydx_hydxlib.diagnostics.csv").read_text()
+    assert "duplicate-id;ERROR;1;knp9;" in diagnostics
+    log = (hydx_path / "import_hydx_hydxlib.log").read_text()
+    assert "duplicate-id (1 times)" in log
+
+
+def test_main_workers(tmp_path):
+    diagnostics = []
+    for workers in ("1", "2"):
+        hydx_path = tmp_path / workers
+        shutil.copytree("hydxlib/tests/example_files_structures_hydx/", hydx_path)
+        argv = ["run-hydxlib", str(hydx_path), str(tmp_path / (workers + ".gpkg"))]
+        argv += ["--output-format", "gpkg", "--workers", workers]
+        with mock.patch("sys.argv", argv):
+            scripts.main()
+        path = hydx_path / "import_hydx_hydxlib.diagnostics.csv"
+        diagnostics.append(path.read_text().replace(str(hydx_path), ""))
+    assert diagnostics[0] == diagnostics[1]
+
+
+def test_batch_main(tmp_path, capsys):
+    shutil.copytree("hydxlib/tests/example_files_structures_hydx/", tmp_path / "hydx")
+    manifest_path = tmp_path / "manifest.csv"
+    manifest_path.write_text("hydx_path;out_path\nhydx;out.gpkg\nmissing;x.gpkg\n")
+    argv = ["run-hydxlib", "batch", str(manifest_path), "--workers", "1"]
+    argv += ["--output-format", "gpkg", "--summary", str(tmp_path / "summary.csv")]
+    with mock.patch("sys.argv", argv):
+        with pytest.raises(SystemExit) as e:
+            scripts.main()
+    assert e.value.code == 1
+    assert "1 of 2 deliveries failed" in capsys.readouterr().out
+    assert (tmp_path / "summary.csv").is_file()
+
+
+@mock.patch(
+    "sys.argv",
+    ["program", "a", "b", "--bbox", "0", "0", "10", "10", "--system", "x"],
+)
+def test_get_parser_filter():
+    options = scripts.get_parser().parse_args()
+    assert options.bbox == [0, 0, 10, 10]
+    assert options.systems == ["x"]
+
+
+def test_run_import_export_filter_is_part_of_fingerprint(tmp_path):
+    hydx_path = "hydxlib/tests/example_files_structures_hydx/"
+    out_path = tmp_path / "model.sqlite"
+    out_path.write_bytes(b"")
+    Fingerprint(out_path).save({"pipes": 80}, source=fingerprint_files(hydx_path))
+    with mock.patch("hydxlib.scripts.import_hydx") as import_hydx:
+        with mock.patch("hydxlib.exporter.convert_and_write", return_value=(0, {})):
+            scripts.run_import_export(
+                hydx_path, str(out_path), where=NodeFilter(systems=["x"])
+            )
+    assert import_hydx.called
@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+"""Tests for server.py"""
+import json
+import queue
+import threading
+import time
+import urllib.error
+import urllib.request
+from unittest import mock
+
+import pytest
+
+from hydxlib.fingerprint import fingerprint_files
+from hydxlib.server import Job, JobCancelled, make_server, Worker
+
+EXAMPLE_PATH = "hydxlib/tests/example_files_structures_hydx/"
+
+
+def wait(job, timeout=60):
+    deadline = time.time() + timeout
+    while not job.is_finished:
+        assert time.time() < deadline
+        time.sleep(0.05)
+    return job
+
+
+@pytest.fixture
+def worker():
+    worker = Worker()
+    worker.start()
+    yield worker
+    worker.stop()
+
+
+def test_worker_runs_jobs_with_cached_parse(worker, tmp_path):
+    first = worker.submit(EXAMPLE_PATH, str(tmp_path / "1.gpkg"), output_format="gpkg")
+    wait(first)
+    second = worker.submit(EXAMPLE_PATH, str(tmp_path / "2.gpkg"), output_format="gpkg")
+    wait(second)
+    assert first.status == second.status == "done"
+    assert first.commit_counts == second.commit_counts
+    assert len(worker.cache.items) == 1
+    # the import diagnostics are reported for the cached parse as well
+    assert first.diagnostics == second.diagnostics
+    assert "duplicate-id" in [x["code"] for x in second.diagnostics]
+
+
+def test_worker_reads_delivery_once(worker, tmp_path):
+    with mock.patch(
+        "hydxlib.server.fingerprint_files", wraps=fingerprint_files
+    ) as server_fingerprint, mock.patch(
+        "hydxlib.scripts.fingerprint_files"
+    ) as scripts_fingerprint, mock.patch(
+        "hydxlib.exporter.convert_and_write", return_value=(None, {"pipes": 80})
+    ) as convert_and_write:
+        job = wait(worker.submit(EXAMPLE_PATH, str(tmp_path / "model.sqlite")))
+    assert job.status == "done"
+    assert server_fingerprint.call_count == 1
+    assert not scripts_fingerprint.called
+    source_fingerprint = convert_and_write.call_args.kwargs["source_fingerprint"]
+    assert source_fingerprint == fingerprint_files(EXAMPLE_PATH)
+
+
+def test_worker_failing_job(worker, tmp_path):
+    job = wait(worker.submit(str(tmp_path / "missing"), str(tmp_path / "out.gpkg")))
+    assert job.status == "failed"
+    assert "does not exist" in job.error
+
+
+def test_worker_queue_is_bounded():
+    worker = Worker(queue_size=1)
+    worker.submit("a", "a.sqlite")
+    with pytest.raises(queue.Full):
+        worker.submit("b", "b.sqlite")
+
+
+def test_worker_unknown_option():
+    with pytest.raises(ValueError):
+        Worker().submit("a", "a.sqlite", in_memmory=True)
+
+
+def test_worker_cancel_queued():
+    worker = Worker()
+    job = worker.submit("a", "a.sqlite")
+    assert worker.cancel(job.id).status == "cancelled"
+    assert worker.cancel("unknown") is None
+
+
+def test_job_cancel_running():
+    job = Job("1", "a", "a.sqlite", {})
+    job.report_progress("pipes", 10, 100)
+    job.cancel_requested.set()
+    with pytest.raises(JobCancelled):
+        job.report_progress("pipes", 20, 100)
+    assert job.progress == {"stage": "pipes", "done": 20, "total": 100}
+
+
+def test_worker_cancel_after_parse(tmp_path):
+    worker = Worker()
+    job = worker.submit(EXAMPLE_PATH, str(tmp_path / "out.gpkg"), output_format="gpkg")
+    load = worker.cache.load
+
+    def cancel_while_parsing(*args):
+        job.cancel_requested.set()
+        return load(*args)
+
+    with mock.patch.object(worker.cache, "load", side_effect=cancel_while_parsing):
+        assert worker.run_job(job) == "cancelled"
+    assert not (tmp_path / "out.gpkg").exists()
+
+
+def test_worker_cancel_gpkg_job(tmp_path):
+    worker = Worker()
+    job = worker.submit(
+        EXAMPLE_PATH, str(tmp_path / "out.gpkg"), output_format="gpkg", chunk_size=10
+    )
+    report_progress = job.report_progress
+
+    def cancel_at_first_chunk(*args):
+        job.cancel_requested.set()
+        report_progress(*args)
+
+    job.report_progress = cancel_at_first_chunk
+    assert worker.run_job(job) == "cancelled"
+    assert job.progress == {"stage": "connection_nodes", "done": 10, "total": 85}
+
+
+def test_worker_history_is_bounded():
+    worker = Worker(history_size=1)
+    jobs = [worker.submit(x, x) for x in "abc"]
+    for job in jobs:
+        worker.cancel(job.id)
+    assert list(worker.jobs) == [jobs[-1].id]
+
+
+def request(url, method="GET", content=None):
+    data = None if content is None else json.dumps(content).encode()
+    try:
+        with urllib.request.urlopen(
+            urllib.request.Request(url, data=data, method=method)
+        ) as response:
+            return response.status, json.load(response)
+    except urllib.error.HTTPError as e:
+        return e.code, json.load(e)
+
+
+def test_server(tmp_path):
+    worker = Worker(queue_size=1)
+    server = make_server(worker, port=0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = "http://127.0.0.1:%d/jobs" % server.server_address[1]
+    try:
+        job = {"hydx_path": EXAMPLE_PATH, "out_path": str(tmp_path / "out.gpkg")}
+        status, content = request(url, "POST", dict(job, output_format="gpkg"))
+        assert status == 202
+        assert content["status"] == "queued"
+        assert request(url, "POST", job)[0] == 503
+        assert request(url, "POST", {"hydx_path": "a"})[0] == 400
+        assert request(url)[1]["jobs"][0]["id"] == content["id"]
+        worker.start()
+        wait(worker.get(content["id"]))
+        status, content = request(url + "/" + content["id"])
+        assert content["status"] == "done"
+        assert content["commit_counts"]["pipes"] == 80
+        assert request(url + "/" + content["id"], "DELETE")[1]["status"] == "done"
+        assert request(url + "/unknown")[0] == 404
+    finally:
+        server.shutdown()
+        server.server_close()
+        worker.stop()
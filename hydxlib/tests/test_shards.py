@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+"""Tests for shards.py"""
+import copy
+from unittest import mock
+
+from threedi_schema.domain.constants import CrossSectionShape
+
+from hydxlib.diagnostics import Diagnostics
+from hydxlib.importer import import_hydx
+from hydxlib.shards import (
+    COLLECTIONS,
+    get_display_names,
+    get_opened_profiles,
+    partition,
+)
+from hydxlib.synthetic import generate_hydx
+from hydxlib.threedi import Threedi
+
+
+def convert(hydx, workers=None):
+    """Return the Threedi instance and the diagnostics of a conversion"""
+    threedi = Threedi()
+    diagnostics = Diagnostics(max_samples=1000)
+    with diagnostics.activate():
+        # the conversion changes some hydx records
+        threedi.import_hydx(copy.deepcopy(hydx), workers=workers)
+    return threedi, diagnostics
+
+
+def assert_same_conversion(hydx, workers):
+    sequential, sequential_diagnostics = convert(hydx)
+    sharded, sharded_diagnostics = convert(hydx, workers)
+    for name in COLLECTIONS:
+        assert getattr(sharded, name) == getattr(sequential, name), name
+    assert sharded_diagnostics.as_dict() == sequential_diagnostics.as_dict()
+
+
+def get_profiles(hydx):
+    profiles = Threedi()
+    profiles.clear()
+    profiles.convert_profiles(hydx.profiles)
+    return profiles
+
+
+def make_hydx(nodes, connections):
+    hydx = mock.Mock()
+    hydx.connection_nodes = [
+        mock.Mock(
+            identificatieknooppuntofverbinding=code,
+            identificatierioolstelsel=system,
+            identificatierioolput=code,
+        )
+        for code, system in nodes
+    ]
+    hydx.connections = [
+        mock.Mock(
+            identificatieknooppuntofverbinding=code,
+            identificatieknooppunt1=node1,
+            identificatieknooppunt2=node2,
+            typeverbinding=typeverbinding,
+            identificatieprofieldefinitie=profile,
+        )
+        for code, node1, node2, typeverbinding, profile in connections
+    ]
+    hydx.structures = []
+    hydx.surfaces = []
+    hydx.discharges = []
+    hydx.variations = []
+    hydx.profiles = []
+    return hydx
+
+
+def test_import_hydx_sharded(hydx):
+    # 4 sewerage systems, 3 connections between them, errors in every stage
+    assert_same_conversion(hydx, workers=2)
+
+
+def test_import_hydx_sharded_components(tmp_path):
+    generate_hydx(tmp_path, 600, system_size=100)
+    hydx = import_hydx(tmp_path)
+    for node in hydx.connection_nodes:
+        node.identificatierioolstelsel = None
+    assert_same_conversion(hydx, workers=3)
+
+
+def test_import_hydx_sharded_one_shard(hydx):
+    hydx = copy.deepcopy(hydx)
+    for node in hydx.connection_nodes:
+        node.identificatierioolstelsel = "x"
+    with mock.patch("hydxlib.shards.ProcessPoolExecutor") as executor:
+        threedi, _ = convert(hydx, workers=2)
+    assert not executor.called
+    assert len(threedi.connection_nodes) == 85
+
+
+def test_get_display_names(hydx):
+    sequential, _ = convert(hydx)
+    converted = {
+        x["code"]: x["display_name"]
+        for x in sequential.pipes
+        + sequential.pumps
+        + sequential.weirs
+        + sequential.orifices
+    }
+    display_names = get_display_names(hydx)
+    for connection, display_name in zip(hydx.connections, display_names):
+        code = connection.identificatieknooppuntofverbinding
+        assert display_name == converted.get(code)
+
+
+def test_partition_by_system(hydx):
+    shards = partition(hydx, get_profiles(hydx), workers=4)
+    # the connections between the systems are in the shared shard, last
+    assert [len(x.connection_nodes) for x in shards] == [69, 6, 5, 5, 0]
+    assert shards[-1].node_codes == {
+        x.identificatieknooppuntofverbinding for x in hydx.connection_nodes
+    }
+    assert len(shards[-1].connections) == 3
+    assert sum(len(x.connections) for x in shards) == len(hydx.connections)
+    assert sum(len(x.surfaces) for x in shards) == len(hydx.surfaces)
+
+
+def test_partition_packs_systems(hydx):
+    shards = partition(hydx, get_profiles(hydx), workers=2)
+    assert [len(x.connection_nodes) for x in shards] == [69, 16, 0]
+
+
+def test_partition_components():
+    hydx = make_hydx(
+        [("a", None), ("b", None), ("c", None), ("d", "x")],
+        [("ab", "a", "b", "GSL", None), ("cd", "c", "d", "GSL", None)],
+    )
+    shards = partition(hydx, get_profiles(hydx), workers=4)
+    assert [
+        [x[1].identificatieknooppuntofverbinding for x in shard.connections]
+        for shard in shards
+    ] == [["ab"], ["cd"]]
+
+
+def test_get_opened_profiles():
+    hydx = make_hydx(
+        [("a", "x"), ("b", "y")],
+        [("ab", "a", "b", "OPL", "tpz"), ("ba", "b", "a", "OPL", "rnd")],
+    )
+    profiles = Threedi()
+    profiles.cross_sections = [
+        {
+            "code": "tpz",
+            "shape": CrossSectionShape.TABULATED_TRAPEZIUM.value,
+            "width": "1 2 0",
+            "height": "0 1 2",
+        },
+        {"code": "rnd", "shape": CrossSectionShape.CIRCLE.value},
+    ]
+    assert get_opened_profiles(hydx, profiles) == {"tpz"}
+
+
+def test_partition_opened_profile():
+    # the connections that use a profile opened by an OPL are in one shard
+    hydx = make_hydx(
+        [("a", "x"), ("b", "x"), ("c", "y"), ("d", "y")],
+        [("ab", "a", "b", "OPL", "tpz"), ("cd", "c", "d", "GSL", "tpz")],
+    )
+    with mock.patch("hydxlib.shards.get_opened_profiles", return_value={"tpz"}):
+        shards = partition(hydx, Threedi(), workers=2)
+    assert len(shards) == 1
+    assert len(shards[0].connections) == 2
@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+"""Tests for sidecars.py"""
+import pytest
+
+from hydxlib.sidecars import open_atomic, read_json_sidecar, write_json_atomic
+
+
+def test_write_and_read_json_sidecar(tmp_path):
+    path = tmp_path / "x.json"
+    assert read_json_sidecar(path, "test file") == {}
+    write_json_atomic(path, {"a": [1, 2]})
+    assert read_json_sidecar(path, "test file") == {"a": [1, 2]}
+    assert not (tmp_path / "x.json.tmp").exists()
+
+
+@pytest.mark.parametrize("content", ["{broken", "[1, 2]"])
+def test_read_json_sidecar_unreadable(tmp_path, caplog, content):
+    path = tmp_path / "x.json"
+    path.write_text(content)
+    assert read_json_sidecar(path, "test file") == {}
+    assert "Ignoring unreadable test file" in caplog.text
+
+
+def test_open_atomic_error_keeps_file(tmp_path):
+    path = tmp_path / "x.csv"
+    path.write_text("old")
+    with pytest.raises(RuntimeError):
+        with open_atomic(path) as f:
+            f.write("new")
+            raise RuntimeError()
+    assert path.read_text() == "old"
+    assert not (tmp_path / "x.csv.tmp").exists()
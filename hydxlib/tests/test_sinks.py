@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+"""Tests for sinks.py"""
+import sqlite3
+import struct
+from unittest import mock
+
+import pytest
+import shapely
+
+from hydxlib.sinks import (
+    convert_values,
+    export_geopackage,
+    export_geoparquet,
+    get_columns,
+    to_gpkg_blobs,
+)
+
+
+def test_get_columns():
+    items = [
+        {"code": "a", "level": None, "start_node.code": "n1", "sewerage": True},
+        {"code": "b", "level": 1.5, "count": 3, "geom": None},
+    ]
+    assert get_columns(items) == [
+        ("code", "code", str),
+        ("level", "level", float),
+        ("start_node.code", "start_node_code", str),
+        ("sewerage", "sewerage", bool),
+        ("count", "count", int),
+    ]
+
+
+def test_get_columns_int_and_float():
+    items = [{"coefficient": 0}, {"coefficient": 0.8}, {"coefficient": None}]
+    ((key, column, datatype),) = get_columns(items)
+    assert datatype is float
+    assert convert_values([x[key] for x in items], datatype) == [0.0, 0.8, None]
+
+
+def test_get_columns_text_and_numbers(caplog):
+    items = [{"area": 1.5}, {"area": "unknown"}]
+    assert get_columns(items) == [("area", "area", str)]
+    assert "Column area mixes text and numbers" in caplog.text
+
+
+def test_to_gpkg_blobs():
+    blob, missing = to_gpkg_blobs([shapely.Point(1, 2), None], 28992)
+    assert missing is None
+    assert blob[:4] == b"GP\x00\x01"
+    assert struct.unpack("<i", blob[4:8]) == (28992,)
+    assert shapely.from_wkb(blob[8:]) == shapely.Point(1, 2)
+
+
+def test_export_geopackage(hydx, tmp_path):
+    path = str(tmp_path / "model.gpkg")
+    counts = export_geopackage(hydx, path, chunk_size=50)
+    assert counts["pipes"] == 80
+    connection = sqlite3.connect(path)
+    assert connection.execute("PRAGMA application_id").fetchone() == (0x47504B47,)
+    assert connection.execute("SELECT count(*) FROM pipes").fetchone() == (80,)
+    # the discharge coefficients are ints and floats
+    assert connection.execute(
+        "SELECT DISTINCT typeof(discharge_coefficient_positive) FROM orifices"
+    ).fetchall() == [("real",)]
+    layers = connection.execute(
+        "SELECT table_name, geometry_type_name, srs_id FROM gpkg_geometry_columns"
+    ).fetchall()
+    assert ("surfaces", "POLYGON", 28992) in layers
+    code, blob = connection.execute(
+        "SELECT code, geom FROM pipes WHERE code = 'lei1'"
+    ).fetchone()
+    assert shapely.from_wkb(blob[8:]).equals(
+        shapely.LineString([(400, 150), (400, 200)])
+    )
+
+
+def test_export_geoparquet(hydx, tmp_path):
+    pq = pytest.importorskip("pyarrow.parquet")
+    counts = export_geoparquet(hydx, str(tmp_path), chunk_size=50)
+    assert counts["connection_nodes"] == 85
+    table = pq.read_table(tmp_path / "pipes.parquet")
+    assert table.num_rows == 80
+    assert b"geo" in table.schema.metadata
+    assert pq.ParquetFile(tmp_path / "pipes.parquet").num_row_groups == 2
+
+
+def test_export_geopackage_progress(hydx, tmp_path):
+    progress = mock.Mock()
+    export_geopackage(
+        hydx, str(tmp_path / "out.gpkg"), chunk_size=50, progress=progress
+    )
+    assert progress.call_args_list[:2] == [
+        mock.call("connection_nodes", 50, 85),
+        mock.call("connection_nodes", 85, 85),
+    ]
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+"""Tests for sources.py"""
+import gzip
+import logging
+import os
+import zipfile
+
+import pytest
+
+from hydxlib.diff import diff_hydx
+from hydxlib.fingerprint import fingerprint_files
+from hydxlib.importer import import_hydx
+from hydxlib.sources import get_log_dir, open_source
+
+EXAMPLE_PATH = "hydxlib/tests/example_files_structures_hydx/"
+COLLECTIONS = ("connection_nodes", "connections", "structures", "surfaces")
+
+
+def assert_same_import(hydx_path):
+    hydx, expected = import_hydx(hydx_path), import_hydx(EXAMPLE_PATH)
+    for name in COLLECTIONS:
+        assert repr(getattr(hydx, name)) == repr(getattr(expected, name))
+
+
+@pytest.fixture
+def zip_path(tmp_path):
+    """The example files in a subdirectory of a zip, Knooppunt.csv gzipped"""
+    path = tmp_path / "delivery.zip"
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as archive:
+        for name in os.listdir(EXAMPLE_PATH):
+            with open(os.path.join(EXAMPLE_PATH, name), "rb") as f:
+                content = f.read()
+            if name == "Knooppunt.csv":
+                name, content = name + ".gz", gzip.compress(content)
+            archive.writestr("delivery/" + name, content)
+    return path
+
+
+def test_import_zip(zip_path, caplog):
+    with caplog.at_level(logging.WARNING):
+        assert_same_import(str(zip_path))
+    # the warnings about the files refer to the archive members
+    assert "delivery.zip/delivery/Meta.csv" in caplog.text
+
+
+def test_import_zip_missing_file(tmp_path, caplog):
+    path = tmp_path / "delivery.zip"
+    with zipfile.ZipFile(path, "w") as archive:
+        archive.write(os.path.join(EXAMPLE_PATH, "Knooppunt.csv"), "Knooppunt.csv")
+    hydx = import_hydx(str(path))
+    assert len(hydx.connection_nodes) == 85
+    assert "could not be found" in caplog.text
+    assert "Verbinding.csv" in caplog.text
+
+
+def test_import_compressed_files(tmp_path):
+    zstandard = pytest.importorskip("zstandard")
+    for name in os.listdir(EXAMPLE_PATH):
+        with open(os.path.join(EXAMPLE_PATH, name), "rb") as f:
+            content = f.read()
+        if name == "Verbinding.csv":
+            name, content = name + ".zst", zstandard.compress(content)
+        elif name == "Knooppunt.csv":
+            name, content = name + ".gz", gzip.compress(content)
+        (tmp_path / name).write_bytes(content)
+    assert_same_import(str(tmp_path))
+
+
+def test_fingerprint_and_diff_zip(zip_path):
+    assert fingerprint_files(str(zip_path)) == fingerprint_files(EXAMPLE_PATH)
+    assert not diff_hydx(EXAMPLE_PATH, str(zip_path))
+
+
+def test_open_source_missing_directory(tmp_path):
+    with open_source(str(tmp_path / "missing")) as source:
+        assert source.find("Knooppunt.csv") is None
+
+
+def test_get_log_dir(zip_path):
+    assert get_log_dir(str(zip_path)) == str(zip_path.parent)
+    assert get_log_dir(EXAMPLE_PATH) == os.path.abspath(EXAMPLE_PATH)
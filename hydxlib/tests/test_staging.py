@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+"""Tests for staging.py"""
+import logging
+import sys
+
+import pytest
+from sqlalchemy import text
+
+from hydxlib.staging import get_peak_memory, staging_database
+
+
+def test_staging_database_flushes_to_disk(threedi_db, caplog):
+    caplog.set_level(logging.INFO, logger="hydxlib.staging")
+    with staging_database(threedi_db) as staging_db:
+        assert staging_db is not threedi_db
+        with staging_db.session_scope() as session:
+            session.execute(text("CREATE TABLE staged (id INTEGER)"))
+    assert threedi_db.has_table("staged")
+    if sys.platform != "win32":
+        assert "Peak memory use while staging" in caplog.text
+
+
+@pytest.mark.skipif(sys.platform == "win32", reason="no resource module")
+def test_get_peak_memory():
+    # the interpreter alone takes more than a MiB
+    assert get_peak_memory() > 2**20
+
+
+def test_staging_database_error_leaves_file_untouched(threedi_db):
+    try:
+        with staging_database(threedi_db) as staging_db:
+            with staging_db.session_scope() as session:
+                session.execute(text("CREATE TABLE staged (id INTEGER)"))
+            raise RuntimeError("export failed")
+    except RuntimeError:
+        pass
+    assert not threedi_db.has_table("staged")
+
+
+def test_staging_database_too_large(threedi_db, caplog):
+    with staging_database(threedi_db, max_size=0) as staging_db:
+        assert staging_db is threedi_db
+    assert "too large for in-memory staging" in caplog.text
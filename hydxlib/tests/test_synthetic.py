@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+"""Tests for synthetic.py"""
+import pytest
+
+from hydxlib.importer import import_hydx
+from hydxlib.synthetic import generate_hydx, get_system_sizes
+
+
+def test_get_system_sizes():
+    assert get_system_sizes(2500, 1000) == [1000, 1000, 500]
+    assert get_system_sizes(2002, 1000) == [1000, 1002]
+    assert get_system_sizes(10, 1000) == [10]
+
+
+def test_get_system_sizes_too_small():
+    with pytest.raises(ValueError):
+        get_system_sizes(3)
+
+
+def test_generate_hydx(tmp_path, caplog):
+    counts = generate_hydx(tmp_path, 250, system_size=100)
+    hydx = import_hydx(tmp_path)
+
+    assert counts["Knooppunt.csv"] == len(hydx.connection_nodes) == 250
+    assert counts["Verbinding.csv"] == len(hydx.connections)
+    assert counts["Kunstwerk.csv"] == len(hydx.structures)
+    assert counts["Oppervlak.csv"] == len(hydx.surfaces)
+    assert len({node.identificatierioolstelsel for node in hydx.connection_nodes}) == 3
+    # an outlet, a pump and a weir per system, one orifice for the first system
+    assert counts["Kunstwerk.csv"] == 3 * 3 + 1
+    assert "ERROR" not in caplog.text
+
+
+def test_generate_hydx_deterministic(tmp_path):
+    generate_hydx(tmp_path / "a", 100, seed=1)
+    generate_hydx(tmp_path / "b", 100, seed=1)
+    generate_hydx(tmp_path / "c", 100, seed=2)
+    for csvfilename in ("Knooppunt.csv", "Verbinding.csv", "Oppervlak.csv"):
+        a = (tmp_path / "a" / csvfilename).read_text()
+        assert a == (tmp_path / "b" / csvfilename).read_text()
+    assert a != (tmp_path / "c" / "Oppervlak.csv").read_text()
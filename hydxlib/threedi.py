@@ -12,7 +12,9 @@ from threedi_schema.domain.constants import (
     SurfaceInclinationType,
 )
 
+from . import diagnostics
 from .hydx import Profile
+from .report import stage
 
 logger = logging.getLogger(__name__)
 
@@ -118,8 +120,14 @@ def get_mapping_value(mapping, hydx_value, record_code, name_for_logging):
     if hydx_value in mapping:
         return mapping[hydx_value]
     else:
-        logger.error(
-            "%s has an unknown %s: %s", record_code, name_for_logging, hydx_value
+        diagnostics.error(
+            logger,
+            "unknown-value",
+            "%s has an unknown %s: %s",
+            record_code,
+            name_for_logging,
+            hydx_value,
+            record=record_code,
         )
         return None
 
@@ -150,11 +158,14 @@ def get_cross_section_details_tpz(
             height = f"0 {h} {h}"
             width = f"{w} {w + 2 * h} 0"
         else:
-            logger.error(
+            diagnostics.error(
+                logger,
+                "undefined-profile-width",
                 "%s has an undefined %s.width: %s",
                 record_code,
                 name_for_logging,
                 hydx_profile.vormprofiel,
+                record=record_code,
             )
             width = ""
             height = ""
@@ -215,19 +226,25 @@ def get_cross_section_details(hydx_profile, record_code, name_for_logging):
         # Unknown/missing shape: fall back to scalar mm fields for width/height
         width = transform_unit_mm_to_m(hydx_profile.breedte_diameterprofiel)
         height = transform_unit_mm_to_m(hydx_profile.hoogteprofiel)
-        logger.warning(
+        diagnostics.warning(
+            logger,
+            "unknown-profile-shape",
             "%s has an unknown %s: %s",
             record_code,
             name_for_logging,
             hydx_profile.vormprofiel,
+            record=record_code,
         )
 
     if not width:
-        logger.error(
+        diagnostics.error(
+            logger,
+            "undefined-profile-width",
             "%s has an undefined %s.width: %s",
             record_code,
             name_for_logging,
             hydx_profile.vormprofiel,
+            record=record_code,
         )
 
     return {
@@ -243,8 +260,9 @@ class Threedi:
     def __init__(self):
         pass
 
-    def import_hydx(self, hydx):
+    def clear(self):
         self.connection_nodes = []
+        self._connection_node_codes = set()
         self.connections = []
         self.pumps = []
         self.weirs = []
@@ -255,16 +273,65 @@ class Threedi:
         self.outlets = []
         self.cross_sections = []
 
-        for connection_node in hydx.connection_nodes:
-            check_if_element_is_created_with_same_code(
-                connection_node.identificatieknooppuntofverbinding,
-                self.connection_nodes,
-                "Connection node",
+    def import_hydx(self, hydx, workers=None):
+        """Convert a Hydx instance
+
+        With workers > 1, the sewerage systems are converted in parallel
+        shards, see shards.py; the result is the same.
+        """
+        if workers is not None and workers > 1:
+            from .shards import import_hydx_sharded
+
+            return import_hydx_sharded(self, hydx, workers)
+
+        self.clear()
+        with stage(
+            "convert connection_nodes", len(hydx.connection_nodes)
+        ) as conversion:
+            for connection_node in hydx.connection_nodes:
+                self.convert_connection_node(connection_node)
+            conversion.records_out = len(self.connection_nodes)
+
+        with stage("convert profiles", len(hydx.profiles)) as conversion:
+            self.convert_profiles(hydx.profiles)
+            conversion.records_out = len(self.cross_sections)
+
+        with stage("convert connections", len(hydx.connections)) as conversion:
+            for connection in hydx.connections:
+                self.convert_connection(connection, hydx.structures)
+            conversion.records_out = (
+                len(self.pipes) + len(self.pumps) + len(self.weirs) + len(self.orifices)
             )
-            self.add_connection_node(connection_node)
 
+        with stage("convert surfaces", len(hydx.surfaces)) as conversion:
+            surface_nr = 1
+            for surface in hydx.surfaces:
+                self.add_impervious_surface_from_surface(surface, surface_nr)
+                surface_nr = surface_nr + 1
+            conversion.records_out = len(self.impervious_surfaces)
+
+        surface_count = len(self.impervious_surfaces)
+        with stage("convert discharges", len(hydx.discharges)) as conversion:
+            for discharge in hydx.discharges:
+                if self.convert_discharge(discharge, hydx.variations, surface_nr):
+                    surface_nr = surface_nr + 1
+            conversion.records_out = len(self.impervious_surfaces) - surface_count
+
+        with stage("convert outlets", len(hydx.structures)) as conversion:
+            self.convert_outlets(hydx.structures)
+            conversion.records_out = len(self.outlets)
+
+    def convert_connection_node(self, connection_node):
+        check_if_element_is_created_with_same_code(
+            connection_node.identificatieknooppuntofverbinding,
+            self.connection_nodes,
+            "Connection node",
+        )
+        self.add_connection_node(connection_node)
+
+    def convert_profiles(self, hydx_profiles):
         self.add_cross_section(get_hydx_default_profile())
-        for hydx_profile in hydx.profiles:
+        for hydx_profile in hydx_profiles:
             check_if_element_is_created_with_same_code(
                 hydx_profile.identificatieprofieldefinitie,
                 self.cross_sections,
@@ -272,101 +339,122 @@ class Threedi:
             )
             self.add_cross_section(hydx_profile)
 
-        for connection in hydx.connections:
-            check_if_element_is_created_with_same_code(
-                connection.identificatieknooppuntofverbinding,
-                self.connections,
-                "Connection",
-            )
-            if connection.typeverbinding in ["GSL", "OPL", "ITR"]:
-                material = None
-                if connection.identificatieprofieldefinitie is None:
-                    logger.error(
-                        "Verbinding %r has no profile defined",
+    def convert_connection(self, connection, structures, display_name=None):
+        """Add a pipe or structure, display_name is computed if not given"""
+        check_if_element_is_created_with_same_code(
+            connection.identificatieknooppuntofverbinding,
+            self.connections,
+            "Connection",
+        )
+        if connection.typeverbinding in ["GSL", "OPL", "ITR"]:
+            material = None
+            if connection.identificatieprofieldefinitie is None:
+                diagnostics.error(
+                    logger,
+                    "missing-profile",
+                    "Verbinding %r has no profile defined",
+                    connection.identificatieknooppuntofverbinding,
+                    record=connection.identificatieknooppuntofverbinding,
+                )
+                linkedprofile = None
+            else:
+                linkedprofile = self.find_cross_section(
+                    connection.identificatieprofieldefinitie
+                )
+                if linkedprofile is None:
+                    diagnostics.error(
+                        logger,
+                        "unknown-profile",
+                        "Profile %r does not exist for verbinding %r",
+                        connection.identificatieprofieldefinitie,
                         connection.identificatieknooppuntofverbinding,
+                        record=connection.identificatieknooppuntofverbinding,
                     )
-                    linkedprofile = None
                 else:
-                    linkedprofile = self.find_cross_section(
-                        connection.identificatieprofieldefinitie
-                    )
-                    if linkedprofile is None:
-                        logger.error(
-                            "Profile %r does not exist for verbinding %r",
-                            connection.identificatieprofieldefinitie,
-                            connection.identificatieknooppuntofverbinding,
-                        )
-                    else:
-                        material = linkedprofile["material"]
-                if linkedprofile:
-                    profile_is_closed = is_closed(linkedprofile)
-                    if connection.typeverbinding == "OPL" and profile_is_closed:
-                        try:
-                            make_open(linkedprofile)
-                        except ValueError:
-                            logger.error(
-                                "Verbinding %r is open (OPL) but uses a closed profiel (%r)",
-                                connection.identificatieknooppuntofverbinding,
-                                connection.identificatieprofieldefinitie,
-                            )
-                    elif connection.typeverbinding != "OPL" and not profile_is_closed:
-                        logger.error(
-                            "Verbinding %r is closed but uses an open profiel (%r)",
+                    material = linkedprofile["material"]
+            if linkedprofile:
+                profile_is_closed = is_closed(linkedprofile)
+                if connection.typeverbinding == "OPL" and profile_is_closed:
+                    try:
+                        make_open(linkedprofile)
+                    except ValueError:
+                        diagnostics.error(
+                            logger,
+                            "closed-profile-for-open-connection",
+                            "Verbinding %r is open (OPL) but uses a closed profiel (%r)",
                             connection.identificatieknooppuntofverbinding,
                             connection.identificatieprofieldefinitie,
+                            record=connection.identificatieknooppuntofverbinding,
                         )
-                self.add_pipe(connection, material)
-            elif connection.typeverbinding in ["PMP", "OVS", "DRL"]:
-                linkedstructures = [
-                    structure
-                    for structure in hydx.structures
-                    if structure.identificatieknooppuntofverbinding
-                    == connection.identificatieknooppuntofverbinding
-                ]
-
-                if len(linkedstructures) > 1:
-                    logger.error(
-                        "Only first structure information is used to create a structure for connection %r",
+                elif connection.typeverbinding != "OPL" and not profile_is_closed:
+                    diagnostics.error(
+                        logger,
+                        "open-profile-for-closed-connection",
+                        "Verbinding %r is closed but uses an open profiel (%r)",
                         connection.identificatieknooppuntofverbinding,
+                        connection.identificatieprofieldefinitie,
+                        record=connection.identificatieknooppuntofverbinding,
                     )
+            self.add_pipe(connection, material, display_name)
+        elif connection.typeverbinding in ["PMP", "OVS", "DRL"]:
+            linkedstructures = [
+                structure
+                for structure in structures
+                if structure.identificatieknooppuntofverbinding
+                == connection.identificatieknooppuntofverbinding
+            ]
 
-                if len(linkedstructures) == 0:
-                    logger.error(
-                        "Structure does not exist for connection %r",
-                        connection.identificatieknooppuntofverbinding,
-                    )
-                else:
-                    self.add_structure(connection, linkedstructures[0])
-            else:
-                logger.error(
-                    'The following "typeverbinding" is not recognized by 3Di exporter: %s',
-                    connection.typeverbinding,
+            if len(linkedstructures) > 1:
+                diagnostics.error(
+                    logger,
+                    "multiple-structures",
+                    "Only first structure information is used to create a structure for connection %r",
+                    connection.identificatieknooppuntofverbinding,
+                    record=connection.identificatieknooppuntofverbinding,
                 )
 
-        surface_nr = 1
-        for surface in hydx.surfaces:
-            self.add_impervious_surface_from_surface(surface, surface_nr)
-            surface_nr = surface_nr + 1
-
-        for discharge in hydx.discharges:
-            linkedvariations = None
-            linkedvariations = [
-                variation
-                for variation in hydx.variations
-                if variation.verloopidentificatie == discharge.verloopidentificatie
-            ]
-            if len(linkedvariations) == 0 and discharge.afvoerendoppervlak is None:
-                logger.error(
-                    "The following discharge object misses information to be used by 3Di exporter: %s",
-                    discharge.identificatieknooppuntofverbinding,
+            if len(linkedstructures) == 0:
+                diagnostics.error(
+                    logger,
+                    "missing-structure",
+                    "Structure does not exist for connection %r",
+                    connection.identificatieknooppuntofverbinding,
+                    record=connection.identificatieknooppuntofverbinding,
                 )
             else:
-                self.add_impervious_surface_from_discharge(
-                    discharge, surface_nr, linkedvariations
-                )
-                surface_nr = surface_nr + 1
+                self.add_structure(connection, linkedstructures[0], display_name)
+        else:
+            diagnostics.error(
+                logger,
+                "unknown-connection-type",
+                'The following "typeverbinding" is not recognized by 3Di exporter: %s',
+                connection.typeverbinding,
+                record=connection.identificatieknooppuntofverbinding,
+            )
+
+    def convert_discharge(self, discharge, variations, surface_nr):
+        """Add an impervious surface, return whether surface_nr is used"""
+        linkedvariations = [
+            variation
+            for variation in variations
+            if variation.verloopidentificatie == discharge.verloopidentificatie
+        ]
+        if len(linkedvariations) == 0 and discharge.afvoerendoppervlak is None:
+            diagnostics.error(
+                logger,
+                "incomplete-discharge",
+                "The following discharge object misses information to be used by 3Di exporter: %s",
+                discharge.identificatieknooppuntofverbinding,
+                record=discharge.identificatieknooppuntofverbinding,
+            )
+            return False
+        self.add_impervious_surface_from_discharge(
+            discharge, surface_nr, linkedvariations
+        )
+        return True
 
-        for structure in hydx.structures:
+    def convert_outlets(self, structures):
+        for structure in structures:
             if structure.typekunstwerk == "UIT":
                 self.add_1d_boundary(structure)
 
@@ -403,7 +491,7 @@ class Threedi:
             ),
         }
         # In case of duplicate connection node, the manhole properties should not be defined
-        if connection_node["code"] in [n["code"] for n in self.connection_nodes]:
+        if connection_node["code"] in self._connection_node_codes:
             manhole_properties = [
                 "manhole_surface_level",
                 "bottom_level",
@@ -413,11 +501,13 @@ class Threedi:
                 connection_node[prop] = None
             connection_node["visualisation"] = -1
         self.connection_nodes.append(connection_node)
+        self._connection_node_codes.add(connection_node["code"])
 
-    def add_pipe(self, hydx_connection, material):
+    def add_pipe(self, hydx_connection, material, display_name=None):
         self.check_if_nodes_of_connection_exists(hydx_connection)
         combined_display_name_string = (
-            self.get_connection_display_names_from_connection_nodes(hydx_connection)
+            display_name
+            or self.get_connection_display_names_from_connection_nodes(hydx_connection)
         )
 
         pipe = {
@@ -439,11 +529,12 @@ class Threedi:
         }
         self.pipes.append(pipe)
 
-    def add_structure(self, hydx_connection, hydx_structure):
+    def add_structure(self, hydx_connection, hydx_structure, display_name=None):
         """Add hydx.structure and hydx.connection into threedi.pumps"""
         self.check_if_nodes_of_connection_exists(hydx_connection)
         combined_display_name_string = (
-            self.get_connection_display_names_from_connection_nodes(hydx_connection)
+            display_name
+            or self.get_connection_display_names_from_connection_nodes(hydx_connection)
         )
 
         if hydx_structure.typekunstwerk == "PMP":
@@ -631,10 +722,7 @@ class Threedi:
     def append_and_map_surface(
         self, surface, connection_node_id, surface_nr, node_code=None
     ):
-        connection_node_codes = [
-            connection_node["code"] for connection_node in self.connection_nodes
-        ]
-        if connection_node_id in connection_node_codes:
+        if connection_node_id in self._connection_node_codes:
             node_code = connection_node_id
         if node_code is None:
             for pipe in self.pipes:
@@ -643,10 +731,13 @@ class Threedi:
                     break
 
         if node_code is None:
-            logger.error(
+            diagnostics.error(
+                logger,
+                "missing-surface-node",
                 "Connection node %r could not be found for surface %r",
                 connection_node_id,
                 surface["code"],
+                record=surface["code"],
             )
             # self.impervious_surfaces.append(surface)
             return
@@ -665,20 +756,23 @@ class Threedi:
         code1 = connection.identificatieknooppunt1
         code2 = connection.identificatieknooppunt2
 
-        connection_node_list = [
-            connection_node["code"] for connection_node in self.connection_nodes
-        ]
-        if code1 is not None and code1 not in connection_node_list:
-            logger.error(
+        if code1 is not None and code1 not in self._connection_node_codes:
+            diagnostics.error(
+                logger,
+                "missing-start-node",
                 "Start connection node %r could not be found for record %r",
                 code1,
                 connection_code,
+                record=connection_code,
             )
-        elif code2 is not None and code2 not in connection_node_list:
-            logger.error(
+        elif code2 is not None and code2 not in self._connection_node_codes:
+            diagnostics.error(
+                logger,
+                "missing-end-node",
                 "End connection node %r could not be found for record %r",
                 code2,
                 connection_code,
+                record=connection_code,
             )
 
     def get_connection_display_names_from_connection_nodes(self, connection):
@@ -708,10 +802,13 @@ class Threedi:
     def get_discharge_coefficients(self, hydx_connection, hydx_structure):
         if hydx_connection.stromingsrichting not in ["GSL", "1_2", "2_1", "OPN"]:
             hydx_connection.stromingsrichting = "OPN"
-            logger.error(
+            diagnostics.error(
+                logger,
+                "unknown-flow-direction",
                 'Flow direction is not recognized for %r with record %r, "OPN" is assumed',
                 hydx_connection.typeverbinding,
                 hydx_connection.identificatieknooppuntofverbinding,
+                record=hydx_connection.identificatieknooppuntofverbinding,
             )
         if hydx_connection.stromingsrichting == "GSL":
             hydx_connection.discharge_coefficient_positive = 0
@@ -789,10 +886,13 @@ def check_if_element_is_created_with_same_code(
 ):
     added_elements = [element["code"] for element in created_elements]
     if checked_element in added_elements:
-        logger.error(
+        diagnostics.error(
+            logger,
+            "duplicate-code",
             "Multiple elements %r are created with the same code %r",
             element_type,
             checked_element,
+            record=checked_element,
         )
 
 
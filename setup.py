@@ -18,9 +18,11 @@ def get_version():
 
 install_requires = [
     "sqlalchemy",
+    "numpy",
     "threedi-schema>=0.301",
     "pyproj>=3",
     "geoalchemy2[shapely]",
+    "shapely>=2",
 ]
 
 tests_require = ["pytest", "pytest-cov"]
@@ -43,6 +45,11 @@ setup(
     install_requires=install_requires,
     python_requires=">=3.9",
     tests_require=tests_require,
-    extras_require={"test": tests_require},
+    extras_require={
+        "test": tests_require,
+        "geoparquet": ["pyarrow"],
+        "zstd": ["zstandard"],
+        "benchmark": tests_require + ["pytest-benchmark"],
+    },
     entry_points={"console_scripts": ["run-hydxlib = hydxlib.scripts:main"]},
 )